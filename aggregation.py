@@ -0,0 +1,50 @@
+import numpy as np
+
+# A rule says how many of a rider's weeks count: it maps the number of weeks to
+# the number of best (lowest) weeks that are summed. best_k applies a rule to the
+# riders×weeks points matrix; season_state applies the same rules incrementally.
+# A fixed number of weeks is simply ``lambda n_weeks: 5``.
+
+def best_half(n_weeks):
+    """The best half of the weeks, at least one week (individual klassement)."""
+    return max(1, n_weeks // 2) if n_weeks else 0
+
+def drop_worst(n_weeks, n=1):
+    """All weeks but the n worst, keeping at least one week (regelmatigheidscriterium)."""
+    return max(n_weeks - n, min(n_weeks, 1))
+
+def best_k(points, k):
+    """Sum of the k lowest values per rider (all of them when there are fewer weeks)."""
+    points = np.asarray(points)
+    n_weeks = points.shape[1]
+    k = min(k, n_weeks)
+    if k <= 0:
+        return np.zeros(points.shape[0], dtype=points.dtype)
+    if k == n_weeks:
+        return points.sum(axis=1)
+    return np.partition(points, k - 1, axis=1)[:, :k].sum(axis=1)
+
+def aggregate(points, rule):
+    """Apply ``rule`` to a riders×weeks points matrix."""
+    points = np.asarray(points)
+    return best_k(points, rule(points.shape[1]))
+
+def aggregate_periods(df, periods, rule):
+    """Apply ``rule`` to several week selections of ``df`` at once.
+
+    ``periods`` maps an output name to its week columns, e.g. ``{'Totaal': weeks,
+    '1e Periode': first, '2e Periode': second}``. The week columns are turned
+    into one matrix and every period is a column slice of it. A period without
+    weeks totals 0.
+    """
+    all_weeks = list(dict.fromkeys(col for cols in periods.values() for col in cols))
+    matrix = df[all_weeks].to_numpy() if all_weeks else np.zeros((len(df), 0))
+    position = {col: i for i, col in enumerate(all_weeks)}
+
+    totals = {}
+    for name, cols in periods.items():
+        if cols:
+            totals[name] = aggregate(matrix[:, [position[col] for col in cols]], rule)
+        else:
+            totals[name] = 0
+    return totals
@@ -0,0 +1,216 @@
+import argparse
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+from input_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+BACKUP_ROOT = "output_backups"
+OBJECTS_DIR = os.path.join(BACKUP_ROOT, "objects")
+INDEX_DB = os.path.join(BACKUP_ROOT, "index.sqlite")
+# Backups made before the store existed: one directory per run with full copies
+LEGACY_ROSTER_BACKUP_DIR = "Deelnemers/backups"
+
+# Every file is stored once as a gzip blob named after the SHA-256 of its
+# content; a run only adds one manifest row per file it backs up. A file that did
+# not change since an earlier run costs a hash and an index row, no copy.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    run TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    week INTEGER,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (run, name)
+);
+CREATE INDEX IF NOT EXISTS snapshots_source ON snapshots (source, week, run);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY
+);
+"""
+LEGACY_MIGRATION = "legacy_backups"
+
+# File name prefixes of the legacy backups and the source file they are a copy of
+LEGACY_SOURCES = [
+    ("team_klassement_2025_DAM_only", "team_klassement_2025_DAM_only.xlsx"),
+    ("team_klassement_2025", "team_klassement_2025.xlsx"),
+    ("klassement_totaal_2025", "klassement_totaal_2025.xlsx"),
+    ("klassement_2025", "klassement_2025.xlsx"),
+    ("regelmatigheids_criterium", "klassement_2025.xlsx"),
+    ("wedstrijd_data_2025", "wedstrijd_data_2025.xlsx"),
+    ("deelnemerslijst_2025", "deelnemerslijst 2025.xlsx"),
+]
+LEGACY_WEEK = re.compile(r"(?:_week_|criterium_)(\d+)\.xlsx$")
+LEGACY_RUN = re.compile(r"(\d{8}_\d{6})\.xlsx$")
+
+def new_run_id():
+    """Identifier of a backup run; sorts in chronological order."""
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+def connect(db_path=None):
+    """Open the backup index."""
+    db_path = db_path or INDEX_DB
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+def blob_path(sha):
+    return os.path.join(OBJECTS_DIR, sha[:2], f"{sha}.gz")
+
+def store_blob(path):
+    """Store the content of ``path`` once and return its SHA-256."""
+    sha = file_sha256(path)
+    target = blob_path(sha)
+    if not os.path.isfile(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, target)
+    return sha
+
+def add_snapshot(run, source_path, name=None, week=None, db_path=None):
+    """Back up ``source_path`` as ``name`` in the manifest of ``run``; returns the blob path.
+
+    ``week`` is the competition week the file belongs to, if any, so the
+    snapshot can be found again with ``snapshot_for_week``.
+    """
+    sha = store_blob(source_path)
+    with closing(connect(db_path)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO snapshots (run, name, source, week, sha256, size) VALUES (?, ?, ?, ?, ?, ?)",
+            (run, name or os.path.basename(source_path), os.path.basename(source_path), week,
+             sha, os.path.getsize(source_path)),
+        )
+    return blob_path(sha)
+
+def run_manifest(run, db_path=None):
+    """The files backed up in ``run`` as ``{name: {source, week, sha256, size}}``."""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT name, source, week, sha256, size FROM snapshots WHERE run = ? ORDER BY rowid", (run,)
+        ).fetchall()
+    return {name: {'source': source, 'week': week, 'sha256': sha, 'size': size}
+            for name, source, week, sha, size in rows}
+
+def list_snapshots(source, db_path=None):
+    """Every backup of the file named ``source``, oldest run first."""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT run, name, source, week, sha256, size FROM snapshots WHERE source = ? ORDER BY run, rowid",
+            (source,),
+        ).fetchall()
+    return [dict(zip(('run', 'name', 'source', 'week', 'sha256', 'size'), row)) for row in rows]
+
+def _snapshot(where, params, db_path):
+    with closing(connect(db_path)) as conn:
+        row = conn.execute(
+            f"SELECT run, name, source, week, sha256, size FROM snapshots WHERE {where} "
+            "ORDER BY run DESC, rowid DESC LIMIT 1",
+            params,
+        ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('run', 'name', 'source', 'week', 'sha256', 'size'), row))
+
+def latest_snapshot(source, db_path=None):
+    """The most recent backup of the file named ``source`` (a basename), or None."""
+    return _snapshot("source = ?", (source,), db_path)
+
+def snapshot_for_week(source, week, db_path=None):
+    """The most recent backup of ``source`` made for competition week ``week``, or None."""
+    return _snapshot("source = ? AND week = ?", (source, int(week)), db_path)
+
+def open_snapshot(snapshot):
+    """Binary file object with the content of a snapshot returned by the lookups."""
+    return gzip.open(blob_path(snapshot['sha256']), "rb")
+
+def restore_snapshot(snapshot, dest_path):
+    """Write the content of a snapshot to ``dest_path``."""
+    with open_snapshot(snapshot) as src, open(dest_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    return dest_path
+
+def _legacy_files():
+    """(run, name, path) of every full copy in the old backup directories."""
+    if os.path.isdir(BACKUP_ROOT):
+        for run in sorted(os.listdir(BACKUP_ROOT)):
+            run_dir = os.path.join(BACKUP_ROOT, run)
+            if re.fullmatch(r"\d{8}_\d{6}", run) and os.path.isdir(run_dir):
+                for name in sorted(os.listdir(run_dir)):
+                    yield run, name, os.path.join(run_dir, name)
+    if os.path.isdir(LEGACY_ROSTER_BACKUP_DIR):
+        for name in sorted(os.listdir(LEGACY_ROSTER_BACKUP_DIR)):
+            match = LEGACY_RUN.search(name)
+            if match:
+                yield match.group(1), name, os.path.join(LEGACY_ROSTER_BACKUP_DIR, name)
+
+def _legacy_source(name):
+    if not name.endswith('.xlsx'):
+        return None
+    return next((src for prefix, src in LEGACY_SOURCES if name.startswith(prefix)), None)
+
+def import_legacy_backups(db_path=None, remove=False):
+    """Copy the backups made before the store existed into it, once; returns how many were copied.
+
+    The entry points call this in the main process before any lookup. The import
+    holds an exclusive lock on the index, so a second process waits and then
+    finds it done. The old full copies are left in place unless ``remove`` is set
+    (``python backup_store.py --remove-originals``).
+    """
+    imported = 0
+    with closing(connect(db_path)) as conn, conn:
+        conn.execute("BEGIN EXCLUSIVE")
+        if conn.execute("SELECT 1 FROM migrations WHERE name = ?", (LEGACY_MIGRATION,)).fetchone() is None:
+            for run, name, path in _legacy_files():
+                source = _legacy_source(name)
+                if source is None:
+                    continue
+                week = LEGACY_WEEK.search(name)
+                conn.execute(
+                    "INSERT OR IGNORE INTO snapshots (run, name, source, week, sha256, size) VALUES (?, ?, ?, ?, ?, ?)",
+                    (run, name, source, int(week.group(1)) if week else None, store_blob(path), os.path.getsize(path)),
+                )
+                imported += 1
+            conn.execute("INSERT INTO migrations (name) VALUES (?)", (LEGACY_MIGRATION,))
+    if imported:
+        logger.info(f"📥 Copied {imported} existing backups into {INDEX_DB}")
+    if remove:
+        remove_legacy_backups(db_path)
+    return imported
+
+def remove_legacy_backups(db_path=None):
+    """Delete the old full copies whose content and index row are in the store; returns how many."""
+    with closing(connect(db_path)) as conn:
+        stored = {(run, name): sha for run, name, sha in conn.execute("SELECT run, name, sha256 FROM snapshots")}
+    removed = set()
+    for run, name, path in _legacy_files():
+        sha = stored.get((run, name))
+        if sha is not None and os.path.isfile(blob_path(sha)) and file_sha256(path) == sha:
+            os.remove(path)
+            removed.add(path)
+    # Run directories that held nothing else
+    for run_dir in {os.path.dirname(path) for path in removed} - {LEGACY_ROSTER_BACKUP_DIR}:
+        if not os.listdir(run_dir):
+            os.rmdir(run_dir)
+    if removed:
+        logger.info(f"🗑️ Removed {len(removed)} old backups that are in {INDEX_DB}")
+    return len(removed)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Copy the backups made before the store existed into it.")
+    parser.add_argument('--remove-originals', action='store_true',
+                        help="then delete the old copies in output_backups/<run>/ and Deelnemers/backups "
+                             "whose content is in the store")
+    args = parser.parse_args()
+    import_legacy_backups(remove=args.remove_originals)
@@ -0,0 +1,248 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from synthetic_season import generate_season, SEASON_DIR
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# The benchmark runs the weekly update on a synthetic season in a scratch
+# directory. Weeks 1..n-1 are built with replay.py (or week by week with
+# --weekly), then the last week runs through the stage graph of generate_all.py
+# with every stage timed. The steps inside the stages (parsing, points,
+# aggregation, ranking, Excel write) are timed separately on the last week's
+# data; they are repeated and the fastest run counts. A report of an earlier
+# run can be given as baseline to catch regressions.
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# riders, weeks
+PRESETS = {
+    'small': (200, 10),
+    'medium': (2000, 20),
+    'large': (10000, 30),
+    'season': (50000, 52),
+}
+# Stages that need the network; the benchmark puts the input files in place itself
+SKIPPED_STAGES = ('deelnemers', 'mail', 'send_mail')
+# A step counts as slower than the baseline beyond this factor and this many seconds
+TOLERANCE = 0.25
+NOISE_SECONDS = 0.05
+
+def _timed(func, timings, name):
+    def run(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[name] = time.perf_counter() - start
+    return run
+
+def timed_stages(stages, timings):
+    """The stages with the run time of each recorded in ``timings`` as ``stage:<name>``."""
+    return [stage._replace(func=_timed(stage.func, timings, f"stage:{stage.name}")) for stage in stages]
+
+def _best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _put_week(finish_path, roster_path):
+    from utils import DEELNEMERS_FILE, RESULT_FILE
+    shutil.copyfile(roster_path, DEELNEMERS_FILE)
+    shutil.copyfile(finish_path, RESULT_FILE)
+
+def run_week(week, finish_path, roster_path):
+    """Run the weekly update for ``week`` on the given files; returns the stage timings and the run context."""
+    from pipeline import build_stage_graph, run_stage_graph
+    from utils import backup_deelnemers_file, set_current_backup_run
+
+    _put_week(finish_path, roster_path)
+    # Week runs follow each other within a second: number them instead of a timestamp
+    set_current_backup_run(f"bench_{week:04d}")
+    timings = {}
+    stages = timed_stages([stage for stage in build_stage_graph() if stage.name not in SKIPPED_STAGES], timings)
+    context = {'is_second_period_started': False, 'write_stage_workbooks': False, 'force': True}
+    start = time.perf_counter()
+    run_stage_graph(stages, context, parallel=False)
+    timings['week'] = time.perf_counter() - start
+    # As generate_all.py does after a run: the roster the next week's class changes are found against
+    backup_deelnemers_file()
+    return timings, context
+
+def time_steps(finish_path, roster_path, context, repeat):
+    """Time the steps inside the stages on the data of the last week."""
+    from aggregation import aggregate_periods
+    from excel_export import write_workbook
+    from generate_klassement import TOTAL_RULE
+    from ranking import add_placings, PLACING_CATEGORIES
+    from season_state import season_periods
+    from utils import calculate_points, load_template_column_order, parse_deelnemers, parse_result
+
+    deelnemers = parse_deelnemers(roster_path)
+    uitslag = parse_result(finish_path)
+    sheet = context['KLASSEMENT']
+    week_cols = sorted((col for col in sheet.columns if str(col).isdigit()), key=int)
+    first, second = season_periods(week_cols, False)
+    periods = {'Totaal': week_cols, '1e Periode': first, '2e Periode': second}
+    ranked = sheet.drop(columns=[col for col in sheet.columns if str(col).startswith('Plaats')])
+
+    def rank():
+        df = add_placings(ranked, 'Klasse', 'Plaats Klasse', score='Totaal', tie='min')
+        df = df.sort_values(by=['Klasse', 'Totaal'])
+        return add_placings(df, 'Cat.', 'Plaats {}', groups=PLACING_CATEGORIES)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        steps = {
+            'parse:roster': lambda: parse_deelnemers(roster_path),
+            'parse:result': lambda: parse_result(finish_path),
+            'parse:template': load_template_column_order,
+            'points': lambda: calculate_points(deelnemers, uitslag, group_by='klasse'),
+            'aggregation': lambda: aggregate_periods(sheet, periods, TOTAL_RULE),
+            'ranking': rank,
+            'excel_write': lambda: write_workbook(os.path.join(tmp_dir, "klassement.xlsx"), {'KLASSEMENT': sheet}),
+            'excel_write:combined': lambda: write_workbook(
+                os.path.join(tmp_dir, "combined.xlsx"),
+                {name: context[name] for name in ('REGELMATIGHEIDSCRITERIUM', 'KLASSEMENT', 'TEAMS STA', 'TEAMS MIXED')}
+            ),
+        }
+        return {name: _best_of(step, repeat) for name, step in steps.items()}
+
+def run_benchmark(riders, weeks, classes=6, teams=None, seed=0, repeat=3, weekly=False, workdir=None):
+    """Benchmark one season size; returns its entry of the report.
+
+    The season is generated in ``workdir`` (a temporary directory that is
+    removed afterwards when not given) and every file of the run is written there.
+    """
+    keep = workdir is not None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="atb_benchmark_"))
+    cwd = os.getcwd()
+    result = {
+        'label': f"{riders}x{weeks}", 'riders': riders, 'weeks': weeks, 'classes': classes,
+        'teams': teams, 'seed': seed, 'timings': {},
+    }
+    timings = result['timings']
+    try:
+        start = time.perf_counter()
+        finish_paths, roster_paths = generate_season(
+            os.path.join(workdir, SEASON_DIR), riders, weeks, classes, teams, seed
+        )
+        result['generate_seconds'] = time.perf_counter() - start
+        os.chdir(workdir)
+        # The modules resolve their files relative to the working directory
+        from utils import DEELNEMERS_FILE, RESULT_FILE, TEMPLATE_FILE
+        for path in (DEELNEMERS_FILE, RESULT_FILE, TEMPLATE_FILE):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(os.path.join(REPO_DIR, TEMPLATE_FILE), TEMPLATE_FILE)
+
+        if weekly:
+            result['weekly'] = []
+            for week in range(1, weeks):
+                week_timings, _ = run_week(week, finish_paths[week - 1], roster_paths[week - 1])
+                result['weekly'].append({'week': week, **week_timings})
+                logger.info(f"⏱️ {result['label']} week {week}: {week_timings['week']:.2f}s")
+        elif weeks > 1:
+            from replay import replay_season, season_from_files
+            from utils import backup_deelnemers_file, set_current_backup_run
+            start = time.perf_counter()
+            races, rosters = season_from_files(finish_paths[:-1], roster_paths[:-1])
+            timings['replay:parse'] = time.perf_counter() - start
+            set_current_backup_run(f"bench_{weeks - 1:04d}")
+            start = time.perf_counter()
+            replay_season(races, rosters)
+            timings['replay'] = time.perf_counter() - start
+            # The roster of the previous week, for the class changes of the last week
+            _put_week(finish_paths[-2], roster_paths[-2])
+            backup_deelnemers_file()
+
+        week_timings, context = run_week(weeks, finish_paths[-1], roster_paths[-1])
+        if weekly:
+            result['weekly'].append({'week': weeks, **week_timings})
+        timings.update(week_timings)
+        timings.update(time_steps(finish_paths[-1], roster_paths[-1], context, repeat))
+        logger.info(f"⏱️ {result['label']}: last week in {timings['week']:.2f}s")
+        return result
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(report, baseline, tolerance=TOLERANCE, noise=NOISE_SECONDS):
+    """``[(label, step, old, new)]`` of the steps that got slower than in ``baseline``."""
+    old = {entry['label']: entry['timings'] for entry in baseline['results']}
+    slower = []
+    for entry in report['results']:
+        for step, seconds in entry['timings'].items():
+            before = old.get(entry['label'], {}).get(step)
+            if before is not None and seconds > before * (1 + tolerance) and seconds - before > noise:
+                slower.append((entry['label'], step, before, seconds))
+    return slower
+
+def format_report(report):
+    """The timings of every size as a table, one column per size."""
+    table = pd.DataFrame({entry['label']: entry['timings'] for entry in report['results']})
+    return table.map(lambda seconds: f"{seconds:8.3f}s").to_string()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time every stage of the weekly update on synthetic seasons.")
+    parser.add_argument('--preset', nargs='+', choices=PRESETS, default=None,
+                        help="season sizes to run (default: small); several give a scaling curve")
+    parser.add_argument('--riders', type=int, help="riders of a custom size (with --weeks)")
+    parser.add_argument('--weeks', type=int, help="weeks of a custom size (with --riders)")
+    parser.add_argument('--classes', type=int, default=6)
+    parser.add_argument('--teams', type=int, default=None, help="number of teams (default: riders / 4)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="runs of every step; the fastest counts")
+    parser.add_argument('--weekly', action='store_true', help="run every week through the pipeline instead of a replay")
+    parser.add_argument('--report', help="write the report as JSON to this file")
+    parser.add_argument('--baseline', help="report of an earlier run; exit with 1 when a step got slower")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="allowed slowdown against the baseline (default: %(default)s)")
+    parser.add_argument('--workdir', help="keep the season and the outputs in this directory")
+    parser.add_argument('--verbose', action='store_true', help="show the log of the pipeline")
+    args = parser.parse_args()
+
+    if (args.riders is None) != (args.weeks is None):
+        parser.error("--riders and --weeks go together")
+    sizes = [PRESETS[name] for name in args.preset or ([] if args.riders else ['small'])]
+    if args.riders:
+        sizes.append((args.riders, args.weeks))
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'results': [],
+    }
+    for riders, weeks in sizes:
+        workdir = os.path.join(args.workdir, f"{riders}x{weeks}") if args.workdir else None
+        report['results'].append(run_benchmark(
+            riders, weeks, args.classes, args.teams, args.seed, args.repeat, args.weekly, workdir
+        ))
+    print(format_report(report))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(report, json.load(f), args.tolerance)
+        for label, step, before, seconds in slower:
+            print(f"⚠️ {label} {step}: {before:.3f}s -> {seconds:.3f}s")
+        sys.exit(1 if slower else 0)
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+
+from input_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+BUILD_DIR = ".cache/build"
+# Bump when the scoring changes, so every stage runs again once
+BUILD_VERSION = 1
+
+# For every stage that ran, the fingerprint of its inputs, the hashes of the
+# files it left behind and (if it returned one) its in-memory output. A stage
+# whose fingerprint and files are unchanged can be skipped and its output reused.
+
+def fingerprint(name, parts):
+    """Stable digest of a stage's name and the JSON-serialisable description of its inputs."""
+    payload = json.dumps([BUILD_VERSION, name, parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _record_path(name):
+    return os.path.join(BUILD_DIR, f"{name}.json")
+
+def _output_path(name):
+    return os.path.join(BUILD_DIR, f"{name}.pkl")
+
+def _load_record(name):
+    try:
+        with open(_record_path(name), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_current(name, key):
+    """Whether the stage last ran with fingerprint ``key`` and its files are as it left them."""
+    record = _load_record(name)
+    if record is None or record.get('key') != key:
+        return False
+    if record.get('has_output') and not os.path.isfile(_output_path(name)):
+        return False
+    return all(os.path.isfile(path) and file_sha256(path) == sha for path, sha in record['files'].items())
+
+def load_output(name):
+    """The in-memory output the stage returned when it last ran, or None."""
+    record = _load_record(name)
+    if not record or not record.get('has_output'):
+        return None
+    with open(_output_path(name), "rb") as f:
+        return pickle.load(f)
+
+def save(name, key, output, files):
+    """Record a finished stage: its fingerprint, output and the files it produced."""
+    try:
+        os.makedirs(BUILD_DIR, exist_ok=True)
+        if output is not None:
+            tmp_path = f"{_output_path(name)}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, _output_path(name))
+        record = {
+            'key': key,
+            'has_output': output is not None,
+            'files': {path: file_sha256(path) for path in files if os.path.isfile(path)},
+        }
+        tmp_path = f"{_record_path(name)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp_path, _record_path(name))
+    except OSError as e:
+        logger.warning(f"⚠️ Could not record build state of stage '{name}': {e}")
@@ -1,7 +1,11 @@
+import base64
 import imaplib
 import email
+import email.header
 import os
 import pickle
+import quopri
+import re
 from dotenv import load_dotenv
 import logging
 
@@ -13,25 +17,38 @@ load_dotenv()
 
 # Config
 # Config
-IMAP_SERVER = "imap.gmail.com"
+IMAP_SERVER = os.getenv("IMAP_SERVER", "imap.gmail.com")
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+# Plain IMAP only for a local test server
+IMAP_SSL = os.getenv("IMAP_SSL", "True").lower() == "true"
+# Seconds a connect or a read may take before the connection is given up
+IMAP_TIMEOUT = 60
 EMAIL_ACCOUNT = os.getenv("EMAIL_ACCOUNT")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 SENDER_FILTER = "seppevc@hotmail.be"
 DOWNLOAD_FOLDER = "Result"
 SAVE_AS_FILENAME = "finish.xlsx"
 LAST_ID_FILE = ".last_email_id"
+# The email whose result was saved but not yet processed: it only becomes the last
+# processed one (commit_processed_id) once the whole update succeeded, so a failed
+# run finds the same email again
+PENDING_ID_FILE = ".last_email_id.pending"
+# Exit status when there is no new result, so the rest of the run can be skipped
+NO_NEW_MAIL = 3
 
 
-# Validate required environment variables
-if not EMAIL_PASSWORD:
-    raise ValueError("EMAIL_PASSWORD environment variable is required")
-
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
 def connect_mailbox():
     """Connect to IMAP server with error handling"""
+    # Validated here, not at import, so other scripts can import the constants of this module
+    if not EMAIL_PASSWORD:
+        raise ValueError("EMAIL_PASSWORD environment variable is required")
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER, 993)
+        if IMAP_SSL:
+            mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT, timeout=IMAP_TIMEOUT)
+        else:
+            mail = imaplib.IMAP4(IMAP_SERVER, IMAP_PORT, timeout=IMAP_TIMEOUT)
         mail.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
         logger.info("✅ Successfully connected to mailbox")
         return mail
@@ -43,21 +60,49 @@ def connect_mailbox():
         raise
 
 def get_last_processed_id():
-    """Get the last processed email ID"""
+    """The ``{'uidvalidity': ..., 'uid': ...}`` of the last processed email, or None"""
     if os.path.isfile(LAST_ID_FILE):
         try:
             with open(LAST_ID_FILE, "rb") as f:
-                return pickle.load(f)
+                state = pickle.load(f)
+            # Older versions stored a message sequence number, which says nothing about new mail
+            if isinstance(state, dict) and {'uidvalidity', 'uid'} <= state.keys():
+                return state
         except Exception as e:
             logger.warning(f"⚠️ Could not read last processed ID: {e}")
     return None
 
-def set_last_processed_id(email_id):
-    """Save the last processed email ID"""
+def _save_id(path, uidvalidity, uid):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({'uidvalidity': uidvalidity, 'uid': uid}, f)
+    os.replace(tmp_path, path)
+
+def set_last_processed_id(uidvalidity, uid):
+    """Save the UIDVALIDITY of the mailbox and the UID of the last processed email"""
     try:
-        with open(LAST_ID_FILE, "wb") as f:
-            pickle.dump(email_id, f)
-        logger.info(f"📝 Updated last processed ID: {email_id}")
+        _save_id(LAST_ID_FILE, uidvalidity, uid)
+        logger.info(f"📝 Updated last processed ID: {uid} (UIDVALIDITY {uidvalidity})")
+    except Exception as e:
+        logger.error(f"❌ Could not save last processed ID: {e}")
+
+def set_pending_id(uidvalidity, uid):
+    """Remember the email whose result was saved until the update that uses it succeeded"""
+    _save_id(PENDING_ID_FILE, uidvalidity, uid)
+
+def discard_pending_id():
+    if os.path.isfile(PENDING_ID_FILE):
+        os.remove(PENDING_ID_FILE)
+
+def commit_processed_id():
+    """Mark the email of the saved result as processed; call once the update succeeded"""
+    if not os.path.isfile(PENDING_ID_FILE):
+        return
+    try:
+        os.replace(PENDING_ID_FILE, LAST_ID_FILE)
+        state = get_last_processed_id()
+        if state:
+            logger.info(f"📝 Updated last processed ID: {state['uid']} (UIDVALIDITY {state['uidvalidity']})")
     except Exception as e:
         logger.error(f"❌ Could not save last processed ID: {e}")
 
@@ -67,76 +112,180 @@ def is_excel_file(filename):
         return False
     return filename.lower().endswith(('.xlsx', '.xls'))
 
+# --- IMAP responses ---
+# A FETCH response comes from imaplib as a list of byte strings and (header,
+# literal) tuples. It is parsed into nested lists of strings (None for NIL);
+# a literal (e.g. the content of a body part) stays bytes.
+TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+LITERAL = re.compile(rb'\{(\d+)\}$')
+
+def _tokens(data):
+    for item in data:
+        if isinstance(item, tuple):
+            header, literal = item
+            yield from TOKEN.findall(LITERAL.sub(b'', header.rstrip()))
+            yield (literal,)
+        elif item:
+            yield from TOKEN.findall(item)
+
+def parse_fetch_response(data):
+    """The items of a FETCH response as nested lists"""
+    stack = [[]]
+    for token in _tokens(data):
+        if isinstance(token, tuple):
+            stack[-1].append(token[0])
+        elif token == b'(':
+            stack.append([])
+        elif token == b')':
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', token[1:-1]).decode(errors='replace'))
+        elif token.upper() == b'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token.decode(errors='replace'))
+    return stack[0]
+
+def fetch_item(data, name):
+    """The value of the ``name`` item (e.g. 'BODYSTRUCTURE') of a FETCH response, or None"""
+    for message in parse_fetch_response(data):
+        if isinstance(message, list):
+            for key, value in zip(message[::2], message[1::2]):
+                if isinstance(key, str) and key.upper().startswith(name):
+                    return value
+    return None
+
+def _pairs(values):
+    """``{KEY: value}`` of an IMAP parameter list"""
+    if not isinstance(values, list):
+        return {}
+    return {str(k).upper(): v for k, v in zip(values[::2], values[1::2])}
+
+def _decode_filename(name):
+    if isinstance(name, bytes):
+        name = name.decode(errors='replace')
+    if not isinstance(name, str):
+        return None
+    return str(email.header.make_header(email.header.decode_header(name)))
+
+def body_parts(structure, prefix=""):
+    """``(part number, part structure)`` of every leaf part of a BODYSTRUCTURE"""
+    if structure and isinstance(structure[0], list):
+        for i, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            yield from body_parts(child, f"{prefix}{i}.")
+    else:
+        yield prefix[:-1] or "1", structure
+
+def excel_attachments(structure):
+    """``(part number, filename, encoding, size)`` of the Excel attachments of a BODYSTRUCTURE"""
+    attachments = []
+    for number, part in body_parts(structure):
+        if len(part) < 7:
+            continue
+        filename = _pairs(part[2]).get('NAME')
+        # The disposition ("attachment" ("filename" ...)) is among the extension fields
+        for field in part[7:]:
+            if isinstance(field, list) and len(field) == 2 and isinstance(field[0], str) and isinstance(field[1], list):
+                filename = _pairs(field[1]).get('FILENAME', filename)
+        filename = _decode_filename(filename)
+        if is_excel_file(filename):
+            size = int(part[6]) if str(part[6]).isdigit() else 0
+            attachments.append((number, filename, str(part[5] or '7BIT').upper(), size))
+    return attachments
+
+def decode_part(payload, encoding):
+    """The content of a body part in its transfer encoding"""
+    if encoding == 'BASE64':
+        return base64.b64decode(payload)
+    if encoding == 'QUOTED-PRINTABLE':
+        return quopri.decodestring(payload)
+    return payload
+
+def _uidvalidity(mail):
+    _, values = mail.response('UIDVALIDITY')
+    if values and values[-1]:
+        return int(values[-1])
+    status, data = mail.status("inbox", "(UIDVALIDITY)")
+    match = re.search(rb'UIDVALIDITY (\d+)', data[0] or b'') if status == "OK" else None
+    return int(match.group(1)) if match else None
+
+def new_message_uids(mail, state, uidvalidity):
+    """UIDs of the sender's emails newer than the last processed one, oldest first"""
+    last_uid = state['uid'] if state and state['uidvalidity'] == uidvalidity else 0
+    criteria = f'(UID {last_uid + 1}:* FROM "{SENDER_FILTER}")' if last_uid else f'(FROM "{SENDER_FILTER}")'
+    status, data = mail.uid('SEARCH', None, criteria)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+    # "n:*" always matches the highest UID, even when it is below n
+    return sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+
 def fetch_new_mail_and_save_attachment(mail):
-    """Fetch only the most recent email and save Excel attachment if present"""
+    """Save the Excel attachment of the newest email since the last run.
+
+    Only emails with a UID above the last processed one are searched. Of the
+    newest, the BODYSTRUCTURE is fetched first and then only the largest Excel
+    part. Returns True when a new result file was saved and False when there is
+    no newer email or it has no Excel attachment; a failed fetch raises. The
+    email is only marked as processed by commit_processed_id, after the update.
+    """
     try:
-        mail.select("inbox")
-        status, messages = mail.search(None, f'(FROM "{SENDER_FILTER}")')
-        
-        if status != "OK":
-            logger.warning("❌ No emails found or search failed")
-            return
+        # Left by a run that failed: the email it names is searched for again
+        discard_pending_id()
+        mail.select("inbox", readonly=True)
+        uidvalidity = _uidvalidity(mail)
+        uids = new_message_uids(mail, get_last_processed_id(), uidvalidity)
+        if not uids:
+            logger.info("📭 No new emails from sender")
+            return False
 
-        message_ids = messages[0].split()
-        if not message_ids:
-            logger.info("📭 No emails from sender")
-            return
+        # Only process the most recent email
+        latest_uid = uids[-1]
 
-        # Only process the most recent email (last in the list)
-        latest_msg_id = message_ids[-1]
+        status, data = mail.uid('FETCH', str(latest_uid), '(BODYSTRUCTURE)')
+        structure = fetch_item(data, 'BODYSTRUCTURE') if status == "OK" else None
+        if structure is None:
+            # A failed fetch is an error, not an empty mailbox: the run must not skip the week
+            raise imaplib.IMAP4.error(f"Could not fetch the structure of email {latest_uid}: {status} {data}")
 
-        try:
-            res, data = mail.fetch(latest_msg_id, "(RFC822)")
-            if res != "OK":
-                logger.warning(f"⚠️ Could not fetch email {latest_msg_id}")
-                return
-
-            msg = email.message_from_bytes(data[0][1])
-            subject = msg.get("Subject", "No Subject")
-            logger.info(f"📨 Processing email: {subject}")
-            
-            attachments = []
-
-            for part in msg.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                if part.get("Content-Disposition") is None:
-                    continue
-
-                filename = part.get_filename()
-                if filename and is_excel_file(filename):
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        attachments.append((filename, payload))
-
-            if attachments:
-                # Save largest Excel attachment
-                largest = max(attachments, key=lambda x: len(x[1]))
-                save_path = os.path.join(DOWNLOAD_FOLDER, SAVE_AS_FILENAME)
-                
-                with open(save_path, "wb") as f:
-                    f.write(largest[1])
-                
-                logger.info(f"✅ Saved '{largest[0]}' as '{SAVE_AS_FILENAME}' ({len(largest[1])} bytes)")
-                
-                # Update last processed ID
-                set_last_processed_id(latest_msg_id)
-                return
-            else:
-                logger.warning("⚠️ No Excel attachments found in the most recent email")
+        attachments = excel_attachments(structure)
+        if not attachments:
+            logger.warning("⚠️ No Excel attachments found in the most recent email")
+            set_last_processed_id(uidvalidity, latest_uid)
+            return False
 
-        except Exception as e:
-            logger.error(f"❌ Error processing email {latest_msg_id}: {e}")
+        # Save largest Excel attachment
+        number, filename, encoding, size = max(attachments, key=lambda a: a[3])
+        status, data = mail.uid('FETCH', str(latest_uid), f'(BODY.PEEK[{number}])')
+        payload = fetch_item(data, f'BODY[{number}]') if status == "OK" else None
+        if not isinstance(payload, (bytes, str)):
+            raise imaplib.IMAP4.error(f"Could not fetch attachment '{filename}' of email {latest_uid}: {status}")
+        content = decode_part(payload.encode() if isinstance(payload, str) else payload, encoding)
+
+        save_path = os.path.join(DOWNLOAD_FOLDER, SAVE_AS_FILENAME)
+        tmp_path = f"{save_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, save_path)
+        logger.info(f"✅ Saved '{filename}' as '{SAVE_AS_FILENAME}' ({len(content)} bytes)")
+
+        set_pending_id(uidvalidity, latest_uid)
+        return True
 
     except Exception as e:
         logger.error(f"❌ Error in fetch_new_mail_and_save_attachment: {e}")
         raise
+
 def main():
-    """Main function with proper error handling"""
+    """Main function with proper error handling; returns NO_NEW_MAIL when there is no new result"""
     mail = None
     try:
         mail = connect_mailbox()
-        fetch_new_mail_and_save_attachment(mail)
+        if not fetch_new_mail_and_save_attachment(mail):
+            return NO_NEW_MAIL
     except Exception as e:
         logger.error(f"❌ Script failed: {e}")
         return 1
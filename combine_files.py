@@ -2,6 +2,9 @@ import pandas as pd
 import os
 import logging
 
+from excel_export import write_workbook
+from utils import backup_file
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -13,22 +16,39 @@ REGELMATIGHEID_BESTAND = "output/klassement_2025.xlsx"
 TEAMSTTA_BESTAND = "output/team_klassement_2025.xlsx"
 TEAMSDAM_BESTAND = "output/team_klassement_2025_DAM_only.xlsx"
 UITVOER_BESTAND = "wedstrijd_data_2025.xlsx"
+# Volgorde van de bladen in het samengevoegde bestand
+BLADEN = {
+    "REGELMATIGHEIDSCRITERIUM": REGELMATIGHEID_BESTAND,
+    "KLASSEMENT": KLASSEMENT_BESTAND,
+    "TEAMS STA": TEAMSTTA_BESTAND,
+    "TEAMS MIXED": TEAMSDAM_BESTAND,
+}
+
+def combine_files(sheets=None, backup=False):
+    """Schrijf de vier klassementen in één bestand, met opmaak, in één keer.
+
+    ``sheets`` bevat de klassementen per bladnaam zoals de stappen ze teruggeven;
+    ontbrekende bladen worden uit de bestanden in ``output`` gelezen.
+    """
+    try:
+        sheets = dict(sheets or {})
+        # Laad de gewenste sheets die niet in het geheugen zitten
+        for blad, bestand in BLADEN.items():
+            if blad not in sheets:
+                sheets[blad] = pd.read_excel(bestand, sheet_name=blad)
+
+        # Combineer in één bestand met vier bladen
+        write_workbook(UITVOER_BESTAND, {blad: sheets[blad] for blad in BLADEN})
+        logger.info(f"✅ Alle bestanden zijn succesvol samengevoegd in '{UITVOER_BESTAND}' met {len(BLADEN)} bladen.")
+
+        if backup:
+            # Het bestand hoort bij de laatste week van het klassement
+            weken = [int(kolom) for kolom in sheets["KLASSEMENT"].columns if str(kolom).isdigit()]
+            backup_path = backup_file(UITVOER_BESTAND, week=max(weken, default=None))
+            logger.info(f"📁 Backup saved to {backup_path}")
+    except Exception as e:
+        logger.error(f"❌ Fout bij samenvoegen van bestanden: {e}")
+        raise
 
-try:
-    # Laad de gewenste sheets
-    regelmatigheid_df = pd.read_excel(REGELMATIGHEID_BESTAND, sheet_name="REGELMATIGHEIDSCRITERIUM")
-    klassement_df = pd.read_excel(KLASSEMENT_BESTAND, sheet_name="KLASSEMENT")
-    teamsta_df = pd.read_excel(TEAMSTTA_BESTAND, sheet_name="TEAMS STA")
-    teamdam_df = pd.read_excel(TEAMSDAM_BESTAND, sheet_name="TEAMS MIXED")
-
-    # Combineer in één bestand met vier bladen
-    with pd.ExcelWriter(UITVOER_BESTAND, engine='openpyxl') as writer:
-        regelmatigheid_df.to_excel(writer, sheet_name="REGELMATIGHEIDSCRITERIUM", index=False)
-        klassement_df.to_excel(writer, sheet_name="KLASSEMENT", index=False)
-        teamsta_df.to_excel(writer, sheet_name="TEAMS STA", index=False)
-        teamdam_df.to_excel(writer, sheet_name="TEAMS MIXED", index=False)
-
-    logger.info(f"✅ Alle bestanden zijn succesvol samengevoegd in '{UITVOER_BESTAND}' met 4 bladen.")
-except Exception as e:
-    logger.error(f"❌ Fout bij samenvoegen van bestanden: {e}")
-    raise
\ No newline at end of file
+if __name__ == '__main__':
+    combine_files()
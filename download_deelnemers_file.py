@@ -1,9 +1,13 @@
-import pandas as pd
+import hashlib
+import json
 import requests
 import logging
 import os
-from io import BytesIO
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from input_cache import file_sha256
 
 # Load environment variables
 load_dotenv()
@@ -15,46 +19,110 @@ logger = logging.getLogger(__name__)
 # Configuration from environment variables
 GOOGLE_SHEETS_ID = os.getenv("GOOGLE_SHEETS_ID")
 WORKSHEET_GID = os.getenv("GOOGLE_SHEETS_GID")
+# Download the roster from another URL instead (e.g. a local test server)
+DEELNEMERS_URL = os.getenv("DEELNEMERS_URL")
 DEELNEMERS_FOLDER = "Deelnemers"
 OUTPUT_FILE = os.path.join(DEELNEMERS_FOLDER, "deelnemerslijst 2025.xlsx")
+# ETag / Last-Modified of the last download, sent back as conditional request headers
+STATE_FILE = os.path.join(DEELNEMERS_FOLDER, ".download_state.json")
+# (connect, read) timeouts in seconds
+TIMEOUT = (10, 60)
+RETRIES = 3
+CHUNK_SIZE = 64 * 1024
+
+def roster_url():
+    if DEELNEMERS_URL:
+        return DEELNEMERS_URL
+    # Validate environment variables
+    if not GOOGLE_SHEETS_ID or not WORKSHEET_GID:
+        raise ValueError("GOOGLE_SHEETS_ID and GOOGLE_SHEETS_GID must be set in .env file")
+    # Construct the Excel export URL for public sheets
+    return f"https://docs.google.com/spreadsheets/d/{GOOGLE_SHEETS_ID}/export?format=xlsx&gid={WORKSHEET_GID}"
+
+def _session():
+    """HTTP session that retries connection errors and 429/5xx answers with backoff."""
+    retry = Retry(total=RETRIES, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",))
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    return session
+
+def _load_state(url):
+    try:
+        with open(STATE_FILE, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Validators only hold for the same URL and as long as the roster is the one they describe
+    if state.get('url') != url or not os.path.isfile(OUTPUT_FILE) or file_sha256(OUTPUT_FILE) != state.get('sha256'):
+        return {}
+    return state
+
+def _save_state(url, response, sha):
+    state = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': sha,
+    }
+    tmp_path = f"{STATE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_FILE)
 
 def download_google_sheets_as_excel():
-    """Download Google Sheets data directly as Excel file."""
+    """Download the roster from Google Sheets; returns False when it did not change.
+
+    The download streams to a temporary file next to the roster and only replaces
+    it when the content differs, so an unchanged roster keeps its file (and the
+    caches keyed on it). The ETag / Last-Modified of the previous download are
+    sent as conditional headers, so a server that supports them answers 304.
+    """
     try:
-        # Validate environment variables
-        if not GOOGLE_SHEETS_ID or not WORKSHEET_GID:
-            raise ValueError("GOOGLE_SHEETS_ID and GOOGLE_SHEETS_GID must be set in .env file")
-        
+        url = roster_url()
+
         # Create Deelnemers folder if it doesn't exist
         os.makedirs(DEELNEMERS_FOLDER, exist_ok=True)
-        logger.info(f"📁 Ensured {DEELNEMERS_FOLDER} folder exists")
-        
-        # Construct the Excel export URL for public sheets
-        excel_url = f"https://docs.google.com/spreadsheets/d/{GOOGLE_SHEETS_ID}/export?format=xlsx&gid={WORKSHEET_GID}"
-        
+
+        state = _load_state(url)
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+
         logger.info("📡 Downloading Excel file from Google Sheets...")
-        response = requests.get(excel_url)
-        response.raise_for_status()
-        
-        # Save the Excel file directly
-        with open(OUTPUT_FILE, 'wb') as f:
-            f.write(response.content)
-        
-        logger.info(f"💾 Downloaded and saved as {OUTPUT_FILE}")
-        
-        # Load and show preview of data
-        df = pd.read_excel(OUTPUT_FILE)
-        logger.info(f"✅ File contains {len(df)} records")
-        
-        # Show preview of data
-        logger.info("📋 Data preview:")
-        logger.info(f"   Columns: {list(df.columns)}")
-        logger.info(f"   First few rows:")
-        for i, row in df.head(3).iterrows():
-            logger.info(f"      {dict(row)}")
-        
-        return df
-        
+        with _session() as session, session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 304:
+                logger.info("✅ Roster unchanged (not modified)")
+                return False
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            size = 0
+            tmp_path = f"{OUTPUT_FILE}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                sha = digest.hexdigest()
+
+                if os.path.isfile(OUTPUT_FILE) and file_sha256(OUTPUT_FILE) == sha:
+                    logger.info("✅ Roster unchanged (same content)")
+                    changed = False
+                else:
+                    os.replace(tmp_path, OUTPUT_FILE)
+                    logger.info(f"💾 Downloaded and saved as {OUTPUT_FILE} ({size} bytes)")
+                    changed = True
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            _save_state(url, response, sha)
+        return changed
+
     except Exception as e:
         logger.error(f"❌ Failed to download Google Sheets: {e}")
         raise
@@ -0,0 +1,133 @@
+import math
+import os
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+from instrumentation import traced
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+PINK = "FFC0CB"
+GREEN = "C6EFCE"
+BLUE = "BDD7EE"
+# Weeks up to this one are coloured green, later weeks blue
+LAST_GREEN_WEEK = 4
+CATEGORY_COLUMN = "Cat."
+
+def _is_week_column(name):
+    return str(name).isdigit()
+
+def _cell_value(value):
+    """Plain Python value for a cell; NaN and NA become an empty cell."""
+    if value is None:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    try:
+        if value != value or (isinstance(value, float) and math.isinf(value)):
+            return None
+    except (TypeError, ValueError):
+        # pd.NA cannot be compared
+        return None
+    return value
+
+def _week_colours(columns):
+    """Fill colour of every week column position."""
+    return {
+        idx: (GREEN if int(name) <= LAST_GREEN_WEEK else BLUE)
+        for idx, name in enumerate(columns)
+        if _is_week_column(name)
+    }
+
+def _write_openpyxl(path, sheets):
+    wb = Workbook(write_only=True)
+    side = Side(style='thin')
+    header_font = Font(bold=True)
+    header_border = Border(left=side, right=side, top=side, bottom=side)
+    header_alignment = Alignment(horizontal='center', vertical='top')
+    fills = {colour: PatternFill(start_color=colour, end_color=colour, fill_type="solid") for colour in (PINK, GREEN, BLUE)}
+
+    for sheet_name, df in sheets.items():
+        ws = wb.create_sheet(title=sheet_name)
+        columns = list(df.columns)
+        week_colours = _week_colours(columns)
+        cat_idx = columns.index(CATEGORY_COLUMN) if CATEGORY_COLUMN in columns else None
+
+        header = []
+        for name in columns:
+            cell = WriteOnlyCell(ws, value=_cell_value(name))
+            cell.font = header_font
+            cell.border = header_border
+            cell.alignment = header_alignment
+            header.append(cell)
+        ws.append(header)
+
+        for values in df.itertuples(index=False, name=None):
+            row_fill = fills[PINK] if cat_idx is not None and values[cat_idx] == 'DAM' else None
+            row = []
+            for idx, value in enumerate(values):
+                fill = fills[week_colours[idx]] if idx in week_colours else row_fill
+                if fill is None:
+                    row.append(_cell_value(value))
+                else:
+                    cell = WriteOnlyCell(ws, value=_cell_value(value))
+                    cell.fill = fill
+                    row.append(cell)
+            ws.append(row)
+
+    wb.save(path)
+
+def _write_xlsxwriter(path, sheets):
+    wb = xlsxwriter.Workbook(path, {
+        'constant_memory': True, 'nan_inf_to_errors': True, 'strings_to_formulas': False, 'strings_to_urls': False
+    })
+    header_format = wb.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    formats = {colour: wb.add_format({'bg_color': f"#{colour}", 'pattern': 1}) for colour in (PINK, GREEN, BLUE)}
+
+    for sheet_name, df in sheets.items():
+        ws = wb.add_worksheet(sheet_name)
+        columns = list(df.columns)
+        week_colours = _week_colours(columns)
+        cat_idx = columns.index(CATEGORY_COLUMN) if CATEGORY_COLUMN in columns else None
+
+        ws.write_row(0, 0, [_cell_value(name) for name in columns], header_format)
+        for row_idx, values in enumerate(df.itertuples(index=False, name=None), start=1):
+            row_format = formats[PINK] if cat_idx is not None and values[cat_idx] == 'DAM' else None
+            for idx, value in enumerate(values):
+                cell_format = formats[week_colours[idx]] if idx in week_colours else row_format
+                value = _cell_value(value)
+                if value is None:
+                    if cell_format is not None:
+                        ws.write_blank(row_idx, idx, None, cell_format)
+                else:
+                    ws.write(row_idx, idx, value, cell_format)
+
+    wb.close()
+
+def _workbook_size(path, sheets):
+    return {
+        'file': os.path.basename(path),
+        'rows': sum(len(df) for df in sheets.values()),
+        'columns': max((df.shape[1] for df in sheets.values()), default=0),
+        'engine': 'xlsxwriter' if xlsxwriter is not None else 'openpyxl',
+    }
+
+# Data and styling are written in the same pass, so one span covers both
+@traced('write', measure=_workbook_size)
+def write_workbook(path, sheets):
+    """Write ``{sheet_name: df}`` to ``path`` with data and styling in one streaming pass.
+
+    Rows with 'DAM' in the Cat. column are pink and week columns (numeric
+    headers) are green up to LAST_GREEN_WEEK and blue after; sheets without
+    those columns are written plain. Uses xlsxwriter when it is installed and
+    openpyxl's write-only mode otherwise.
+    """
+    if xlsxwriter is not None:
+        _write_xlsxwriter(path, sheets)
+    else:
+        _write_openpyxl(path, sheets)
@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+# Reading a sheet streams its rows once and keeps only the cells it needs: the
+# header row picks the columns, reading stops after the wanted rows and the
+# cells of other columns are never converted. The cells are converted the way
+# the engines of pd.read_excel do and the frame is typed the way its parser
+# types it (names of empty and repeated headers, empty cells NaN, columns of
+# numbers numeric, dates datetime), so names, values and dtypes come out as
+# read_excel gives them. Unlike read_excel, text such as "NA" or "null" stays text.
+# python-calamine parses the file natively and is used when it is installed;
+# otherwise openpyxl streams the sheet in read-only mode.
+
+def _convert_openpyxl(cell):
+    """Cell value as read_excel's openpyxl engine gives it: empty '', errors NaN, whole numbers int."""
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+def _convert_calamine(value):
+    """Cell value as read_excel's calamine engine gives it."""
+    if isinstance(value, float):
+        whole = int(value)
+        return whole if whole == value else value
+    if isinstance(value, date):
+        return pd.Timestamp(value)
+    if isinstance(value, timedelta):
+        return pd.Timedelta(value)
+    return value
+
+@contextmanager
+def _openpyxl_sheet(source, last):
+    wb = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        # Only the cells up to ``width`` are made; the rest of every row is skipped while parsing
+        yield lambda first, last, width: ws.iter_rows(min_row=first + 1, max_row=last, max_col=width)
+    finally:
+        wb.close()
+
+@contextmanager
+def _calamine_sheet(source, last):
+    # The sheet is parsed natively in one go, up to the last row needed
+    read = python_calamine.load_workbook(source).get_sheet_by_index(0).to_python(skip_empty_area=False, nrows=last)
+    yield lambda first, last, width: (row[:width] for row in read[first:last])
+
+ENGINES = {
+    'calamine': (_calamine_sheet, _convert_calamine),
+    'openpyxl': (_openpyxl_sheet, _convert_openpyxl),
+}
+
+def engine_name():
+    """The engine the sheets are read with: 'calamine' when installed, else 'openpyxl'."""
+    return 'calamine' if python_calamine is not None else 'openpyxl'
+
+def _has_data(row):
+    return any(value != "" for value in row)
+
+def _column_names(row):
+    """The header row as read_excel names it: empty cells 'Unnamed: i', repeats 'name.1', 'name.2', ..."""
+    names = []
+    counts = {}
+    for i, name in enumerate(row):
+        if name == "":
+            name = f"Unnamed: {i}"
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        names.append(name)
+    return names
+
+def _typed_column(values):
+    """A column typed as read_excel types it: empty cells NaN, numbers (or numeric text) numeric, dates datetime."""
+    column = pd.Series(values, dtype=object)
+    column = column.mask(column.eq(""))
+    try:
+        return pd.to_numeric(column)
+    except (ValueError, TypeError):
+        return column.infer_objects()
+
+def read_sheet(source, header=0, usecols=None, nrows=None):
+    """The first sheet of an xlsx file (path or file object) as a frame, as ``pd.read_excel`` reads it.
+
+    Row ``header`` (counting from 0) holds the column names. ``usecols`` keeps
+    the columns whose name it lists or, when callable, accepts. ``nrows`` reads
+    that many rows below the header; 0 gives only the column names.
+    """
+    sheet, convert = ENGINES[engine_name()]
+    last = None if nrows is None else header + 1 + nrows
+    with sheet(source, last) as rows:
+        if usecols is None:
+            data = []
+            for row in rows(0, last, None):
+                data.append([convert(cell) for cell in row])
+                # Trailing empty cells are dropped and the rows padded again below, as read_excel does
+                while data[-1] and data[-1][-1] == "":
+                    data[-1].pop()
+        else:
+            wanted = usecols if callable(usecols) else set(usecols).__contains__
+            data = [[convert(cell) for cell in row] for row in rows(0, header + 1, None)]
+            # Columns are picked by the names read_excel gives them, so a repeated name is picked once
+            names = _column_names(data[header]) if len(data) > header else []
+            positions = [i for i, name in enumerate(names) if wanted(name)]
+            data = [[row[i] if i < len(row) else "" for i in positions] for row in data]
+            if positions:
+                data[header] = [names[i] for i in positions]
+            if positions:
+                data += [
+                    [convert(row[i]) if i < len(row) else "" for i in positions]
+                    for row in rows(header + 1, last, max(positions) + 1)
+                ]
+
+    last_with_data = max((i for i, row in enumerate(data) if _has_data(row)), default=-1)
+    data = data[:last_with_data + 1]
+    if not data:
+        return pd.DataFrame()
+    if len(data) <= header:
+        raise ValueError(f"Passed header={header}, but the sheet has only {len(data)} rows")
+    width = max(len(row) for row in data)
+    data = [row + [""] * (width - len(row)) for row in data]
+    names = _column_names(data[header])
+    rows = data[header + 1:]
+    if not rows:
+        return pd.DataFrame(columns=names, dtype=object)
+    return pd.DataFrame({name: _typed_column(values) for name, values in zip(names, zip(*rows))})
@@ -1,8 +1,14 @@
+import argparse
 import subprocess
 import sys
 import logging
 import os
-from utils import backup_deelnemers_file
+from concurrent.futures import ThreadPoolExecutor
+import backup_store
+import instrumentation
+from check_mail import NO_NEW_MAIL, commit_processed_id
+from pipeline import DOWNLOAD_TIMEOUT, MAIL_TIMEOUT
+from utils import backup_deelnemers_file, get_current_backup_run
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -84,9 +90,14 @@ def run_combine():
         raise
 
 def run_search_mail():
+    """Fetch the newest result; returns False when there was no new one."""
     try:
-        subprocess.run([sys.executable, 'check_mail.py'], check=True)
+        result = subprocess.run([sys.executable, 'check_mail.py'], timeout=MAIL_TIMEOUT)
+        if result.returncode == NO_NEW_MAIL:
+            return False
+        result.check_returncode()
         logger.info("✅ Mail search successfully.")
+        return True
     except Exception as e:
         logger.error(f"❌ Error searching mail: {e}")
         raise
@@ -101,12 +112,55 @@ def run_send_mail():
     
 def run_deelnemers_file():
     try:
-        subprocess.run([sys.executable, 'download_deelnemers_file.py'], check=True)
+        subprocess.run([sys.executable, 'download_deelnemers_file.py'], check=True, timeout=DOWNLOAD_TIMEOUT)
         logger.info("✅ Deelnemers file downloaded successfully.")
     except Exception as e:
         logger.error(f"❌ Error downloading deelnemers file: {e}")
         raise
 
+def run_stage(name, func):
+    """Run one stage in a span of the run report, named as the stage of the pipeline."""
+    with instrumentation.span(name, kind='stage'):
+        return func()
+
+def run_ingestion():
+    """Download the roster and fetch the result mail at the same time; returns whether there was new mail."""
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        roster = pool.submit(run_stage, 'deelnemers', run_deelnemers_file)
+        mail = pool.submit(run_stage, 'mail', run_search_mail)
+        roster.result()
+        return mail.result()
+
+def run_subprocesses(force=False):
+    """Run every stage as a subprocess; returns False when there was no new result and nothing was updated.
+
+    Like run_pipeline, the run writes a report of its spans (see instrumentation);
+    the time of a stage includes starting its interpreter.
+    """
+    instrumentation.start_run(get_current_backup_run())
+    status = 'failed'
+    try:
+        with instrumentation.span('run', parallel=False):
+            if not (run_ingestion() or force):
+                status = 'no_new_result'
+                return False
+            run_stage('klassement', run_generate_klassement)
+            run_stage('regelmatigheid', run_generate_regelmatigheidscriterium)
+            run_stage('teams_sta', run_teams_sta)
+            run_stage('teams_mixed', run_teams_dam)
+            run_stage('combine', run_combine)
+            run_stage('send_mail', run_send_mail)
+        status = 'updated'
+        # Not before: when a stage fails the next run fetches the same email again
+        commit_processed_id()
+        return True
+    finally:
+        try:
+            path = instrumentation.write_report(status=status, parallel=False, force=force)
+            logger.info(f"📊 Run report written to {path}")
+        except OSError as e:
+            logger.warning(f"⚠️ Could not write the run report: {e}")
+
 def run_utils():
     try:
         subprocess.run([sys.executable, 'utils.py'], check=True)
@@ -116,21 +170,35 @@ def run_utils():
         raise
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate and distribute the weekly standings.")
+    parser.add_argument('--in-process', action='store_true',
+                        help="run every stage in this interpreter and parse the shared inputs only once")
+    parser.add_argument('--parallel', action='store_true',
+                        help="like --in-process, but run independent stages concurrently on a process pool")
+    parser.add_argument('--stage-workbooks', action='store_true',
+                        help="with --in-process/--parallel, also write the per-standing workbooks in output/")
+    parser.add_argument('--force', action='store_true',
+                        help="run every stage even without new mail or when its inputs did not change")
+    args = parser.parse_args()
+
     logger.info("Starting the generation process...")
     
     # Ask about second period status at the beginning
     ask_second_period_status()
     
-    run_deelnemers_file()
-
-    run_search_mail()
-    run_generate_klassement()
-    run_generate_regelmatigheidscriterium()
-    run_teams_sta()
-    run_teams_dam()
-    run_combine()
-    run_send_mail()
-    
+    if args.in_process or args.parallel:
+        from pipeline import run_pipeline
+        updated = run_pipeline(IS_SECOND_PERIOD_STARTED, parallel=args.parallel,
+                               write_stage_workbooks=args.stage_workbooks, force=args.force)
+    else:
+        backup_store.import_legacy_backups()
+        updated = run_subprocesses(force=args.force)
+
+    if not updated:
+        # The roster is not backed up either: its class changes belong to the next week that is computed
+        logger.info("📭 No new result, nothing to update.")
+        sys.exit(0)
+
     try: 
         backup_deelnemers_file()
         logger.info("✅ Deelnemers file backed up.")
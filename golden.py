@@ -0,0 +1,259 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+import backup_store
+from benchmark import format_report, timed_stages
+from combine_files import BLADEN, UITVOER_BESTAND
+from utils import DEELNEMERS_FILE, RESULT_FILE, TEMPLATE_FILE
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Every run backs up the finish file and the roster it used, next to the
+# standings it produced. A golden case is such a week: its recorded inputs go
+# through the stage graph again, starting from the standings of the week
+# before, and the result is compared cell by cell with the standings that were
+# backed up for that week. The roster download and the mail fetch are replaced
+# by stages that put the recorded files in place, and no mail is sent, so the
+# check runs offline. Every case runs in its own scratch directory.
+FINISH_SOURCE = os.path.basename(RESULT_FILE)
+ROSTER_SOURCE = os.path.basename(DEELNEMERS_FILE)
+COMBINED_SOURCE = os.path.basename(UITVOER_BESTAND)
+# Differences listed per sheet in the report; all of them are counted
+MAX_LISTED = 20
+
+Case = namedtuple('Case', ['week', 'finish', 'roster', 'previous_roster', 'expected', 'history'])
+
+def _sheet_snapshots(week):
+    """``{sheet: snapshot}`` of the standings after ``week``: the combined workbook, else each standing's own."""
+    combined = backup_store.snapshot_for_week(COMBINED_SOURCE, week)
+    snapshots = {}
+    for sheet, path in BLADEN.items():
+        snapshot = combined or backup_store.snapshot_for_week(os.path.basename(path), week)
+        if snapshot is not None:
+            snapshots[sheet] = snapshot
+    return snapshots
+
+def recorded_cases(weeks=None):
+    """The weeks of the backup store with a recorded finish file, as golden cases.
+
+    The roster of a week is the first roster snapshot made in or after the run
+    of its finish file (as in ``replay.season_from_backups``); the one before
+    is the roster the class changes were found against.
+    """
+    finishes = {}
+    for snapshot in backup_store.list_snapshots(FINISH_SOURCE):
+        if snapshot['week'] is not None:
+            finishes[snapshot['week']] = snapshot
+    rosters = backup_store.list_snapshots(ROSTER_SOURCE)
+    cases = []
+    for week in sorted(finishes):
+        if weeks and week not in weeks:
+            continue
+        run = finishes[week]['run']
+        cases.append(Case(
+            week=week,
+            finish=finishes[week],
+            roster=next((s for s in rosters if s['run'] >= run), None),
+            previous_roster=next((s for s in reversed(rosters) if s['run'] < run), None),
+            expected=_sheet_snapshots(week),
+            history=_sheet_snapshots(week - 1) if week > 1 else {},
+        ))
+    return cases
+
+def _missing(case):
+    """Why a case cannot be checked, or None."""
+    if case.roster is None:
+        return "no roster snapshot for the week"
+    if not case.expected:
+        return "no standings backed up for the week"
+    if case.week > 1 and set(case.history) != set(BLADEN):
+        return f"standings of week {case.week - 1} incomplete: {sorted(case.history)}"
+    return None
+
+def restore_case(case, case_dir):
+    """Write the files of ``case`` into ``case_dir``; runs in the directory of the backup store."""
+    inputs = os.path.join(case_dir, "golden")
+    os.makedirs(os.path.join(inputs, "previous"), exist_ok=True)
+    backup_store.restore_snapshot(case.finish, os.path.join(inputs, FINISH_SOURCE))
+    backup_store.restore_snapshot(case.roster, os.path.join(inputs, ROSTER_SOURCE))
+    if case.previous_roster is not None:
+        backup_store.restore_snapshot(case.previous_roster, os.path.join(inputs, "previous", ROSTER_SOURCE))
+    for sheet, snapshot in case.expected.items():
+        backup_store.restore_snapshot(snapshot, os.path.join(inputs, f"expected_{sheet}.xlsx"))
+    # The standings of the week before, where the stages import their history from
+    for sheet, snapshot in case.history.items():
+        path = os.path.join(case_dir, BLADEN[sheet])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backup_store.restore_snapshot(snapshot, path)
+    os.makedirs(os.path.join(case_dir, os.path.dirname(TEMPLATE_FILE)), exist_ok=True)
+    shutil.copyfile(TEMPLATE_FILE, os.path.join(case_dir, TEMPLATE_FILE))
+
+def _offline_stages(inputs):
+    """The stage graph with the roster download and mail fetch replaced by the recorded files, and no mail."""
+    from pipeline import build_stage_graph
+
+    def put_roster(context):
+        os.makedirs(os.path.dirname(DEELNEMERS_FILE), exist_ok=True)
+        shutil.copyfile(os.path.join(inputs, ROSTER_SOURCE), DEELNEMERS_FILE)
+
+    def put_result(context):
+        os.makedirs(os.path.dirname(RESULT_FILE), exist_ok=True)
+        shutil.copyfile(os.path.join(inputs, FINISH_SOURCE), RESULT_FILE)
+
+    def no_mail(context):
+        logger.info("📭 Golden run, no mail sent")
+
+    stubs = {'deelnemers': put_roster, 'mail': put_result, 'send_mail': no_mail}
+    return [stage._replace(func=stubs[stage.name]) if stage.name in stubs else stage for stage in build_stage_graph()]
+
+def diff_sheet(expected, actual):
+    """Cells that differ between two sheets as ``(cell, expected, actual)``, the header as row 1."""
+    differences = []
+    expected_columns = [str(col) for col in expected.columns]
+    actual_columns = [str(col) for col in actual.columns]
+    if expected_columns != actual_columns:
+        differences.append(("header", expected_columns, actual_columns))
+    if len(expected) != len(actual):
+        differences.append(("rows", len(expected), len(actual)))
+    actual = actual.set_axis(actual_columns, axis=1)
+    rows = min(len(expected), len(actual))
+    for position, column in enumerate(expected_columns):
+        if column not in actual.columns:
+            continue
+        want = expected.iloc[:rows, position].reset_index(drop=True)
+        got = actual[column].iloc[:rows].reset_index(drop=True)
+        same = (want == got) | (want.isna() & got.isna())
+        for row in same.index[~same.to_numpy()]:
+            differences.append((f"{get_column_letter(position + 1)}{row + 2}", want[row], got[row]))
+    return differences
+
+def _json_value(value):
+    if isinstance(value, list):
+        return value
+    return None if pd.isna(value) else value.item() if hasattr(value, 'item') else value
+
+def run_case(case, case_dir):
+    """Run ``case`` in ``case_dir`` (its files restored there) and compare the result with the backups."""
+    from pipeline import run_stage_graph
+    from utils import set_current_backup_run
+
+    inputs = os.path.join(case_dir, "golden")
+    cwd = os.getcwd()
+    os.chdir(case_dir)
+    try:
+        if case.previous_roster is not None:
+            # The roster of the week before, where the class changes are found against
+            backup_store.add_snapshot("golden_previous", os.path.join(inputs, "previous", ROSTER_SOURCE))
+        set_current_backup_run(f"golden_{case.week:04d}")
+        expected = {
+            sheet: pd.read_excel(os.path.join(inputs, f"expected_{sheet}.xlsx"), sheet_name=sheet)
+            for sheet in case.expected
+        }
+        # The flag is not recorded; a standing with 2e Periode points was made in the second period
+        klassement = expected.get('KLASSEMENT', next(iter(expected.values())))
+        second_period = '2e Periode' in klassement.columns and bool(klassement['2e Periode'].fillna(0).astype(bool).any())
+
+        timings = {}
+        context = {'is_second_period_started': second_period, 'write_stage_workbooks': False, 'force': True}
+        run_stage_graph(timed_stages(_offline_stages(inputs), timings), context, parallel=False)
+        timings['week'] = sum(timings.values())
+
+        actual = pd.read_excel(UITVOER_BESTAND, sheet_name=None)
+        differences = {}
+        for sheet, want in expected.items():
+            found = diff_sheet(want, actual[sheet]) if sheet in actual else [("sheet", sheet, None)]
+            if found:
+                differences[sheet] = found
+        return second_period, timings, differences
+    finally:
+        os.chdir(cwd)
+
+def check(weeks=None, workdir=None):
+    """Run every golden case of the backup store in the working directory; returns the report."""
+    backup_store.import_legacy_backups()
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'results': []}
+    root = os.path.abspath(workdir or tempfile.mkdtemp(prefix="atb_golden_"))
+    try:
+        for case in recorded_cases(weeks):
+            entry = {'label': f"week {case.week}", 'week': case.week, 'run': case.finish['run'], 'timings': {}}
+            report['results'].append(entry)
+            reason = _missing(case)
+            if reason:
+                entry.update(status='skipped', reason=reason)
+                logger.warning(f"⚠️ Week {case.week} skipped: {reason}")
+                continue
+            case_dir = os.path.join(root, f"week_{case.week:02d}")
+            shutil.rmtree(case_dir, ignore_errors=True)
+            restore_case(case, case_dir)
+            second_period, timings, differences = run_case(case, case_dir)
+            entry.update(
+                status='different' if differences else 'same',
+                second_period=second_period,
+                timings=timings,
+                differences={sheet: len(found) for sheet, found in differences.items()},
+                cells={sheet: [[cell, _json_value(want), _json_value(got)] for cell, want, got in found[:MAX_LISTED]]
+                       for sheet, found in differences.items()},
+            )
+            if differences:
+                logger.error(f"❌ Week {case.week}: {entry['differences']} cells differ")
+            else:
+                logger.info(f"✅ Week {case.week}: identical in {timings['week']:.2f}s")
+        return report
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+def speedups(report, baseline):
+    """Time of every step against an earlier report, as ``{label: {step: old / new}}``."""
+    old = {entry['label']: entry['timings'] for entry in baseline['results']}
+    return {
+        entry['label']: {step: old[entry['label']][step] / seconds
+                         for step, seconds in entry['timings'].items()
+                         if seconds and old.get(entry['label'], {}).get(step)}
+        for entry in report['results'] if entry['timings']
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run the recorded weeks of the backup store again and compare with the backed-up standings."
+    )
+    parser.add_argument('--weeks', type=int, nargs='+', help="only these weeks (default: every recorded week)")
+    parser.add_argument('--report', help="write the report with differences and timings as JSON to this file")
+    parser.add_argument('--baseline', help="report of an earlier run, to compare the timings with")
+    parser.add_argument('--workdir', help="keep the scratch directories of the cases here")
+    parser.add_argument('--verbose', action='store_true', help="show the log of the pipeline")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    report = check(args.weeks, args.workdir)
+    results = report['results']
+    if not results:
+        logger.warning("⚠️ No week in the backups has a recorded finish file yet")
+    if any(entry['timings'] for entry in results):
+        print(format_report({'results': [entry for entry in results if entry['timings']]}))
+    for entry in results:
+        for sheet, cells in entry.get('cells', {}).items():
+            for cell, want, got in cells:
+                print(f"{entry['label']} {sheet} {cell}: expected {want!r}, got {got!r}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            for label, steps in speedups(report, json.load(f)).items():
+                print(f"{label}: " + ", ".join(f"{step} x{ratio:.2f}" for step, ratio in steps.items()))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if any(entry['status'] == 'different' for entry in results) else 0)
@@ -0,0 +1,62 @@
+import hashlib
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = ".cache/inputs"
+# Bump when the normalisation in the loaders changes, so old entries are not reused
+CACHE_VERSION = 4
+
+def file_sha256(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _entry_path(name, sha):
+    return os.path.join(CACHE_DIR, f"{name}-v{CACHE_VERSION}-{sha}.pkl")
+
+def _evict_stale(name, keep_path):
+    """Remove the entries of this source that no longer match its content."""
+    prefix = f"{name}-"
+    for filename in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, filename)
+        if filename.startswith(prefix) and path != keep_path:
+            try:
+                os.remove(path)
+                logger.info(f"🧹 Removed stale cache entry {filename}")
+            except OSError as e:
+                logger.warning(f"⚠️ Could not remove stale cache entry {filename}: {e}")
+
+def cached_frame(source_path, name, parse):
+    """Return ``parse(source_path)``, cached on the SHA-256 of the source file.
+
+    The normalised frame is stored as a pandas pickle: the column blocks are
+    written as binary arrays, so loading is fast and dtypes (Int64, the
+    categoricals of the schema, object columns that mix text and numbers as the
+    roster does) come back exactly.
+    When the source changes its old entry is evicted.
+    """
+    sha = file_sha256(source_path)
+    path = _entry_path(name, sha)
+    if os.path.isfile(path):
+        try:
+            return pd.read_pickle(path)
+        except Exception as e:
+            logger.warning(f"⚠️ Ignoring unreadable cache entry {path}: {e}")
+
+    df = parse(source_path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        _evict_stale(name, path)
+    except OSError as e:
+        logger.warning(f"⚠️ Could not write cache entry for {source_path}: {e}")
+    return df
@@ -0,0 +1,180 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from backup_store import BACKUP_ROOT
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Spans time the stages of a run and the steps inside them (reading the xlsx
+# files, points, class changes, aggregation, ranking, writing, backups, mail).
+# Each span records its wall time, the peak RSS of the process when it ends and,
+# where the step knows them, the rows and columns it processed. Spans nest per
+# thread; stages that run in a worker process send their spans back with their
+# result. The pipeline writes them as one JSON report per run in REPORTS_DIR.
+#
+# With PROFILE_STAGE set to the name of a span (a stage such as "klassement",
+# or a step such as "write") that span is run under cProfile and the profile is
+# written next to the report, for pstats or snakeviz.
+REPORTS_DIR = os.path.join(BACKUP_ROOT, "reports")
+PROFILE_STAGE = os.getenv("PROFILE_STAGE")
+
+_lock = threading.Lock()
+_local = threading.local()
+_spans = []
+_run = None
+_profiling = False
+
+class Span:
+    """Handle of a running span, to add what it processed."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def frame(self, df):
+        """Record the rows and columns of ``df`` (a frame or a series)."""
+        self.fields.update(frame_size(df) if df.ndim > 1 else {'rows': len(df), 'columns': 1})
+        return df
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+def frame_size(df):
+    """Rows and columns of a frame, as span fields."""
+    return {'rows': len(df), 'columns': df.shape[1]}
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+def _profile_path(name):
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    return os.path.join(REPORTS_DIR, f"{_run or 'run'}_{name}_{os.getpid()}.prof")
+
+@contextmanager
+def span(name, **fields):
+    """Time the block as a span called ``name``; yields a ``Span`` to record rows and columns."""
+    global _profiling
+    stack = _local.__dict__.setdefault('stack', [])
+    current = Span(name, fields)
+    parent = stack[-1].name if stack else None
+    stack.append(current)
+
+    profiler = None
+    if name == PROFILE_STAGE and not _profiling:
+        _profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.fields['error'] = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+            path = _profile_path(name)
+            profiler.dump_stats(path)
+            logger.info(f"🔬 Profile of '{name}' written to {path}")
+        stack.pop()
+        record = {
+            'name': name,
+            'parent': parent,
+            'depth': len(stack),
+            'start': started,
+            'seconds': round(seconds, 6),
+            'peak_rss_mb': _peak_rss_mb(),
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            **current.fields,
+        }
+        with _lock:
+            _spans.append(record)
+
+def traced(name, measure=None, **fields):
+    """Decorator that runs the function in a span called ``name``.
+
+    ``measure(*args, **kwargs)`` returns extra fields (rows, columns, ...) from
+    the arguments; without it a frame or series result records its shape.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **fields) as current:
+                if measure is not None:
+                    current.set(**measure(*args, **kwargs))
+                result = func(*args, **kwargs)
+                if measure is None and hasattr(result, 'shape'):
+                    current.frame(result)
+                return result
+        return wrapper
+    return decorate
+
+def start_run(run):
+    """Forget the spans recorded so far; the next report belongs to ``run``."""
+    global _run
+    _run = run
+    with _lock:
+        _spans.clear()
+
+def collect():
+    """The spans recorded in this process since the last call, to send them to the parent process."""
+    with _lock:
+        spans = list(_spans)
+        _spans.clear()
+    return spans
+
+def merge(spans):
+    """Add the spans of a worker process to this one's."""
+    with _lock:
+        _spans.extend(spans)
+
+def report_path(run=None):
+    return os.path.join(REPORTS_DIR, f"{run or _run}.json")
+
+def write_report(path=None, **summary):
+    """Write the spans of the run as JSON, with the total time and calls per span name; returns the path."""
+    with _lock:
+        spans = sorted(_spans, key=lambda record: record['start'])
+    origin = spans[0]['start'] if spans else time.time()
+    totals = {}
+    for record in spans:
+        total = totals.setdefault(record['name'], {'calls': 0, 'seconds': 0.0})
+        total['calls'] += 1
+        total['seconds'] = round(total['seconds'] + record['seconds'], 6)
+    report = {
+        'run': _run,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        **summary,
+        'peak_rss_mb': max((record['peak_rss_mb'] or 0 for record in spans), default=None),
+        'totals': totals,
+        # Start times relative to the first span
+        'spans': [{**record, 'start': round(record['start'] - origin, 6)} for record in spans],
+    }
+    path = path or report_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,432 @@
+import logging
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import backup_store
+import build_cache
+import instrumentation
+import results_store
+from combine_files import (
+    BLADEN as COMBINED_SHEETS,
+    KLASSEMENT_BESTAND as KLASSEMENT_FILE,
+    REGELMATIGHEID_BESTAND as REGELMATIGHEID_FILE,
+    TEAMSTTA_BESTAND as TEAMS_STA_FILE,
+    TEAMSDAM_BESTAND as TEAMS_MIXED_FILE,
+    UITVOER_BESTAND as COMBINED_FILE
+)
+from utils import (
+    load_deelnemers,
+    load_result,
+    load_template_column_order,
+    get_current_backup_run,
+    set_current_backup_run,
+    file_sha256,
+    DEELNEMERS_FILE,
+    RESULT_FILE,
+    TEMPLATE_FILE
+)
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# In-memory artefacts: the parsed roster, result and template shared by the standings
+# stages, and the sheet each standings stage returns (named after the sheet)
+SHARED_INPUTS = "shared_inputs"
+# Marks that the standings kept only as workbook are in the results store
+STORE_SYNCED = "store_synced"
+
+# A stage reads its declared inputs and produces its declared outputs. Inputs and
+# outputs are file paths or in-memory artefact names; a stage that returns a value
+# publishes it in the run context under its first output. A stage that reads its own
+# previous output does not depend on itself.
+#
+# A stage with a ``fingerprint`` (a function of the run context returning what,
+# besides its inputs, its result depends on) is skipped when neither its inputs
+# nor that changed since it last ran; its previous output is reused.
+#
+# An ``io`` stage mostly waits on the network. It runs on a thread in this process,
+# also in a sequential run, so the roster download and the mail fetch overlap and
+# the computation starts once both files are on disk. When it takes longer than
+# its ``timeout`` (seconds) the run fails.
+Stage = namedtuple('Stage', ['name', 'func', 'inputs', 'outputs', 'fingerprint', 'io', 'timeout'],
+                   defaults=(None, False, None))
+
+# Time the ingestion stages get; the download and IMAP connection have their own socket timeouts
+DOWNLOAD_TIMEOUT = 180
+MAIL_TIMEOUT = 180
+# Pool workers are spawned, not forked: io stages may be running on threads when
+# the pool starts, and a forked worker would inherit their logging, socket and SSL
+# locks in whatever state they are in. A spawned worker also starts in the current
+# directory and environment of the run.
+POOL_CONTEXT = multiprocessing.get_context('spawn')
+# Whether the standings stages write their own workbook in output (the combined
+# workbook is then not backed up again) when the run context does not say
+WRITE_STAGE_WORKBOOKS = False
+
+def _writes_stage_workbooks(context):
+    return context.get('write_stage_workbooks', WRITE_STAGE_WORKBOOKS)
+
+def load_shared_inputs(context=None):
+    """Parse the roster, the result file and the template header once for all stages."""
+    inputs = {
+        'deelnemers': load_deelnemers(),
+        'uitslag': load_result(),
+        'template_columns': load_template_column_order(),
+    }
+    logger.info(f"📥 Loaded {len(inputs['deelnemers'])} deelnemers and {len(inputs['uitslag'])} results")
+    return inputs
+
+def run_download_deelnemers(context):
+    if not context.get('download_roster', True):
+        # A roster put in place by hand is used as it is, not replaced by the Google Sheet
+        logger.info("✅ Deelnemers file not downloaded, the file in place is used.")
+        return
+    from download_deelnemers_file import download_google_sheets_as_excel
+    if download_google_sheets_as_excel():
+        logger.info("✅ Deelnemers file downloaded successfully.")
+    else:
+        # The file is left as it is, so everything keyed on its content is reused
+        logger.info("✅ Deelnemers file unchanged.")
+
+class NoNewResult(Exception):
+    """Raised by the mail stage when there is no new result: the rest of the run is skipped."""
+
+def run_check_mail(context):
+    import check_mail
+    status = check_mail.main()
+    if status == check_mail.NO_NEW_MAIL and context.get('require_new_mail', True) and not context.get('force'):
+        raise NoNewResult("No new result in the mailbox")
+    if status not in (0, check_mail.NO_NEW_MAIL):
+        raise RuntimeError("check_mail failed")
+    logger.info("✅ Mail search successfully.")
+
+def run_klassement(context):
+    from generate_klassement import generate_klassement
+    inputs = context[SHARED_INPUTS]
+    sheet = generate_klassement(
+        inputs['deelnemers'], inputs['uitslag'], inputs['template_columns'], context['is_second_period_started'],
+        write_output=_writes_stage_workbooks(context)
+    )
+    logger.info("✅ Klassement generated successfully.")
+    return sheet
+
+def run_regelmatigheidscriterium(context):
+    from generate_regelmatigheidscriterium import generate_regelmatigheidscriterium
+    inputs = context[SHARED_INPUTS]
+    sheet = generate_regelmatigheidscriterium(
+        inputs['deelnemers'], inputs['uitslag'], inputs['template_columns'], context['is_second_period_started'],
+        write_output=_writes_stage_workbooks(context)
+    )
+    logger.info("✅ Regelmatigheidscriterium generated successfully.")
+    return sheet
+
+def run_teams_sta(context):
+    from team_klassement import calculate_team_klassement
+    inputs = context[SHARED_INPUTS]
+    sheet = calculate_team_klassement(
+        inputs['deelnemers'], inputs['uitslag'], context['is_second_period_started'],
+        write_output=_writes_stage_workbooks(context)
+    )
+    logger.info("✅ Team klassement (STA) generated successfully.")
+    return sheet
+
+def run_teams_mixed(context):
+    from team_DAM_klassement import calculate_team_klassement
+    inputs = context[SHARED_INPUTS]
+    sheet = calculate_team_klassement(
+        inputs['deelnemers'], inputs['uitslag'], context['is_second_period_started'],
+        write_output=_writes_stage_workbooks(context)
+    )
+    logger.info("✅ Team klassement (DAM) generated successfully.")
+    return sheet
+
+def run_combine(context):
+    from combine_files import combine_files
+    sheets = {name: context[name] for name in COMBINED_SHEETS if name in context}
+    # Without the stage workbooks the combined workbook is the snapshot of this run
+    combine_files(sheets, backup=not _writes_stage_workbooks(context))
+    logger.info("✅ Files combined successfully.")
+
+def run_send_mail(context):
+    from send_mail import send_email
+    sheets = {name: context[name] for name in COMBINED_SHEETS if name in context}
+    send_email(sheets if len(sheets) == len(COMBINED_SHEETS) else None)
+    logger.info("✅ Mail sent successfully.")
+
+def sync_results_store(context=None):
+    """Import the standings that only exist as workbook into the results store (once per standing).
+
+    Runs before the standings stages, so their fingerprints read the same
+    history before and after the first run without changing the store.
+    """
+    for standing, workbook, import_workbook in (
+        ('KLASSEMENT', KLASSEMENT_FILE, results_store.import_rider_workbook),
+        ('REGELMATIGHEIDSCRITERIUM', REGELMATIGHEID_FILE, results_store.import_rider_workbook),
+        ('TEAMS STA', TEAMS_STA_FILE, results_store.import_team_workbook),
+        ('TEAMS MIXED', TEAMS_MIXED_FILE, results_store.import_team_workbook),
+    ):
+        import_workbook(standing, workbook, standing)
+
+def _standing_fingerprint(standing):
+    """A standing depends on the flags of the run and on its stored weeks before the race's week."""
+    def fingerprint(context):
+        race = results_store.race_id(context[SHARED_INPUTS]['uitslag'])
+        week = results_store.week_for_race(standing, race)
+        return {
+            'is_second_period_started': context['is_second_period_started'],
+            'write_stage_workbooks': _writes_stage_workbooks(context),
+            'week': week,
+            'history': results_store.history_digest(standing, week),
+        }
+    return fingerprint
+
+def _combine_fingerprint(context):
+    return {'backup': not _writes_stage_workbooks(context)}
+
+def _send_mail_fingerprint(context):
+    # Only mail again when the combined workbook or the distribution changed;
+    # recipients that already got the workbook are skipped by send_email
+    from send_mail import distribution_settings
+    return distribution_settings()
+
+def build_stage_graph():
+    """The weekly run as a graph of stages with their declared inputs and outputs."""
+    return [
+        Stage('deelnemers', run_download_deelnemers, (), (DEELNEMERS_FILE,), io=True, timeout=DOWNLOAD_TIMEOUT),
+        Stage('mail', run_check_mail, (), (RESULT_FILE,), io=True, timeout=MAIL_TIMEOUT),
+        Stage('inputs', load_shared_inputs, (DEELNEMERS_FILE, RESULT_FILE, TEMPLATE_FILE), (SHARED_INPUTS,)),
+        Stage('store', sync_results_store, (), (STORE_SYNCED,)),
+        Stage('klassement', run_klassement, (SHARED_INPUTS, STORE_SYNCED), ('KLASSEMENT', KLASSEMENT_FILE),
+              _standing_fingerprint('KLASSEMENT')),
+        Stage('regelmatigheid', run_regelmatigheidscriterium, (SHARED_INPUTS, STORE_SYNCED),
+              ('REGELMATIGHEIDSCRITERIUM', REGELMATIGHEID_FILE), _standing_fingerprint('REGELMATIGHEIDSCRITERIUM')),
+        Stage('teams_sta', run_teams_sta, (SHARED_INPUTS, STORE_SYNCED), ('TEAMS STA', TEAMS_STA_FILE),
+              _standing_fingerprint('TEAMS STA')),
+        Stage('teams_mixed', run_teams_mixed, (SHARED_INPUTS, STORE_SYNCED), ('TEAMS MIXED', TEAMS_MIXED_FILE),
+              _standing_fingerprint('TEAMS MIXED')),
+        Stage('combine', run_combine, tuple(COMBINED_SHEETS), (COMBINED_FILE,), _combine_fingerprint),
+        Stage('send_mail', run_send_mail, (COMBINED_FILE,), (), _send_mail_fingerprint),
+    ]
+
+def _producers(stages):
+    """Map every output to the name of the stage producing it."""
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"Output '{output}' is produced by both '{producers[output]}' and '{stage.name}'")
+            producers[output] = stage.name
+    return producers
+
+def stage_dependencies(stages):
+    """Map every stage name to the names of the stages producing its inputs."""
+    producers = _producers(stages)
+    return {
+        stage.name: {producers[i] for i in stage.inputs if i in producers and producers[i] != stage.name}
+        for stage in stages
+    }
+
+def _ready_stages(pending, dependencies, done):
+    return [stage for stage in pending if dependencies[stage.name] <= done]
+
+def _stage_key(stage, context, producers, keys):
+    """Fingerprint of a stage: its input files by content, in-memory inputs by the key of their producer."""
+    parts = {}
+    for name in stage.inputs:
+        if os.path.isfile(name):
+            parts[name] = file_sha256(name)
+        elif name in producers and producers[name] != stage.name:
+            parts[name] = keys.get(producers[name])
+        else:
+            parts[name] = None
+    if stage.fingerprint is not None:
+        parts['fingerprint'] = stage.fingerprint(context)
+    return build_cache.fingerprint(stage.name, parts)
+
+def _skip_if_current(stage, key, context):
+    """Reuse the previous output of an unchanged stage; False when the stage has to run."""
+    if stage.fingerprint is None or context.get('force') or not build_cache.is_current(stage.name, key):
+        return False
+    output = build_cache.load_output(stage.name)
+    if output is not None:
+        context[stage.outputs[0]] = output
+    logger.info(f"⏭️ Stage '{stage.name}' is up to date, skipped")
+    return True
+
+def _finish_stage(stage, key, result, context):
+    if result is not None:
+        context[stage.outputs[0]] = result
+    if stage.fingerprint is not None:
+        build_cache.save(stage.name, key, result, stage.outputs)
+
+def _run_stage(func, name, context):
+    with instrumentation.span(name, kind='stage'):
+        return func(context)
+
+def _run_stage_in_worker(func, name, context):
+    """Run a stage in a pool worker; its spans go back to the parent with the result."""
+    instrumentation.start_run(get_current_backup_run())
+    return _run_stage(func, name, context), instrumentation.collect()
+
+def _deadline(stage):
+    return None if stage.timeout is None else time.monotonic() + stage.timeout
+
+def _check_deadlines(deadlines):
+    """Fail the run when a running stage is past its timeout."""
+    now = time.monotonic()
+    for future, (stage, deadline) in deadlines.items():
+        if not future.done() and now >= deadline:
+            raise TimeoutError(f"Stage '{stage.name}' did not finish within {stage.timeout}s")
+
+def _wait_timeout(deadlines):
+    """Seconds until the first deadline of a running stage, None without deadlines."""
+    pending = [deadline for future, (stage, deadline) in deadlines.items() if not future.done()]
+    return max(0, min(pending) - time.monotonic()) if pending else None
+
+def run_stage_graph(stages, context, max_workers=None, parallel=True):
+    """Run each stage as soon as the stages it depends on have finished.
+
+    With ``parallel`` independent stages run concurrently on a process pool,
+    otherwise they run one after another in this process. ``io`` stages run on
+    threads in both cases. Stages whose fingerprint did not change are skipped
+    unless ``context['force']`` is set.
+    """
+    producers = _producers(stages)
+    dependencies = stage_dependencies(stages)
+    pending = list(stages)
+    done = set()
+    keys = {}
+    # Network stages: started on threads, collected when done or past their deadline
+    io_pool = ThreadPoolExecutor(thread_name_prefix='io-stage')
+    deadlines = {}
+
+    def start_io(stage):
+        future = io_pool.submit(_run_stage, stage.func, stage.name, context)
+        if stage.timeout is not None:
+            deadlines[future] = (stage, _deadline(stage))
+        return future
+
+    try:
+        if not parallel:
+            while pending:
+                ready = _ready_stages(pending, dependencies, done)
+                if not ready:
+                    raise ValueError(f"Stage graph has a cycle: {[stage.name for stage in pending]}")
+                io_running = {}
+                to_run = []
+                for stage in ready:
+                    keys[stage.name] = key = _stage_key(stage, context, producers, keys)
+                    if _skip_if_current(stage, key, context):
+                        continue
+                    if stage.io:
+                        io_running[start_io(stage)] = stage
+                    else:
+                        to_run.append(stage)
+                # The network stages of this round overlap with the others
+                for stage in to_run:
+                    _finish_stage(stage, keys[stage.name], _run_stage(stage.func, stage.name, context), context)
+                while io_running:
+                    finished, _ = wait(io_running, timeout=_wait_timeout(deadlines), return_when=FIRST_COMPLETED)
+                    _check_deadlines(deadlines)
+                    for future in finished:
+                        stage = io_running.pop(future)
+                        deadlines.pop(future, None)
+                        _finish_stage(stage, keys[stage.name], future.result(), context)
+                for stage in ready:
+                    done.add(stage.name)
+                    pending.remove(stage)
+            return context
+
+        # Every worker adds its backups to the manifest of this run
+        backup_run = get_current_backup_run()
+        running = {}
+        with ProcessPoolExecutor(max_workers, mp_context=POOL_CONTEXT, initializer=set_current_backup_run,
+                                 initargs=(backup_run,)) as pool:
+            while pending or running:
+                ready = _ready_stages(pending, dependencies, done)
+                for stage in ready:
+                    pending.remove(stage)
+                    keys[stage.name] = key = _stage_key(stage, context, producers, keys)
+                    if _skip_if_current(stage, key, context):
+                        done.add(stage.name)
+                    else:
+                        logger.info(f"▶️ Starting stage '{stage.name}'")
+                        if stage.io:
+                            future = start_io(stage)
+                        else:
+                            future = pool.submit(_run_stage_in_worker, stage.func, stage.name, context)
+                        running[future] = stage
+                if not running:
+                    if ready:
+                        # Only skipped stages: their dependants may be ready now
+                        continue
+                    if pending:
+                        raise ValueError(f"Stage graph has a cycle: {[stage.name for stage in pending]}")
+                    break
+
+                finished, _ = wait(running, timeout=_wait_timeout(deadlines), return_when=FIRST_COMPLETED)
+                _check_deadlines(deadlines)
+                for future in finished:
+                    stage = running.pop(future)
+                    deadlines.pop(future, None)
+                    result = future.result()
+                    if not stage.io:
+                        result, spans = result
+                        instrumentation.merge(spans)
+                    _finish_stage(stage, keys[stage.name], result, context)
+                    done.add(stage.name)
+        return context
+    finally:
+        # A stage past its timeout is left to its socket timeouts; the run does not wait for it
+        io_pool.shutdown(wait=False, cancel_futures=True)
+
+def run_pipeline(is_second_period_started, parallel=False, max_workers=None,
+                 write_stage_workbooks=WRITE_STAGE_WORKBOOKS, force=False, require_new_mail=True,
+                 download_roster=True):
+    """Run every stage of the weekly update as a function call instead of a subprocess.
+
+    The standings are handed to the combine stage in memory; the per-standing
+    workbooks in ``output`` are only written with ``write_stage_workbooks``.
+    Stages whose inputs did not change since the last run are skipped unless
+    ``force`` is set. Returns False when there was no new result in the mailbox
+    and nothing was updated; with ``force`` or without ``require_new_mail``
+    (e.g. a result file that was put in place by hand) the run goes on. Without
+    ``download_roster`` the roster file in place is used instead of the download.
+    """
+    context = {
+        'is_second_period_started': is_second_period_started,
+        'write_stage_workbooks': write_stage_workbooks,
+        'force': force,
+        'require_new_mail': require_new_mail,
+        'download_roster': download_roster,
+    }
+    # Once, here and not in the stages: the pool workers only look backups up
+    backup_store.import_legacy_backups()
+    # Every run writes a report of its spans next to the backups (see instrumentation)
+    instrumentation.start_run(get_current_backup_run())
+    status = 'failed'
+    try:
+        with instrumentation.span('run', parallel=parallel):
+            run_stage_graph(build_stage_graph(), context, max_workers=max_workers, parallel=parallel)
+        status = 'updated'
+        # Only now: after a failed stage the next run fetches the same email again
+        from check_mail import commit_processed_id
+        commit_processed_id()
+    except NoNewResult:
+        status = 'no_new_result'
+        logger.info("📭 No new result, standings not updated")
+        return False
+    except Exception as e:
+        logger.error(f"❌ Pipeline failed: {e}")
+        raise
+    finally:
+        try:
+            path = instrumentation.write_report(status=status, parallel=parallel, force=force)
+            logger.info(f"📊 Run report written to {path}")
+        except OSError as e:
+            logger.warning(f"⚠️ Could not write the run report: {e}")
+    return True
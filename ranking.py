@@ -0,0 +1,51 @@
+from instrumentation import traced
+from schema import PLACE_DTYPE
+
+# Categories that get their own placing column in the individual standings
+PLACING_CATEGORIES = ('STA', 'SEN', 'DAM')
+
+# How rows with the same score are placed:
+#   'order' - by their position in the (already sorted) frame: 1, 2, 3
+#   'min'   - shared place, the next one skipped: 1, 1, 3
+#   'dense' - shared place, no gap: 1, 1, 2
+#   'first' - by score, equal scores in order of appearance: 1, 2, 3
+TIE_POLICIES = ('order', 'min', 'dense', 'first')
+
+def placing_columns(column, groups):
+    """Names of the columns ``add_placings`` creates for ``column`` and ``groups``."""
+    if '{}' not in column:
+        return [column]
+    return [column.format(group) for group in groups]
+
+@traced('ranking')
+def add_placings(df, group_by, column, score=None, tie='order', groups=None):
+    """Add the place of every row within its ``group_by`` group, in one grouped pass.
+
+    With a ``{}`` in ``column`` every group gets its own column (``'Plaats {}'``
+    gives 'Plaats STA', 'Plaats SEN', ...) holding the places of that group's
+    rows and empty cells elsewhere; ``groups`` limits which groups get a column
+    (default: every group present, sorted). Without it all places go into one
+    column. ``score`` is the column to rank on, not needed for the 'order' tie
+    policy. Places are nullable int32; rows without a group get none.
+    """
+    if tie not in TIE_POLICIES:
+        raise ValueError(f"Unknown tie policy '{tie}', expected one of {TIE_POLICIES}")
+    if tie != 'order' and score is None:
+        raise ValueError(f"Tie policy '{tie}' needs a score column")
+
+    grouped = df.groupby(group_by, sort=False, observed=True)
+    if tie == 'order':
+        places = grouped.cumcount() + 1
+    else:
+        places = grouped[score].rank(method=tie)
+    places = places.where(df[group_by].notna()).astype(PLACE_DTYPE)
+
+    if '{}' not in column:
+        return df.assign(**{column: places})
+
+    if groups is None:
+        groups = sorted(df[group_by].dropna().unique())
+    return df.assign(**{
+        name: places.where(df[group_by] == group)
+        for name, group in zip(placing_columns(column, groups), groups)
+    })
@@ -0,0 +1,341 @@
+import argparse
+import io
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import backup_store
+import generate_klassement
+import generate_regelmatigheidscriterium
+import results_store
+import team_DAM_klassement
+import team_klassement
+from aggregation import aggregate
+from combine_files import combine_files
+from excel_export import write_workbook
+from ranking import add_placings, PLACING_CATEGORIES
+from schema import class_per_week
+from season_state import recompute_season_totals
+from team_scoring import finish_team_klassement, is_team, score_teams
+from utils import (
+    load_template_column_order,
+    export_columns,
+    get_current_backup_run,
+    parse_deelnemers,
+    parse_result,
+    calculate_points,
+    MAX_POINTS,
+    CLASS_CHANGE_POINTS,
+    DEELNEMERS_FILE,
+    RESULT_FILE
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Replaying a season recomputes every week from its race and roster at once,
+# instead of running the weekly scripts week after week. Points of all weeks
+# come from one grouped rank over the stacked races and the totals, class
+# changes and export order are computed on the riders×weeks matrix. The weekly
+# scripts' own rules, column order and tie handling are reused, so a replay
+# gives the same standings as the weekly runs it replaces.
+
+def _stack(frames):
+    """One long frame of per-week frames, with a ``week`` column counting from 1."""
+    return pd.concat([frame.assign(week=week) for week, frame in enumerate(frames, start=1)], ignore_index=True)
+
+def _snapshot_frame(snapshot, parse):
+    with backup_store.open_snapshot(snapshot) as f:
+        return parse(io.BytesIO(f.read()))
+
+def season_from_files(finish_files, roster_files=()):
+    """Races and rosters of a season from files, one per week.
+
+    Week ``n`` uses the ``n``-th roster; without rosters for the later weeks
+    the last given roster (or the current one) is used.
+    """
+    races = [parse_result(path) for path in finish_files]
+    roster_files = list(roster_files) or [DEELNEMERS_FILE]
+    rosters = [parse_deelnemers(path) for path in roster_files[:len(races)]]
+    rosters += [rosters[-1]] * (len(races) - len(rosters))
+    return races, rosters
+
+def season_from_backups():
+    """Races and rosters of a season from the backup store.
+
+    Every week takes the latest backed-up finish file of that week and the
+    first roster snapshot made in or after that run (the roster the week was
+    computed with); the current roster when there is none yet.
+    """
+    backup_store.import_legacy_backups()
+    finishes = {}
+    for snapshot in backup_store.list_snapshots(os.path.basename(RESULT_FILE)):
+        if snapshot['week'] is not None:
+            finishes[snapshot['week']] = snapshot
+    weeks = sorted(finishes)
+    if not weeks or weeks != list(range(1, len(weeks) + 1)):
+        raise ValueError(f"The backups do not hold a finish file for every week from 1: {weeks}")
+
+    roster_snapshots = backup_store.list_snapshots(os.path.basename(DEELNEMERS_FILE))
+    current_roster = None
+    races, rosters = [], []
+    for week in weeks:
+        races.append(_snapshot_frame(finishes[week], parse_result))
+        roster = next((s for s in roster_snapshots if s['run'] >= finishes[week]['run']), None)
+        if roster is None:
+            if current_roster is None:
+                current_roster = parse_deelnemers(DEELNEMERS_FILE)
+            rosters.append(current_roster)
+        else:
+            rosters.append(_snapshot_frame(roster, parse_deelnemers))
+    return races, rosters
+
+class RiderSeason:
+    """The riders×weeks matrices of an individual standing.
+
+    The riders are those of the first roster, in its order, as in a standing
+    that is built week by week.
+    """
+
+    def __init__(self, races, rosters):
+        self.n_weeks = len(races)
+        self.rosters = rosters
+        self.riders = rosters[0][['naam', 'bib', 'klasse', 'categorie']].reset_index(drop=True)
+        bibs = self.riders['bib']
+        weeks = range(1, self.n_weeks + 1)
+
+        roster_long = _stack(rosters)
+        points = calculate_points(roster_long, _stack(races), group_by='klasse', by=('week',))
+        weekly = roster_long[['week', 'bib']].assign(points=points.to_numpy())
+        weekly = weekly.drop_duplicates(subset=['week', 'bib'])
+        # Points per rider and week; riders missing from a week's roster get MAX_POINTS
+        self.points = (
+            weekly.pivot(index='bib', columns='week', values='points')
+            .reindex(index=bibs, columns=weeks).fillna(MAX_POINTS).to_numpy()
+        )
+        # Klasse per rider and week as a code into ``class_names``, -1 when the
+        # rider is not on that week's roster
+        classes = class_per_week(rosters)
+        self.class_names = classes['klasse'].cat.categories
+        self.klasse = (
+            classes.assign(code=classes['klasse'].cat.codes)
+            .pivot(index='bib', columns='week', values='code')
+            .reindex(index=bibs, columns=weeks).fillna(-1).to_numpy(dtype=np.int16)
+        )
+
+        # A class change in week w: the klasse differs from the roster of week w - 1
+        klasse = self.klasse
+        changed = np.zeros(klasse.shape, dtype=bool)
+        changed[:, 1:] = (klasse[:, 1:] >= 0) & (klasse[:, :-1] >= 0) & (klasse[:, 1:] != klasse[:, :-1])
+        self.changed = changed
+        # Latest change up to every week (-1 when none): the weeks before it count CLASS_CHANGE_POINTS
+        self.last_change = np.maximum.accumulate(np.where(changed, np.arange(self.n_weeks), -1), axis=1)
+
+    def matrix(self, week):
+        """Points of weeks 1..``week`` as the standing of ``week`` sees them, class changes applied."""
+        index = week - 1
+        earlier = np.arange(week)[None, :] < self.last_change[:, index][:, None]
+        return np.where(earlier, CLASS_CHANGE_POINTS, self.points[:, :week])
+
+    def class_change_bibs(self, week):
+        return self.riders['bib'][self.changed[:, week - 1]].tolist()
+
+def _order_codes(values):
+    """Sortable integer codes of object values, in the order pandas sorts them (missing values last)."""
+    values = pd.Series(values, dtype=object)
+    categories = sorted(values.dropna().unique())
+    codes = pd.Categorical(values, categories=categories).codes
+    return np.where(codes < 0, len(categories), codes)
+
+def rider_orders(season, rule, klasse_per_week):
+    """Row order of the standing after every week (positions into ``season.riders``).
+
+    Every week sorts the previous week's order by (klasse, total) with a stable
+    sort, exactly like the weekly run; ``klasse_per_week(week)`` gives the klasse
+    sorted on in that week.
+    """
+    orders = []
+    order = np.arange(len(season.riders))
+    for week in range(1, season.n_weeks + 1):
+        total = aggregate(season.matrix(week), rule)
+        klasse = _order_codes(np.asarray(klasse_per_week(week), dtype=object))
+        order = order[np.lexsort((total[order], klasse[order]))]
+        orders.append(order)
+    return orders
+
+def _week_frame(season, order, week):
+    df = season.riders.iloc[order].reset_index(drop=True)
+    matrix = season.matrix(week)[order]
+    return df.assign(**{str(w): matrix[:, w - 1] for w in range(1, week + 1)})
+
+def klassement_sheet(season, orders, week, template_columns, is_second_period_started):
+    """The KLASSEMENT sheet after ``week``."""
+    df = _week_frame(season, orders[week - 1], week)
+    week_cols = [str(w) for w in range(1, week + 1)]
+    df['Totaal'], df['1e Periode'], df['2e Periode'] = recompute_season_totals(
+        df, week_cols, generate_klassement.TOTAL_RULE, is_second_period_started
+    )
+    df = add_placings(df, 'klasse', 'Plaats Klasse', score='Totaal', tie='min')
+    df = add_placings(df, 'categorie', 'Plaats {}', groups=PLACING_CATEGORIES)
+    df = df.rename(columns={'bib': 'Nr.', 'naam': 'Naam', 'klasse': 'Klasse', 'categorie': 'Cat.'})
+    return df[export_columns(df.columns, template_columns)]
+
+def regelmatigheid_sheet(season, orders, week, template_columns, is_second_period_started):
+    """The REGELMATIGHEIDSCRITERIUM sheet after ``week``."""
+    df = _week_frame(season, orders[week - 1], week)
+    week_cols = [str(w) for w in range(1, week + 1)]
+    df['Totaal'], df['1e Periode'], df['2e Periode'] = recompute_season_totals(
+        df, week_cols, generate_regelmatigheidscriterium.TOTAL_RULE, is_second_period_started
+    )
+    df['current_klasse'] = _current_klasse(season, week)[orders[week - 1]]
+    df = add_placings(df, 'current_klasse', 'Plaats Klasse')
+    df = add_placings(df, 'categorie', 'Plaats {}', groups=PLACING_CATEGORIES)
+    df = df.drop(columns=['current_klasse'])
+    df = df.rename(columns={'bib': 'Nr.', 'naam': 'Naam', 'klasse': 'Klasse', 'categorie': 'Cat.'})
+    return df[export_columns(df.columns, template_columns)]
+
+def _current_klasse(season, week):
+    """The klasse of the roster of ``week``, 'Unknown' for riders not on it."""
+    codes = season.klasse[:, week - 1]
+    names = season.class_names.to_numpy(dtype=object)
+    return np.where(codes >= 0, names[np.maximum(codes, 0)], 'Unknown').astype(object)
+
+def team_weeks(module, races, rosters):
+    """Weekly ranking of every team of a team standing, for all weeks in one pass."""
+    roster_long = _stack([module.eligible_riders(roster) for roster in rosters])
+    points = calculate_points(roster_long, _stack(races), group_by=module.POINTS_GROUP, by=('week',))
+    punten_df = roster_long[['week', 'team', 'categorie']].assign(points=points.to_numpy())
+    scores = score_teams(punten_df, module.TEAM_RULE, 'points', by=('week',))
+    scores = scores[is_team(scores['team'])]
+    scores['points'] = scores.groupby('week')['points'].rank(method='min', ascending=False).astype(int)
+    return scores
+
+def team_sheet(module, scores, first_roster, week, is_second_period_started):
+    """A team standing's sheet after ``week``, from the weekly rankings of ``team_weeks``."""
+    week_col = f"{week}T"
+    earlier = scores[scores['week'] < week]
+    if earlier.empty:
+        team_klassement_df = pd.DataFrame({'team': first_roster['team'].unique()})
+    else:
+        team_klassement_df = earlier.pivot(index='team', columns='week', values='points')
+        team_klassement_df.columns = [f"{w}T" for w in team_klassement_df.columns]
+        team_klassement_df = team_klassement_df.rename_axis('team').reset_index()
+        team_klassement_df = team_klassement_df[is_team(team_klassement_df['team'])]
+    this_week = scores[scores['week'] == week].rename(columns={'points': week_col})
+    return finish_team_klassement(team_klassement_df, this_week[['team', week_col]], week_col, is_second_period_started)
+
+def _write_store(season, orders, races, rosters, team_scores, db_path):
+    """Store every replayed week, as the weekly runs would have."""
+    for module, order_of in ((generate_klassement, orders['KLASSEMENT']),
+                             (generate_regelmatigheidscriterium, orders['REGELMATIGHEIDSCRITERIUM'])):
+        for week in range(1, season.n_weeks + 1):
+            order = order_of[week - 1]
+            df = season.riders.iloc[order].assign(points=season.points[order, week - 1])
+            results_store.append_rider_week(
+                module.STANDING, week, df, 'points', rosters[week - 1],
+                class_change_bibs=season.class_change_bibs(week),
+                race=results_store.race_id(races[week - 1]), db_path=db_path
+            )
+    for module, scores in team_scores.items():
+        for week in range(1, season.n_weeks + 1):
+            results_store.append_team_week(
+                module.STANDING, week, scores[scores['week'] == week], 'points',
+                race=results_store.race_id(races[week - 1]), db_path=db_path
+            )
+
+def replay_season(races, rosters, is_second_period_started=False, template_columns=None, snapshots=False,
+                  write_store=True):
+    """Recompute the four standings for every week of a season and write the final exports.
+
+    ``races`` and ``rosters`` hold the parsed result and roster of every week in
+    order. The second period flag applies to the last week. With ``snapshots``
+    the combined workbook of every earlier week is added to the backup store.
+    With ``write_store`` the results store is replaced by the replayed weeks.
+    Returns the final sheets by sheet name.
+    """
+    if not races or len(races) != len(rosters):
+        raise ValueError("A replay needs one roster per race")
+    if template_columns is None:
+        template_columns = load_template_column_order()
+    n_weeks = len(races)
+    logger.info(f"🔁 Replaying {n_weeks} weeks")
+
+    season = RiderSeason(races, rosters)
+    orders = {
+        'KLASSEMENT': rider_orders(
+            season, generate_klassement.TOTAL_RULE, lambda week: season.riders['klasse']
+        ),
+        'REGELMATIGHEIDSCRITERIUM': rider_orders(
+            season, generate_regelmatigheidscriterium.TOTAL_RULE, lambda week: _current_klasse(season, week)
+        ),
+    }
+    team_scores = {module: team_weeks(module, races, rosters) for module in (team_klassement, team_DAM_klassement)}
+
+    def sheets_after(week, flag):
+        return {
+            'REGELMATIGHEIDSCRITERIUM': regelmatigheid_sheet(
+                season, orders['REGELMATIGHEIDSCRITERIUM'], week, template_columns, flag
+            ),
+            'KLASSEMENT': klassement_sheet(season, orders['KLASSEMENT'], week, template_columns, flag),
+            'TEAMS STA': team_sheet(team_klassement, team_scores[team_klassement], rosters[0], week, flag),
+            'TEAMS MIXED': team_sheet(
+                team_DAM_klassement, team_scores[team_DAM_klassement],
+                team_DAM_klassement.eligible_riders(rosters[0]), week, flag
+            ),
+        }
+
+    if snapshots:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for week in range(1, n_weeks):
+                path = os.path.join(tmp_dir, "wedstrijd_data_2025.xlsx")
+                write_workbook(path, sheets_after(week, False))
+                backup_store.add_snapshot(
+                    get_current_backup_run(), path, f"wedstrijd_data_2025_week_{week}.xlsx", week=week
+                )
+        logger.info(f"📁 Snapshots of weeks 1-{n_weeks - 1} saved to the backup store")
+
+    sheets = sheets_after(n_weeks, is_second_period_started)
+
+    if write_store:
+        db_path = f"{results_store.RESULTS_DB}.replay"
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        _write_store(season, orders, races, rosters, team_scores, db_path)
+        os.replace(db_path, results_store.RESULTS_DB)
+        # The season states describe the old weeks; they are rebuilt on the next run
+        for state_file in (generate_klassement.STATE_FILE, generate_regelmatigheidscriterium.STATE_FILE):
+            if os.path.isfile(state_file):
+                os.remove(state_file)
+        logger.info(f"💾 Results store rebuilt with {n_weeks} weeks")
+
+    write_workbook(generate_klassement.KLASSEMENT_FILE, {'KLASSEMENT': sheets['KLASSEMENT']})
+    write_workbook(generate_regelmatigheidscriterium.KLASSEMENT_FILE,
+                   {'REGELMATIGHEIDSCRITERIUM': sheets['REGELMATIGHEIDSCRITERIUM']})
+    write_workbook(team_klassement.TEAM_KLASSEMENT_FILE, {'TEAMS STA': sheets['TEAMS STA']})
+    write_workbook(team_DAM_klassement.TEAM_KLASSEMENT_FILE, {'TEAMS MIXED': sheets['TEAMS MIXED']})
+    combine_files(sheets)
+    logger.info(f"✅ Season replayed up to week {n_weeks}")
+    return sheets
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recompute all standings from the races of the season.")
+    parser.add_argument('finish_files', nargs='*', help="finish files of week 1, 2, ... in order")
+    parser.add_argument('--rosters', nargs='+', default=(),
+                        help="roster of every week (the last one is used for the later weeks); default: current roster")
+    parser.add_argument('--from-backups', action='store_true',
+                        help="take the finish files and rosters of every week from the backup store")
+    parser.add_argument('--second-period', action='store_true', help="the second period started with the last week")
+    parser.add_argument('--snapshots', action='store_true',
+                        help="also save the combined workbook of every earlier week in the backup store")
+    args = parser.parse_args()
+
+    if args.from_backups:
+        races, rosters = season_from_backups()
+    elif args.finish_files:
+        races, rosters = season_from_files(args.finish_files, args.rosters)
+    else:
+        parser.error("give the finish files of the season or --from-backups")
+    replay_season(races, rosters, args.second_period, snapshots=args.snapshots)
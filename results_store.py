@@ -0,0 +1,297 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from instrumentation import traced
+from schema import compact
+from utils import CLASS_CHANGE_POINTS
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DB = "output/results.sqlite"
+SEASON = 2025
+# Upper bound for "every week" in the week filters
+MAX_WEEK = 1 << 30
+
+# Week results are only ever appended. A class change is recorded as its own row
+# and applied when the weeks are read, instead of rewriting the earlier weeks.
+# Every week remembers the race it was computed from; processing the same race
+# again replaces that week instead of adding a new one.
+# Rider and team columns have no declared type so the values of the roster
+# (text or numbers) are stored as they are.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS riders (
+    standing TEXT NOT NULL,
+    season INTEGER NOT NULL,
+    bib INTEGER NOT NULL,
+    naam,
+    klasse,
+    categorie,
+    PRIMARY KEY (standing, season, bib)
+);
+CREATE TABLE IF NOT EXISTS rider_points (
+    standing TEXT NOT NULL,
+    season INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    bib INTEGER NOT NULL,
+    klasse,
+    categorie,
+    points INTEGER,
+    position INTEGER,
+    PRIMARY KEY (standing, season, week, bib)
+);
+CREATE TABLE IF NOT EXISTS class_changes (
+    standing TEXT NOT NULL,
+    season INTEGER NOT NULL,
+    bib INTEGER NOT NULL,
+    up_to_week INTEGER NOT NULL,
+    points INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS class_changes_standing ON class_changes (standing, season);
+CREATE TABLE IF NOT EXISTS weeks (
+    standing TEXT NOT NULL,
+    season INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    race TEXT,
+    PRIMARY KEY (standing, season, week)
+);
+CREATE TABLE IF NOT EXISTS team_points (
+    standing TEXT NOT NULL,
+    season INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    team NOT NULL,
+    points INTEGER,
+    PRIMARY KEY (standing, season, week, team)
+);
+"""
+
+def connect(db_path=None):
+    """Open the results store, creating the tables on first use."""
+    db_path = db_path or RESULTS_DB
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    # The standings stages may write concurrently when the pipeline runs in parallel
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+def last_week(standing, season=SEASON, db_path=None):
+    """The highest stored week of a standing, 0 when nothing is stored yet."""
+    with closing(connect(db_path)) as conn:
+        row = conn.execute(
+            """
+            SELECT MAX(week) FROM (
+                SELECT MAX(week) AS week FROM rider_points WHERE standing = ? AND season = ?
+                UNION ALL
+                SELECT MAX(week) AS week FROM team_points WHERE standing = ? AND season = ?
+            )
+            """,
+            (standing, season, standing, season),
+        ).fetchone()
+    return row[0] or 0
+
+def next_week(standing, season=SEASON, db_path=None):
+    return last_week(standing, season, db_path) + 1
+
+def race_id(uitslag):
+    """Identity of a race: a digest of its finish order (bib and plaats)."""
+    rows = uitslag[['bib', 'plaats']].astype(str)
+    return hashlib.sha256(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes()).hexdigest()
+
+def week_for_race(standing, race, season=SEASON, db_path=None):
+    """The week ``race`` is stored as: the latest week if it was computed from it, else the next one."""
+    week = last_week(standing, season, db_path)
+    if week:
+        with closing(connect(db_path)) as conn:
+            row = conn.execute(
+                "SELECT race FROM weeks WHERE standing = ? AND season = ? AND week = ?", (standing, season, week)
+            ).fetchone()
+        if row is not None and row[0] == race:
+            return week
+    return week + 1
+
+def history_digest(standing, before_week, season=SEASON, db_path=None):
+    """Digest of everything stored for a standing before ``before_week``.
+
+    Two runs that start from the same digest (and the same inputs) compute the
+    same week, which is what lets the pipeline skip an unchanged stage.
+    """
+    digest = hashlib.sha256(f"{standing}:{season}:{before_week}".encode())
+    with closing(connect(db_path)) as conn:
+        # Class changes recorded with a week cover the weeks before it
+        for query, bound in (
+            ("SELECT week, bib, klasse, categorie, points, position FROM rider_points "
+             "WHERE standing = ? AND season = ? AND week < ? ORDER BY week, bib", before_week),
+            ("SELECT bib, up_to_week, points FROM class_changes "
+             "WHERE standing = ? AND season = ? AND up_to_week < ? ORDER BY rowid", before_week - 1),
+            ("SELECT week, team, points FROM team_points "
+             "WHERE standing = ? AND season = ? AND week < ? ORDER BY week, CAST(team AS TEXT)", before_week),
+        ):
+            for row in conn.execute(query, (standing, season, bound)):
+                digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+@traced('store_read')
+def load_rider_weeks(standing, season=SEASON, db_path=None, before_week=None):
+    """Riders of an individual standing with one column of points per week.
+
+    Rows come in the order of the latest export, klasse and categorie as
+    categoricals; recorded class changes are applied to the weeks they cover.
+    With ``before_week`` only the earlier weeks are read (to compute that week
+    again). Empty when there are no weeks yet.
+    """
+    before_week = before_week or MAX_WEEK
+    with closing(connect(db_path)) as conn:
+        riders = pd.read_sql_query(
+            """
+            SELECT r.naam, r.bib, r.klasse, r.categorie
+            FROM riders r
+            LEFT JOIN rider_points p
+                ON p.standing = r.standing AND p.season = r.season AND p.bib = r.bib
+                AND p.week = (SELECT MAX(week) FROM rider_points WHERE standing = ? AND season = ? AND week < ?)
+            WHERE r.standing = ? AND r.season = ?
+            ORDER BY p.position, r.rowid
+            """,
+            conn,
+            params=(standing, season, before_week, standing, season),
+        )
+        points = pd.read_sql_query(
+            "SELECT week, bib, points FROM rider_points WHERE standing = ? AND season = ? AND week < ?",
+            conn,
+            params=(standing, season, before_week),
+        )
+        changes = pd.read_sql_query(
+            "SELECT bib, up_to_week, points FROM class_changes WHERE standing = ? AND season = ? ORDER BY rowid",
+            conn,
+            params=(standing, season),
+        )
+
+    if points.empty:
+        return riders.iloc[:0]
+
+    if not changes.empty:
+        # Every change overwrites the weeks up to the change, the latest value wins
+        changes = changes.groupby('bib').agg(up_to_week=('up_to_week', 'max'), change_points=('points', 'last'))
+        points = points.merge(changes, left_on='bib', right_index=True, how='left')
+        affected = points['week'] <= points['up_to_week']
+        points.loc[affected, 'points'] = points.loc[affected, 'change_points']
+
+    weeks = points.pivot(index='bib', columns='week', values='points')
+    weeks.columns = [str(week) for week in weeks.columns]
+    return compact(riders).merge(weeks, left_on='bib', right_index=True, how='inner')
+
+@traced('store_write', measure=lambda standing, week, standings_df, *args, **kwargs: {'rows': len(standings_df)})
+def append_rider_week(standing, week, standings_df, week_col, roster, class_change_bibs=(),
+                      class_change_points=CLASS_CHANGE_POINTS, race=None, season=SEASON, db_path=None):
+    """Store one week of an individual standing in a single transaction.
+
+    ``standings_df`` is the standing in export order with ``bib``, ``naam``,
+    ``klasse``, ``categorie`` and ``week_col``. New riders are added; the class
+    and category of the week are taken from ``roster``. A week that is already
+    stored (the same race processed again) is replaced.
+    """
+    week_roster = roster.drop_duplicates('bib').set_index('bib')
+    rows = standings_df[['bib', week_col]].reset_index(drop=True)
+    klasse = rows['bib'].map(week_roster['klasse'])
+    categorie = rows['bib'].map(week_roster['categorie'])
+
+    with closing(connect(db_path)) as conn, conn:
+        _replace_week(conn, 'rider_points', standing, season, week, race)
+        conn.executemany(
+            "INSERT OR IGNORE INTO riders (standing, season, bib, naam, klasse, categorie) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (standing, season, int(r.bib), _value(r.naam), _value(r.klasse), _value(r.categorie))
+                for r in standings_df[['bib', 'naam', 'klasse', 'categorie']].itertuples(index=False)
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO rider_points (standing, season, week, bib, klasse, categorie, points, position) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (standing, season, week, int(bib), _value(k), _value(c), _value(p), position)
+                for position, (bib, p, k, c) in enumerate(zip(rows['bib'], rows[week_col], klasse, categorie))
+            ),
+        )
+        if week > 1:
+            conn.executemany(
+                "INSERT INTO class_changes (standing, season, bib, up_to_week, points) "
+                "SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS ("
+                "SELECT 1 FROM class_changes WHERE standing = ? AND season = ? AND bib = ? AND up_to_week = ?)",
+                (
+                    (standing, season, int(bib), week - 1, class_change_points, standing, season, int(bib), week - 1)
+                    for bib in class_change_bibs
+                ),
+            )
+
+@traced('store_read')
+def load_team_weeks(standing, season=SEASON, db_path=None, before_week=None):
+    """Teams of a team standing with one ``<week>T`` column per week, sorted by team.
+
+    With ``before_week`` only the earlier weeks are read.
+    """
+    with closing(connect(db_path)) as conn:
+        points = pd.read_sql_query(
+            "SELECT week, team, points FROM team_points WHERE standing = ? AND season = ? AND week < ?",
+            conn,
+            params=(standing, season, before_week or MAX_WEEK),
+        )
+    if points.empty:
+        return pd.DataFrame(columns=['team'])
+    weeks = points.pivot(index='team', columns='week', values='points')
+    weeks.columns = [f"{week}T" for week in weeks.columns]
+    return weeks.rename_axis('team').reset_index()
+
+@traced('store_write', measure=lambda standing, week, team_points, *args, **kwargs: {'rows': len(team_points)})
+def append_team_week(standing, week, team_points, week_col, race=None, season=SEASON, db_path=None):
+    """Store the weekly ranking of every team in a team standing, replacing a stored week."""
+    with closing(connect(db_path)) as conn, conn:
+        _replace_week(conn, 'team_points', standing, season, week, race)
+        conn.executemany(
+            "INSERT INTO team_points (standing, season, week, team, points) VALUES (?, ?, ?, ?, ?)",
+            (
+                (standing, season, week, team, _value(p))
+                for team, p in zip(team_points['team'], team_points[week_col])
+            ),
+        )
+
+def _replace_week(conn, table, standing, season, week, race):
+    """Drop a stored week of ``table`` and record the race the week is computed from."""
+    conn.execute(f"DELETE FROM {table} WHERE standing = ? AND season = ? AND week = ?", (standing, season, week))
+    conn.execute(
+        "INSERT OR REPLACE INTO weeks (standing, season, week, race) VALUES (?, ?, ?, ?)",
+        (standing, season, week, race),
+    )
+
+def _value(value):
+    """Plain Python value for sqlite; NaN becomes NULL."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+def import_rider_workbook(standing, workbook, sheet_name, season=SEASON, db_path=None):
+    """Load an individual standing that only exists as workbook into the store (once)."""
+    if last_week(standing, season, db_path) or not os.path.isfile(workbook):
+        return
+    df = pd.read_excel(workbook, sheet_name=sheet_name)
+    df = df.rename(columns={'Nr.': 'bib', 'Naam': 'naam', 'Klasse': 'klasse', 'Cat.': 'categorie'})
+    week_cols = sorted((col for col in df.columns if str(col).isdigit()), key=int)
+    roster = df[['bib', 'klasse', 'categorie']]
+    for col in week_cols:
+        append_rider_week(standing, int(col), df, col, roster, season=season, db_path=db_path)
+    logger.info(f"📥 Imported {len(week_cols)} weeks of {standing} from {workbook}")
+
+def import_team_workbook(standing, workbook, sheet_name, season=SEASON, db_path=None):
+    """Load a team standing that only exists as workbook into the store (once)."""
+    if last_week(standing, season, db_path) or not os.path.isfile(workbook):
+        return
+    df = pd.read_excel(workbook, sheet_name=sheet_name)
+    week_cols = sorted(
+        (col for col in df.columns if str(col).endswith('T') and str(col)[:-1].isdigit()),
+        key=lambda c: int(c[:-1])
+    )
+    for col in week_cols:
+        append_team_week(standing, int(col[:-1]), df, col, season=season, db_path=db_path)
+    logger.info(f"📥 Imported {len(week_cols)} weeks of {standing} from {workbook}")
@@ -0,0 +1,107 @@
+import logging
+from contextlib import closing
+
+import pandas as pd
+
+import backup_store
+
+logger = logging.getLogger(__name__)
+
+# Every roster version is stored once, keyed by the SHA-256 of the roster file
+# (the same key as its blob in the backup store), as one (bib, klasse) row per
+# rider. The class changes between two versions are computed once and kept.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roster_versions (
+    sha256 TEXT PRIMARY KEY,
+    riders INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS roster_classes (
+    sha256 TEXT NOT NULL,
+    bib INTEGER NOT NULL,
+    klasse,
+    PRIMARY KEY (sha256, bib)
+);
+CREATE TABLE IF NOT EXISTS roster_diffs (
+    old_sha256 TEXT NOT NULL,
+    new_sha256 TEXT NOT NULL,
+    changes INTEGER NOT NULL,
+    PRIMARY KEY (old_sha256, new_sha256)
+);
+CREATE TABLE IF NOT EXISTS roster_class_changes (
+    old_sha256 TEXT NOT NULL,
+    new_sha256 TEXT NOT NULL,
+    bib INTEGER NOT NULL,
+    klasse_oud,
+    klasse_nieuw
+);
+CREATE INDEX IF NOT EXISTS roster_class_changes_pair ON roster_class_changes (old_sha256, new_sha256);
+"""
+
+def connect(db_path=None):
+    """Open the roster history, kept next to the backup index."""
+    conn = backup_store.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+def has_version(sha, db_path=None):
+    with closing(connect(db_path)) as conn:
+        return conn.execute("SELECT 1 FROM roster_versions WHERE sha256 = ?", (sha,)).fetchone() is not None
+
+def record_version(sha, roster, db_path=None):
+    """Store the class of every rider of a roster version (``bib`` and ``klasse`` columns), once."""
+    riders = roster[['bib', 'klasse']].dropna().drop_duplicates('bib')
+    with closing(connect(db_path)) as conn, conn:
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO roster_versions (sha256, riders) VALUES (?, ?)", (sha, len(riders))
+        ).rowcount
+        if inserted:
+            conn.executemany(
+                "INSERT INTO roster_classes (sha256, bib, klasse) VALUES (?, ?, ?)",
+                ((sha, int(bib), klasse) for bib, klasse in zip(riders['bib'], riders['klasse'])),
+            )
+
+def _load_version(conn, sha):
+    return pd.read_sql_query("SELECT bib, klasse FROM roster_classes WHERE sha256 = ?", conn, params=(sha,))
+
+def class_changes(old_sha, new_sha, load_roster, db_path=None):
+    """Riders whose class differs between two roster versions, as ``{bib: (old, new)}``.
+
+    The diff is read from the history when it was computed before. Otherwise
+    both versions are compared with one merge; a version that is not in the
+    history yet is loaded with ``load_roster(sha)`` and recorded first.
+    """
+    if old_sha == new_sha:
+        return {}
+    with closing(connect(db_path)) as conn:
+        cached = conn.execute(
+            "SELECT 1 FROM roster_diffs WHERE old_sha256 = ? AND new_sha256 = ?", (old_sha, new_sha)
+        ).fetchone()
+        if cached:
+            rows = conn.execute(
+                "SELECT bib, klasse_oud, klasse_nieuw FROM roster_class_changes "
+                "WHERE old_sha256 = ? AND new_sha256 = ? ORDER BY rowid",
+                (old_sha, new_sha),
+            ).fetchall()
+            return {bib: (oud, nieuw) for bib, oud, nieuw in rows}
+
+    for sha in (old_sha, new_sha):
+        if not has_version(sha, db_path):
+            record_version(sha, load_roster(sha), db_path)
+
+    with closing(connect(db_path)) as conn, conn:
+        merged = _load_version(conn, old_sha).merge(
+            _load_version(conn, new_sha), on='bib', suffixes=('_oud', '_nieuw')
+        )
+        changed = merged[merged['klasse_oud'] != merged['klasse_nieuw']]
+        if conn.execute(
+            "INSERT OR IGNORE INTO roster_diffs (old_sha256, new_sha256, changes) VALUES (?, ?, ?)",
+            (old_sha, new_sha, len(changed)),
+        ).rowcount:
+            conn.executemany(
+                "INSERT INTO roster_class_changes (old_sha256, new_sha256, bib, klasse_oud, klasse_nieuw) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((old_sha, new_sha, int(bib), oud, nieuw)
+                 for bib, oud, nieuw in zip(changed['bib'], changed['klasse_oud'], changed['klasse_nieuw'])),
+            )
+    logger.info(f"🔁 {len(changed)} klasse wissels between roster versions {old_sha[:12]} and {new_sha[:12]}")
+    return dict(zip(changed['bib'].tolist(), zip(changed['klasse_oud'], changed['klasse_nieuw'])))
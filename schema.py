@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+# Column types of the roster, result and standings frames the stages pass on.
+#
+# Class, category and team repeat a handful of values over the whole field, so
+# they are categoricals: one small integer code per row and the values once.
+# The categories are sorted, numbers before text, so sorting on the codes puts
+# the rows in the order sorting the values would (the standings sort on klasse).
+# Weekly points run from 0 to MAX_POINTS and fit in int16; places are nullable
+# int32, as a field can outgrow int16. Rider names are unique per rider and stay
+# plain strings.
+CATEGORY_COLUMNS = ('klasse', 'categorie', 'team')
+POINTS_DTYPE = np.int16
+PLACE_DTYPE = 'Int32'
+
+def _category_order(value):
+    return (isinstance(value, str), value)
+
+def categorical(values):
+    """``values`` as a categorical with sorted categories, missing values kept."""
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    categories = sorted(values.dropna().unique(), key=_category_order)
+    return values.astype(pd.CategoricalDtype(categories))
+
+def compact(df, columns=CATEGORY_COLUMNS):
+    """``df`` with its class, category and team columns (those present) as categoricals."""
+    return df.assign(**{col: categorical(df[col]) for col in columns if col in df.columns})
+
+def points(values, fill):
+    """Weekly points (a series or a frame of week columns) as int16, missing points as ``fill``."""
+    return values.fillna(fill).astype(POINTS_DTYPE)
+
+def class_per_week(rosters):
+    """The class and category of every rider in every week, one row per (week, bib).
+
+    ``rosters`` holds the roster of week 1, 2, ... in order. The table is long:
+    a season adds rows, not columns, and every week shares the same categories.
+    """
+    weeks = pd.concat(
+        [roster[['bib', 'klasse', 'categorie']].assign(week=np.int16(week))
+         for week, roster in enumerate(rosters, start=1)],
+        ignore_index=True,
+    )
+    weeks = compact(weeks.drop_duplicates(subset=['week', 'bib']))
+    return weeks[['week', 'bib', 'klasse', 'categorie']].reset_index(drop=True)
@@ -0,0 +1,165 @@
+import logging
+import os
+
+import numpy as np
+
+from aggregation import aggregate, aggregate_periods
+from instrumentation import traced
+from utils import CLASS_CHANGE_POINTS, MAX_POINTS
+
+logger = logging.getLogger(__name__)
+
+# Recompute every total from all week columns as well and compare with the state
+VERIFY_SEASON_STATE = os.environ.get('VERIFY_SEASON_STATE', 'False').lower() == 'true'
+
+def _as_points(values):
+    """Weekly points as an int array, or ValueError when a value does not fit the histogram."""
+    values = np.asarray(values, dtype=float)
+    if values.size and (
+        not np.isfinite(values).all()
+        or (values < 0).any()
+        or (values > MAX_POINTS).any()
+        or (values != np.round(values)).any()
+    ):
+        raise ValueError("points must be whole numbers between 0 and MAX_POINTS")
+    return values.astype(np.int64)
+
+class SeasonState:
+    """Per-rider histogram of the weekly points of a season.
+
+    Points are whole numbers from 0 to MAX_POINTS, so counting how often every
+    rider scored each value is enough to total any "best k of n weeks" rule
+    without keeping the weeks themselves. Absorbing a week is one increment per
+    rider and totalling costs the same whatever the number of weeks.
+    """
+
+    def __init__(self, bibs, counts, weeks):
+        self.bibs = np.asarray(bibs)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.weeks = [str(week) for week in weeks]
+
+    @classmethod
+    def from_matrix(cls, bibs, points, weeks):
+        """Build the state from a riders×weeks points matrix (the full recompute)."""
+        points = _as_points(points).reshape(len(bibs), len(weeks))
+        counts = np.zeros((len(bibs), MAX_POINTS + 1), dtype=np.int64)
+        rows = np.repeat(np.arange(len(bibs)), len(weeks))
+        np.add.at(counts, (rows, points.ravel()), 1)
+        return cls(bibs, counts, weeks)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['bibs'], data['counts'], data['weeks'])
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, bibs=self.bibs, counts=self.counts.astype(np.uint16), weeks=np.array(self.weeks))
+        os.replace(tmp_path, path)
+
+    def reorder(self, bibs):
+        """The same state with its rows in the order of ``bibs``, or None if the riders differ."""
+        bibs = np.asarray(bibs)
+        if len(bibs) != len(self.bibs) or len(np.unique(bibs)) != len(bibs):
+            return None
+        order = np.argsort(self.bibs, kind='stable')
+        positions = np.searchsorted(self.bibs[order], bibs)
+        positions = np.clip(positions, 0, len(bibs) - 1)
+        rows = order[positions]
+        if len(bibs) and not (self.bibs[rows] == bibs).all():
+            return None
+        return SeasonState(bibs, self.counts[rows], self.weeks)
+
+    def add_week(self, points, week):
+        """Absorb one week of points, aligned with ``self.bibs``."""
+        self.counts[np.arange(len(self.bibs)), _as_points(points)] += 1
+        self.weeks.append(str(week))
+
+    def reset_weeks(self, mask, value):
+        """Give the riders selected by ``mask`` ``value`` points for every absorbed week."""
+        self.counts[mask] = 0
+        self.counts[mask, value] = len(self.weeks)
+
+    def totals(self, rule):
+        """Total per rider of the best ``rule(n_weeks)`` weeks."""
+        k = rule(len(self.weeks))
+        lower = np.cumsum(self.counts, axis=1) - self.counts
+        taken = np.clip(k - lower, 0, self.counts)
+        return taken @ np.arange(MAX_POINTS + 1)
+
+def season_periods(week_cols, is_second_period_started):
+    """Split the sorted week columns into the 1e and 2e Periode."""
+    if is_second_period_started and week_cols:
+        second_period_start = int(week_cols[-1])
+        first_period_weeks = [col for col in week_cols if int(col) < second_period_start]
+        second_period_weeks = [col for col in week_cols if int(col) >= second_period_start]
+    else:
+        first_period_weeks = week_cols
+        second_period_weeks = []
+    return first_period_weeks, second_period_weeks
+
+def recompute_season_totals(df, week_cols, rule, is_second_period_started):
+    """Totaal, 1e and 2e Periode from every week column."""
+    first_period_weeks, second_period_weeks = season_periods(week_cols, is_second_period_started)
+    totals = aggregate_periods(
+        df, {'total': week_cols, 'first': first_period_weeks, 'second': second_period_weeks}, rule
+    )
+    return totals['total'], totals['first'], totals['second']
+
+def _load_state(state_path, bibs, weeks):
+    """The persisted state if it holds exactly these riders and weeks, else None."""
+    if not os.path.isfile(state_path):
+        return None
+    try:
+        state = SeasonState.load(state_path)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read season state {state_path}: {e}")
+        return None
+    if state.weeks != [str(week) for week in weeks]:
+        return None
+    return state.reorder(bibs)
+
+@traced('aggregation', measure=lambda df, week_cols, *args, **kwargs: {'rows': len(df), 'columns': len(week_cols)})
+def update_season_totals(df, week_cols, week_col, rule, state_path, is_second_period_started, reset_bibs=(),
+                         reset_value=CLASS_CHANGE_POINTS):
+    """Totaal, 1e and 2e Periode after adding ``week_col``, without rescanning earlier weeks.
+
+    The state of the earlier weeks is read from ``state_path``; riders in
+    ``reset_bibs`` get ``reset_value`` for those weeks (class change). When the
+    state is missing or does not match ``df`` it is rebuilt from the week
+    columns. Falls back to a full recompute if the points do not fit the state.
+    """
+    bibs = df['bib'].to_numpy()
+    previous_weeks = [col for col in week_cols if col != week_col]
+    try:
+        state = _load_state(state_path, bibs, previous_weeks)
+        if state is None:
+            state = SeasonState.from_matrix(bibs, df[previous_weeks].to_numpy(), previous_weeks)
+        state.reset_weeks(np.isin(bibs, list(reset_bibs)), reset_value)
+
+        previous = state.totals(rule)
+        current = _as_points(df[week_col].to_numpy())
+        state.add_week(current, week_col)
+    except ValueError as e:
+        logger.info(f"ℹ️ Recomputing season totals from all weeks: {e}")
+        return recompute_season_totals(df, week_cols, rule, is_second_period_started)
+
+    totaal = state.totals(rule)
+    if is_second_period_started:
+        # The 2e Periode starts with the week being added
+        eerste, tweede = previous, aggregate(current[:, None], rule)
+    else:
+        eerste, tweede = totaal, 0
+
+    if VERIFY_SEASON_STATE:
+        expected = recompute_season_totals(df, week_cols, rule, is_second_period_started)
+        if not all(np.array_equal(np.broadcast_to(a, len(df)), np.broadcast_to(b, len(df)))
+                   for a, b in zip((totaal, eerste, tweede), expected)):
+            logger.warning("⚠️ Season state does not match the full recompute, using the recompute")
+            if os.path.isfile(state_path):
+                os.remove(state_path)
+            return expected
+        logger.info("✅ Season state matches the full recompute")
+
+    state.save(state_path)
+    return totaal, eerste, tweede
@@ -1,48 +1,287 @@
-import smtplib
+import argparse
+import html
+import io
+import json
 import os
+import re
+import smtplib
+import tempfile
+import time
+import zipfile
 from email.message import EmailMessage
+
+import pandas as pd
 from dotenv import load_dotenv
 load_dotenv()
 import logging
+
+from excel_export import write_workbook
+from input_cache import file_sha256
+from instrumentation import traced
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Email configuration
-SMTP_SERVER = 'smtp.gmail.com'
-SMTP_PORT = 587
+# Email configuration; SMTP_SERVER, SMTP_PORT and SMTP_STARTTLS=False point the
+# mail at a local debugging server
+SMTP_SERVER = os.getenv("SMTP_SERVER", 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", 'True').lower() == 'true'
+SMTP_TIMEOUT = 60
 EMAIL_ADDRESS = os.getenv("EMAIL_ACCOUNT")      # Replace with your email
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")           # Replace with your app password or email password
+# Comma separated; "adres:klasse=A" or "adres:team=Naam" only gets that part of the standings
 EMAIL_RECIPIENTS = os.getenv("EMAIL_RECIPIENTS", "")  # This returns a string
-RECIPIENT = [email.strip() for email in EMAIL_RECIPIENTS.split(",") if email.strip()]  # This works
+EMAIL_ZIP = os.getenv("EMAIL_ZIP", 'False').lower() == 'true'
+EMAIL_HTML_SUMMARY = os.getenv("EMAIL_HTML_SUMMARY", 'False').lower() == 'true'
 
 # File to send
 ATTACHMENT_PATH = 'wedstrijd_data_2025.xlsx'
+XLSX_TYPE = ('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+SELECTIONS = ('klasse', 'team')
+# Recipients that already got the current workbook, so a rerun after a failure
+# only mails the ones that are missing
+SENT_LOG = os.path.join(".cache", "mail_sent.json")
+SEND_ATTEMPTS = 3
+RETRY_SECONDS = 10
+SUMMARY_ROWS = 3
 
-def send_email():
-    try:
-        msg = EmailMessage()
-        msg['Subject'] = 'Wedstrijd Data 2025'
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = ', '.join(RECIPIENT)  # Join multiple recipients with a comma
-        msg.set_content(
-            "Beste,\n\nIn de bijlage vindt u het aangepaste klassement voor deze week ('wedstrijd_data_2025.xlsx').\n\nMet vriendelijke groet,\nUw automatiseringsscript"
-        )
-
-        # Attach the file
+def parse_recipients(text=EMAIL_RECIPIENTS):
+    """``{selection: [addresses]}``; the selection is None (everything) or ``(kind, value)``."""
+    distribution = {}
+    for entry in text.split(","):
+        address, _, selection = entry.strip().partition(":")
+        if not address:
+            continue
+        if selection:
+            kind, _, value = selection.partition("=")
+            kind, value = kind.strip().lower(), value.strip()
+            if kind not in SELECTIONS or not value:
+                raise ValueError(f"Unknown selection '{selection}' for {address}, use klasse=... or team=...")
+            selection = (kind, value)
+        distribution.setdefault(selection or None, []).append(address.strip())
+    return distribution
+
+def distribution_settings():
+    """What decides who gets which mail, for the fingerprint of the mail stage."""
+    return {'recipients': EMAIL_RECIPIENTS, 'zip': EMAIL_ZIP, 'html': EMAIL_HTML_SUMMARY}
+
+def _is_rider_sheet(df):
+    return 'Klasse' in df.columns
+
+def tailored_sheets(sheets, selection, deelnemers=None):
+    """The part of ``sheets`` a ``(kind, value)`` selection is about.
+
+    ``klasse``: the rider standings of that class. ``team``: the team standings
+    row of the team and its riders in the rider standings.
+    """
+    kind, value = selection
+    if kind == 'klasse':
+        return {
+            name: df[df['Klasse'].astype(str).str.strip().str.upper() == value.upper()]
+            for name, df in sheets.items() if _is_rider_sheet(df)
+        }
+    if deelnemers is None:
+        from utils import load_deelnemers
+        deelnemers = load_deelnemers()
+    bibs = deelnemers.loc[deelnemers['team'].astype(str).str.strip() == value, 'bib']
+    tailored = {}
+    for name, df in sheets.items():
+        rows = df['Nr.'].isin(bibs) if _is_rider_sheet(df) else df['team'].astype(str).str.strip() == value
+        tailored[name] = df[rows]
+    return tailored
+
+def summary_html(sheets, week=None):
+    """A short HTML overview: the leaders per class and the top of the team standings."""
+    parts = [f"<p>Stand na week {week}.</p>" if week else ""]
+    for name, df in sheets.items():
+        if df.empty:
+            continue
+        if _is_rider_sheet(df):
+            top = df.sort_values(['Klasse', 'Plaats Klasse']).groupby('Klasse', observed=True).head(SUMMARY_ROWS)
+            top = top[['Klasse', 'Plaats Klasse', 'Naam', 'Totaal']]
+        else:
+            top = df.sort_values('Plaats').head(SUMMARY_ROWS * 2)[['Plaats', 'team', 'Totaal']]
+        parts.append(f"<h3>{html.escape(name)}</h3>")
+        parts.append(top.to_html(index=False, border=0, na_rep=""))
+    return "<html><body>" + "\n".join(parts) + "</body></html>"
+
+def _latest_week(sheets):
+    weeks = [int(column) for df in sheets.values() for column in df.columns if str(column).isdigit()]
+    return max(weeks, default=None)
+
+def attachment(sheets, selection, tmp_dir, zip_attachment=False):
+    """``(data, maintype, subtype, filename)`` of the workbook for ``selection``."""
+    file_name = os.path.basename(ATTACHMENT_PATH)
+    if selection is None:
         with open(ATTACHMENT_PATH, 'rb') as f:
-            file_data = f.read()
-            file_name = os.path.basename(ATTACHMENT_PATH)
-            msg.add_attachment(file_data, maintype='application', subtype='vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename=file_name)
+            data = f.read()
+    else:
+        stem, ext = os.path.splitext(file_name)
+        value = re.sub(r'[^\w-]+', '_', selection[1])
+        file_name = f"{stem}_{selection[0]}_{value}{ext}"
+        path = os.path.join(tmp_dir, file_name)
+        write_workbook(path, sheets)
+        with open(path, 'rb') as f:
+            data = f.read()
+    if not zip_attachment:
+        return (data, *XLSX_TYPE, file_name)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+        archive.writestr(file_name, data)
+    return buffer.getvalue(), 'application', 'zip', f"{os.path.splitext(file_name)[0]}.zip"
+
+def build_message(recipients, selection, file, summary=None):
+    msg = EmailMessage()
+    msg['Subject'] = 'Wedstrijd Data 2025'
+    msg['From'] = EMAIL_ADDRESS
+    msg['To'] = ', '.join(recipients)  # Join multiple recipients with a comma
+    what = "het aangepaste klassement" if selection is None else f"het klassement van {selection[0]} {selection[1]}"
+    msg.set_content(
+        f"Beste,\n\nIn de bijlage vindt u {what} voor deze week ('{file[3]}').\n\nMet vriendelijke groet,\nUw automatiseringsscript"
+    )
+    if summary is not None:
+        msg.add_alternative(summary, subtype='html')
+    data, maintype, subtype, file_name = file
+    msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=file_name)
+    return msg
 
-        # Send the email
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
+def connect_smtp():
+    """An SMTP session, logged in when the server offers AUTH (a local debugging server does not)."""
+    smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        if SMTP_STARTTLS:
             smtp.starttls()
+        smtp.ehlo_or_helo_if_needed()
+        if smtp.has_extn('auth'):
             smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            smtp.send_message(msg)
-            logger.info(f"✅ Email sent to {RECIPIENT} with attachment '{file_name}'.")
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
+
+@traced('mail', measure=lambda deliveries, *args, **kwargs: {'rows': len(deliveries)})
+def send_batch(deliveries, connect=connect_smtp, on_sent=None, attempts=SEND_ATTEMPTS, retry_seconds=RETRY_SECONDS):
+    """Send ``[(message, recipients)]`` over one SMTP session and return what could not be delivered.
+
+    A refused recipient or a lost connection does not resend what already went
+    out: the next attempt opens a new session for the failed recipients only.
+    Permanent refusals (5xx) are not retried. ``on_sent`` is called with every
+    accepted message and the addresses it went to.
+    """
+    pending = [(message, list(recipients)) for message, recipients in deliveries]
+    permanent, errors = {}, {}
+    for attempt in range(1, attempts + 1):
+        retry, errors, done = [], {}, 0
+        try:
+            with connect() as smtp:
+                for message, recipients in pending:
+                    try:
+                        refused = smtp.send_message(message, to_addrs=recipients)
+                    except smtplib.SMTPRecipientsRefused as e:
+                        refused = e.recipients
+                    except smtplib.SMTPResponseException as e:
+                        refused = dict.fromkeys(recipients, (e.smtp_code, e.smtp_error))
+                    done += 1
+                    delivered = [address for address in recipients if address not in refused]
+                    if delivered:
+                        file_name = next(message.iter_attachments()).get_filename()
+                        logger.info(f"✅ Email sent to {delivered} with attachment '{file_name}'.")
+                        if on_sent is not None:
+                            on_sent(message, delivered)
+                    for address, (code, error) in refused.items():
+                        logger.warning(f"⚠️ {address} refused: {code} {error!r}")
+                        if code >= 500:
+                            permanent[address] = (code, error)
+                        else:
+                            errors[address] = (code, error)
+                    temporary = [address for address in recipients if address in errors]
+                    if temporary:
+                        retry.append((message, temporary))
+        except (smtplib.SMTPException, OSError) as e:
+            logger.warning(f"⚠️ SMTP session failed after {done} of {len(pending)} messages: {e}")
+            for message, recipients in pending[done:]:
+                errors.update(dict.fromkeys(recipients, (None, str(e))))
+            retry.extend(pending[done:])
+        pending = retry
+        if not pending:
+            break
+        if attempt < attempts:
+            logger.info(f"🔁 Retrying {len(errors)} recipients in {retry_seconds}s (attempt {attempt + 1} of {attempts})")
+            time.sleep(retry_seconds)
+    return {**permanent, **errors}
+
+def _sent_key(address, selection):
+    return address if selection is None else f"{address}:{selection[0]}={selection[1]}"
+
+def _load_sent(version):
+    try:
+        with open(SENT_LOG) as f:
+            log = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    return set(log.get('recipients', [])) if log.get('version') == version else set()
+
+def _save_sent(version, recipients):
+    os.makedirs(os.path.dirname(SENT_LOG), exist_ok=True)
+    tmp_path = f"{SENT_LOG}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({'version': version, 'recipients': sorted(recipients)}, f)
+    os.replace(tmp_path, SENT_LOG)
+
+def send_email(sheets=None, distribution=None, zip_attachment=None, html_summary=None, resend=False, connect=connect_smtp):
+    """Mail the standings to every recipient over one SMTP session.
+
+    ``sheets`` are the standings of the combined workbook when they are already
+    in memory; they are only read from the workbook for tailored attachments
+    or the HTML summary. Recipients that already got this workbook are skipped
+    unless ``resend`` is set.
+    """
+    if distribution is None:
+        distribution = parse_recipients()
+    if zip_attachment is None:
+        zip_attachment = EMAIL_ZIP
+    if html_summary is None:
+        html_summary = EMAIL_HTML_SUMMARY
+    try:
+        version = file_sha256(ATTACHMENT_PATH)
+        sent = set() if resend else _load_sent(version)
+        if sheets is None and (html_summary or any(distribution)):
+            sheets = pd.read_excel(ATTACHMENT_PATH, sheet_name=None)
+        week = _latest_week(sheets) if sheets is not None else None
+
+        deliveries, selections = [], {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for selection, recipients in distribution.items():
+                recipients = [address for address in recipients if _sent_key(address, selection) not in sent]
+                if not recipients:
+                    continue
+                part = sheets if selection is None else tailored_sheets(sheets, selection)
+                file = attachment(part, selection, tmp_dir, zip_attachment)
+                summary = summary_html(part, week) if html_summary else None
+                message = build_message(recipients, selection, file, summary)
+                selections[id(message)] = selection
+                deliveries.append((message, recipients))
+        if not deliveries:
+            logger.info("📭 Every recipient already has this workbook, nothing to send.")
+            return
+
+        def record(message, addresses):
+            sent.update(_sent_key(address, selections[id(message)]) for address in addresses)
+            _save_sent(version, sent)
+
+        failed = send_batch(deliveries, connect=connect, on_sent=record)
+        if failed:
+            raise RuntimeError(f"mail not delivered to {', '.join(sorted(failed))}")
     except Exception as e:
         logger.error(f"❌ Failed to send email: {e}")
         raise
 
 if __name__ == '__main__':
-    send_email()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Mail the combined standings to the recipients in EMAIL_RECIPIENTS.")
+    parser.add_argument('--zip', action='store_true', default=None, help="send the workbook as a zip file")
+    parser.add_argument('--html', action='store_true', default=None, help="add an HTML summary to the mail")
+    parser.add_argument('--resend', action='store_true',
+                        help="also mail the recipients that already got this workbook")
+    args = parser.parse_args()
+    send_email(zip_attachment=args.zip, html_summary=args.html, resend=args.resend)
@@ -0,0 +1,142 @@
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# A synthetic season in the layout of the real files: one roster per week like
+# "deelnemerslijst 2025.xlsx" (title on row 1, header on row 5) and one finish
+# file per week like Result/finish.xlsx. Sizes go from the real field (a few
+# hundred riders) up to tens of thousands of riders over a full year, for the
+# benchmarks. The same seed gives the same season.
+ROSTER_TITLE = "DEELNEMERSLIJST 2025"
+ROSTER_HEADER_ROW = 5
+ROSTER_COLUMNS = ['NUMBER', 'NAME', 'KLASSE', 'CAT', 'TEAM', 'HESJE']
+FINISH_COLUMNS = ['Pl', '', 'BIB', 'NAAM', 'CAT', 'R1', 'R2', 'R3', 'FINISH']
+# Share of the categories and of riders without a team, as in the 2025 roster
+CATEGORIES = {'STA': 0.70, 'SEN': 0.16, 'DAM': 0.08, 'VET': 0.06}
+NO_TEAM = 0.45
+SEASON_DIR = "season"
+
+def class_names(classes):
+    """A, B, C, ... (AA, AB, ... beyond 26 classes)."""
+    letters = [chr(ord('A') + i) for i in range(26)]
+    names = letters[:classes]
+    names += [a + b for a in letters for b in letters][:max(0, classes - 26)]
+    return names
+
+def make_roster(riders, classes=6, teams=None, seed=0):
+    """The week 1 roster as a frame with the columns of the roster file."""
+    rng = np.random.default_rng(seed)
+    teams = teams if teams is not None else max(1, riders // 4)
+    # Lower classes are bigger, as in the real field
+    weights = np.arange(1, classes + 1, dtype=float)
+    klasse = rng.choice(class_names(classes), size=riders, p=weights / weights.sum())
+    categorie = rng.choice(list(CATEGORIES), size=riders, p=list(CATEGORIES.values()))
+    team_names = np.array([f"Team {i:05d}" for i in range(1, teams + 1)], dtype=object)
+    team = team_names[rng.integers(teams, size=riders)]
+    team[rng.random(riders) < NO_TEAM] = '0'
+    bibs = np.arange(1, riders + 1)
+    return pd.DataFrame({
+        'NUMBER': bibs,
+        'NAME': [f"Renner{bib:06d} Synth" for bib in bibs],
+        'KLASSE': klasse,
+        'CAT': categorie,
+        'TEAM': team,
+        'HESJE': None,
+    })
+
+def change_classes(roster, classes, share, rng):
+    """A copy of ``roster`` in which ``share`` of the riders moved one class up or down."""
+    roster = roster.copy()
+    names = class_names(classes)
+    moved = np.flatnonzero(rng.random(len(roster)) < share)
+    index = pd.Index(names).get_indexer(roster['KLASSE'].iloc[moved])
+    step = rng.choice([-1, 1], size=len(moved))
+    roster.iloc[moved, roster.columns.get_loc('KLASSE')] = np.asarray(names, dtype=object)[
+        np.clip(index + step, 0, len(names) - 1)
+    ]
+    return roster
+
+def make_finish(roster, seed=0, turnout=0.85, guests=0.02):
+    """A finish file for one race: a random order of the riders that started, plus some guests."""
+    rng = np.random.default_rng(seed)
+    started = roster[rng.random(len(roster)) < turnout]
+    n_guests = int(len(started) * guests)
+    guest_bibs = len(roster) + 1 + rng.choice(max(n_guests * 10, 1), size=n_guests, replace=False)
+    bibs = np.concatenate([started['NUMBER'].to_numpy(), guest_bibs])
+    names = np.concatenate([started['NAME'].to_numpy(), [f"Gast{bib} Synth" for bib in guest_bibs]])
+    categories = np.concatenate([started['CAT'].to_numpy(), np.full(n_guests, 'STA', dtype=object)])
+    order = rng.permutation(len(bibs))
+    seconds = np.sort(rng.normal(3600, 300, size=len(bibs)).clip(1800))
+    laps = [np.round(seconds / 3 + rng.normal(0, 20, size=len(bibs))) for _ in range(3)]
+    return pd.DataFrame({
+        'Pl': np.arange(1, len(bibs) + 1),
+        '': None,
+        'BIB': bibs[order],
+        'NAAM': names[order],
+        'CAT': categories[order],
+        **{f"R{i + 1}": [_clock(s) for s in lap] for i, lap in enumerate(laps)},
+        'FINISH': [_clock(s) for s in seconds],
+    }, columns=FINISH_COLUMNS)
+
+def _clock(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+def _write_rows(path, rows):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Blad1")
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+def write_roster(path, roster):
+    """Write ``roster`` in the layout of the roster file: title on row 1, header on row 5."""
+    blank = [None] * len(ROSTER_COLUMNS)
+    rows = [[ROSTER_TITLE] + blank[1:], blank, blank, blank, ROSTER_COLUMNS]
+    rows += [[None if pd.isna(value) else value for value in row]
+             for row in roster[ROSTER_COLUMNS].itertuples(index=False, name=None)]
+    _write_rows(path, rows)
+
+def write_finish(path, finish):
+    _write_rows(path, [list(finish.columns)] + [list(row) for row in finish.itertuples(index=False, name=None)])
+
+def generate_season(directory, riders=200, weeks=10, classes=6, teams=None, seed=0,
+                    turnout=0.85, class_changes=0.01):
+    """Write ``roster_<week>.xlsx`` and ``finish_<week>.xlsx`` for every week into ``directory``.
+
+    Every week a share ``class_changes`` of the riders changes class on the
+    roster. Returns the finish and roster paths, week 1 first.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    roster = make_roster(riders, classes, teams, seed)
+    finish_paths, roster_paths = [], []
+    for week in range(1, weeks + 1):
+        if week > 1:
+            roster = change_classes(roster, classes, class_changes, rng)
+        roster_paths.append(os.path.join(directory, f"roster_{week}.xlsx"))
+        finish_paths.append(os.path.join(directory, f"finish_{week}.xlsx"))
+        write_roster(roster_paths[-1], roster)
+        write_finish(finish_paths[-1], make_finish(roster, seed + week, turnout))
+    logger.info(f"🧪 Generated {weeks} weeks for {riders} riders in {classes} classes in {directory}")
+    return finish_paths, roster_paths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic season of rosters and finish files.")
+    parser.add_argument('directory', nargs='?', default=SEASON_DIR)
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--weeks', type=int, default=10)
+    parser.add_argument('--classes', type=int, default=6)
+    parser.add_argument('--teams', type=int, default=None, help="number of teams (default: riders / 4)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_season(args.directory, args.riders, args.weeks, args.classes, args.teams, args.seed)
@@ -1,6 +1,9 @@
 import os
 import pandas as pd
-from utils import load_deelnemers, load_result, MAX_POINTS, backup_file
+import results_store
+from excel_export import write_workbook
+from team_scoring import CompositionRule, Slot, finish_team_klassement, is_team, score_teams
+from utils import load_deelnemers, load_result, calculate_points, MAX_POINTS, backup_file
 
 import logging
 import shutil
@@ -14,149 +17,81 @@ OUTPUT_DIR = "output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 TEAM_KLASSEMENT_FILE = os.path.join(OUTPUT_DIR, "team_klassement_2025_DAM_only.xlsx")
+STANDING = "TEAMS MIXED"
+# 2 STA + 1 SEN + 1 DAM/VET; a team that cannot fill a place gets MAX_POINTS for it
+TEAM_RULE = CompositionRule(slots=(Slot(('STA',), 2), Slot(('SEN',), 1), Slot(('DAM', 'VET'), 1)), padding=MAX_POINTS)
+# Riders are placed within their category
+POINTS_GROUP = 'categorie'
+
+def eligible_riders(deelnemers):
+    """Riders of a real team that has at least one DAM rider."""
+    deelnemers = deelnemers[is_team(deelnemers['team'])]
+    has_dam = (deelnemers['categorie'] == 'DAM').groupby(deelnemers['team'], observed=True).transform('any')
+    return deelnemers[has_dam]
+
 IS_SECOND_PERIOD_STARTED = os.environ.get('IS_SECOND_PERIOD_STARTED', 'False').lower() == 'true'
 
-def calculate_team_klassement():
+def calculate_team_klassement(deelnemers=None, uitslag=None, is_second_period_started=None, write_output=True):
+    """Add the current week to the TEAMS MIXED klassement and return the sheet. Inputs left as None are loaded from disk."""
+    if is_second_period_started is None:
+        is_second_period_started = IS_SECOND_PERIOD_STARTED
     try:
-        deelnemers = load_deelnemers()
-        uitslag = load_result()
+        if deelnemers is None:
+            deelnemers = load_deelnemers()
+        if uitslag is None:
+            uitslag = load_result()
         logger.info("Calculating DAM-only team klassement")
 
-        # Filter out team '0' and empty
-        deelnemers = deelnemers[
-            deelnemers['team'].notna() &
-            (deelnemers['team'].astype(str).str.strip() != '') &
-            (deelnemers['team'].astype(str).str.strip() != '0')
-        ]
-
-        # Only include teams with at least one DAM rider
-        dam_teams = deelnemers[deelnemers['categorie'] == 'DAM']['team'].unique()
-        deelnemers = deelnemers[deelnemers['team'].isin(dam_teams)]
+        # Filter out team '0' and empty, and teams without a DAM rider
+        deelnemers = eligible_riders(deelnemers)
 
         # Load existing klassement or start fresh
-        if os.path.isfile(TEAM_KLASSEMENT_FILE):
-            team_klassement_df = pd.read_excel(TEAM_KLASSEMENT_FILE, sheet_name="TEAMS MIXED")
-            team_klassement_df = team_klassement_df[
-                team_klassement_df['team'].notna() &
-                (team_klassement_df['team'].astype(str).str.strip() != '') &
-                (team_klassement_df['team'].astype(str).str.strip() != '0')
-            ]
-            week_cols = [col for col in team_klassement_df.columns if col.endswith('T') and col[:-1].isdigit()]
-            if week_cols:
-                max_week_num = max(int(col[:-1]) for col in week_cols)
-                current_week = max_week_num + 1
-            else:
-                current_week = 1
-        else:
-            current_week = 1
+        results_store.import_team_workbook(STANDING, TEAM_KLASSEMENT_FILE, "TEAMS MIXED")
+        # The same race processed again recomputes its week instead of adding one
+        race = results_store.race_id(uitslag)
+        current_week = results_store.week_for_race(STANDING, race)
+        team_klassement_df = results_store.load_team_weeks(STANDING, before_week=current_week)
+        if team_klassement_df.empty:
             teams = deelnemers['team'].unique()
             team_klassement_df = pd.DataFrame({'team': teams})
-            week_cols = []
+        else:
+            team_klassement_df = team_klassement_df[is_team(team_klassement_df['team'])]
 
         new_week_col = f"{current_week}T"
 
         # Calculate points per rider for current week
-        punten = {}
-        for cat in deelnemers['categorie'].unique():
-            cat_deelnemers = deelnemers[deelnemers['categorie'] == cat]
-            cat_bibs = set(cat_deelnemers['bib'])
-            cat_result = uitslag[uitslag['bib'].isin(cat_bibs)].copy()
-            cat_result['rank_in_class'] = cat_result['plaats'].rank(method='first').astype(int)
-
-            for row in cat_result.itertuples():
-                punten[row.bib] = row.rank_in_class if row.rank_in_class < 60 else 60
-
-        punten_per_rijder = []
-        for _, rijder in deelnemers.iterrows():
-            punten_per_rijder.append({
-                'bib': rijder['bib'],
-                'team': rijder['team'],
-                'categorie': rijder['categorie'],
-                current_week: punten.get(rijder['bib'], MAX_POINTS)
-            })
-
-        punten_df = pd.DataFrame(punten_per_rijder)
-
-        # Group by team and select the best 2 STA + 1 SEN + 1 DAM/VET
-        team_scores = []
-
-        for team, group in punten_df.groupby('team'):
-            group = group.sort_values(by=current_week)
-
-            # Select best riders according to category rules
-            sta_riders = group[group['categorie'] == 'STA'].nsmallest(2, current_week)
-            sen_riders = group[group['categorie'] == 'SEN'].nsmallest(1, current_week)
-            damvet_riders = group[group['categorie'].isin(['DAM', 'VET'])].nsmallest(1, current_week)
+        punten_df = pd.DataFrame({
+            'bib': deelnemers['bib'],
+            'team': deelnemers['team'],
+            'categorie': deelnemers['categorie'],
+            current_week: calculate_points(deelnemers, uitslag, group_by=POINTS_GROUP)
+        })
 
-            selected_riders = pd.concat([sta_riders, sen_riders, damvet_riders])
-
-            # If fewer than 4 riders are selected, pad with MAX_POINTS
-            if len(selected_riders) < 4:
-                missing = 4 - len(selected_riders)
-                selected_riders = pd.concat([
-                    selected_riders,
-                    pd.DataFrame([{current_week: MAX_POINTS}] * missing)
-                ])
-
-            team_score = selected_riders[current_week].sum()
-            team_scores.append({'team': team, new_week_col: team_score})
-
-        team_points_this_week = pd.DataFrame(team_scores)
+        # Score every team on its best 2 STA + 1 SEN + 1 DAM/VET
+        team_points_this_week = score_teams(punten_df, TEAM_RULE, current_week).rename(columns={current_week: new_week_col})
 
         # Clean and rank
-        team_points_this_week = team_points_this_week[
-            (team_points_this_week['team'].astype(str).str.strip() != '') &
-            (team_points_this_week['team'].astype(str).str.strip() != '0')
-        ]
+        team_points_this_week = team_points_this_week[is_team(team_points_this_week['team'])]
 
         team_points_this_week[new_week_col] = team_points_this_week[new_week_col].rank(method='min', ascending=False).astype(int)
 
-        # Merge into klassement
-        team_klassement_df = team_klassement_df.merge(team_points_this_week[['team', new_week_col]], on='team', how='outer')
-
-        # Clean again
-        team_klassement_df = team_klassement_df[
-            team_klassement_df['team'].notna() &
-            (team_klassement_df['team'].astype(str).str.strip() != '') &
-            (team_klassement_df['team'].astype(str).str.strip() != '0')
-        ]
-
-        # Update week columns
-        week_cols = [col for col in team_klassement_df.columns if col.endswith('T') and col[:-1].isdigit()]
-        team_klassement_df[week_cols] = team_klassement_df[week_cols].fillna(0)
-
-        # Totals
-        team_klassement_df['Totaal'] = team_klassement_df[week_cols].sum(axis=1)
-
-        if IS_SECOND_PERIOD_STARTED and week_cols:
-            second_period_start = max([int(col[:-1]) for col in week_cols])
-            first_period_weeks = [col for col in week_cols if int(col[:-1]) < second_period_start]
-            second_period_weeks = [col for col in week_cols if int(col[:-1]) >= second_period_start]
-        else:
-            first_period_weeks = week_cols
-            second_period_weeks = []
-
-        team_klassement_df['1e Periode'] = team_klassement_df[first_period_weeks].sum(axis=1) if first_period_weeks else 0
-        team_klassement_df['2e Periode'] = team_klassement_df[second_period_weeks].sum(axis=1) if second_period_weeks else 0
-
-        # Final ranking
-        team_klassement_df = team_klassement_df.sort_values('Totaal')
-        team_klassement_df['Plaats'] = range(1, len(team_klassement_df) + 1)
+        results_store.append_team_week(STANDING, current_week, team_points_this_week, new_week_col, race=race)
 
-        # Reorder columns
-        cols_order = ['Plaats', 'team', '1e Periode', '2e Periode', 'Totaal'] + sorted(week_cols, key=lambda c: int(c[:-1]))
-        team_klassement_df = team_klassement_df[cols_order]
+        team_klassement_df = finish_team_klassement(
+            team_klassement_df, team_points_this_week, new_week_col, is_second_period_started
+        )
 
         # Save main file in output
-        with pd.ExcelWriter(TEAM_KLASSEMENT_FILE, engine='openpyxl', mode='w') as writer:
-            team_klassement_df.to_excel(writer, sheet_name="TEAMS MIXED", index=False)
+        if write_output:
+            write_workbook(TEAM_KLASSEMENT_FILE, {"TEAMS MIXED": team_klassement_df})
 
-        # --- Save backup using shared backup system ---
-        backup_path = backup_file(TEAM_KLASSEMENT_FILE, f"team_klassement_2025_DAM_only_week_{current_week}.xlsx")
-        logger.info(f"📁 Backup saved to {backup_path}")
+            # --- Save backup using shared backup system ---
+            backup_path = backup_file(TEAM_KLASSEMENT_FILE, f"team_klassement_2025_DAM_only_week_{current_week}.xlsx", week=current_week)
+            logger.info(f"📁 Backup saved to {backup_path}")
 
+            logger.info(f"✅ DAM-only team klassement updated with week {current_week} (column {new_week_col}) in {TEAM_KLASSEMENT_FILE}")
 
-        logger.info(f"✅ DAM-only team klassement updated with week {current_week} (column {new_week_col}) in {TEAM_KLASSEMENT_FILE}")
+        return team_klassement_df
 
     except Exception as e:
         logger.error(f"❌ Error in calculate_team_klassement: {e}")
@@ -1,6 +1,9 @@
 import os
 import pandas as pd
-from utils import load_deelnemers, load_result, MAX_POINTS, backup_file
+import results_store
+from excel_export import write_workbook
+from team_scoring import CompositionRule, Slot, finish_team_klassement, is_team, score_teams
+from utils import load_deelnemers, load_result, calculate_points, backup_file
 
 import logging
 import shutil
@@ -13,127 +16,80 @@ OUTPUT_DIR = "output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 TEAM_KLASSEMENT_FILE = os.path.join(OUTPUT_DIR, "team_klassement_2025.xlsx")
+STANDING = "TEAMS STA"
+# The 4 best riders of a team count, whatever their category
+TEAM_RULE = CompositionRule(slots=(Slot(None, 4),))
+# Riders are placed within their klasse
+POINTS_GROUP = 'klasse'
+
+def eligible_riders(deelnemers):
+    """Riders of a real team (not empty and not '0')."""
+    return deelnemers[is_team(deelnemers['team'])]
+
 IS_SECOND_PERIOD_STARTED = os.environ.get('IS_SECOND_PERIOD_STARTED', 'False').lower() == 'true'
 
-def calculate_team_klassement():
+def calculate_team_klassement(deelnemers=None, uitslag=None, is_second_period_started=None, write_output=True):
+    """Add the current week to the TEAMS STA klassement and return the sheet. Inputs left as None are loaded from disk."""
+    if is_second_period_started is None:
+        is_second_period_started = IS_SECOND_PERIOD_STARTED
     try:
-        deelnemers = load_deelnemers()
-        uitslag = load_result()
+        if deelnemers is None:
+            deelnemers = load_deelnemers()
+        if uitslag is None:
+            uitslag = load_result()
         logger.info("Calculating team klassement")
 
-        if os.path.isfile(TEAM_KLASSEMENT_FILE):
-            team_klassement_df = pd.read_excel(TEAM_KLASSEMENT_FILE, sheet_name="TEAMS STA")
-            team_klassement_df = team_klassement_df[
-                team_klassement_df['team'].notna() &
-                (team_klassement_df['team'].astype(str).str.strip() != '') &
-                (team_klassement_df['team'].astype(str).str.strip() != '0')
-            ]
-            week_cols = [col for col in team_klassement_df.columns if col.endswith('T') and col[:-1].isdigit()]
-            if week_cols:
-                max_week_num = max(int(col[:-1]) for col in week_cols)
-                current_week = max_week_num + 1
-            else:
-                current_week = 1
-        else:
-            current_week = 1
+        results_store.import_team_workbook(STANDING, TEAM_KLASSEMENT_FILE, "TEAMS STA")
+        # The same race processed again recomputes its week instead of adding one
+        race = results_store.race_id(uitslag)
+        current_week = results_store.week_for_race(STANDING, race)
+        team_klassement_df = results_store.load_team_weeks(STANDING, before_week=current_week)
+        if team_klassement_df.empty:
             teams = deelnemers['team'].unique()
             team_klassement_df = pd.DataFrame({'team': teams})
-            week_cols = []
+        else:
+            team_klassement_df = team_klassement_df[is_team(team_klassement_df['team'])]
 
         new_week_col = f"{current_week}T"
 
         if 'team' not in deelnemers.columns:
             raise ValueError("Deelnemers data must have a 'team' column")
 
-        deelnemers = deelnemers[
-            deelnemers['team'].notna() &
-            (deelnemers['team'].astype(str).str.strip() != '') &
-            (deelnemers['team'].astype(str).str.strip() != '0')
-        ]
-
-        punten = {}
-        for klasse in deelnemers['klasse'].unique():
-            klasse_deelnemers = deelnemers[deelnemers['klasse'] == klasse]
-            klasse_bibs = set(klasse_deelnemers['bib'])
-            klasse_result = uitslag[uitslag['bib'].isin(klasse_bibs)].copy()
-            klasse_result['rank_in_class'] = klasse_result['plaats'].rank(method='first').astype(int)
-
-            for row in klasse_result.itertuples():
-                punten[row.bib] = row.rank_in_class if row.rank_in_class < 60 else 60
-
-        punten_per_rijder = []
-        for _, rijder in deelnemers.iterrows():
-            punten_per_rijder.append({
-                'bib': rijder['bib'],
-                'team': rijder['team'],
-                current_week: punten.get(rijder['bib'], MAX_POINTS)
-            })
-
-        punten_df = pd.DataFrame(punten_per_rijder)
-
-        # Only count top 4 best riders per team
-        top_riders_per_team = (
-            punten_df
-            .sort_values(by=current_week)  # Lower rank = better position
-            .groupby('team')
-            .head(4)  # Select top 4 riders per team
-        )
+        deelnemers = eligible_riders(deelnemers)
 
-        team_points_this_week = (
-            top_riders_per_team
-            .groupby('team')[current_week]
-            .sum()
-            .reset_index()
-        )
+        punten_df = pd.DataFrame({
+            'bib': deelnemers['bib'],
+            'team': deelnemers['team'],
+            'categorie': deelnemers['categorie'],
+            current_week: calculate_points(deelnemers, uitslag, group_by=POINTS_GROUP)
+        })
+
+        # Only count top 4 best riders per team (lower rank = better position)
+        team_points_this_week = score_teams(punten_df, TEAM_RULE, current_week)
 
-        team_points_this_week = team_points_this_week[
-            (team_points_this_week['team'].astype(str).str.strip() != '') &
-            (team_points_this_week['team'].astype(str).str.strip() != '0')
-        ]
+        team_points_this_week = team_points_this_week[is_team(team_points_this_week['team'])]
 
         team_points_this_week.rename(columns={current_week: new_week_col}, inplace=True)
 
         # Rank teams (lower total = better, hence rank ascending)
         team_points_this_week[new_week_col] = team_points_this_week[new_week_col].rank(method='min', ascending=False).astype(int)
 
-        team_klassement_df = team_klassement_df.merge(team_points_this_week[['team', new_week_col]], on='team', how='outer')
+        results_store.append_team_week(STANDING, current_week, team_points_this_week, new_week_col, race=race)
 
-        team_klassement_df = team_klassement_df[
-            team_klassement_df['team'].notna() &
-            (team_klassement_df['team'].astype(str).str.strip() != '') &
-            (team_klassement_df['team'].astype(str).str.strip() != '0')
-        ]
-
-        week_cols = [col for col in team_klassement_df.columns if col.endswith('T') and col[:-1].isdigit()]
-        team_klassement_df[week_cols] = team_klassement_df[week_cols].fillna(0)
-
-        team_klassement_df['Totaal'] = team_klassement_df[week_cols].sum(axis=1)
-
-        if IS_SECOND_PERIOD_STARTED and week_cols:
-            second_period_start = max([int(col[:-1]) for col in week_cols])
-            first_period_weeks = [col for col in week_cols if int(col[:-1]) < second_period_start]
-            second_period_weeks = [col for col in week_cols if int(col[:-1]) >= second_period_start]
-        else:
-            first_period_weeks = week_cols
-            second_period_weeks = []
-
-        team_klassement_df['1e Periode'] = team_klassement_df[first_period_weeks].sum(axis=1) if first_period_weeks else 0
-        team_klassement_df['2e Periode'] = team_klassement_df[second_period_weeks].sum(axis=1) if second_period_weeks else 0
-
-        team_klassement_df = team_klassement_df.sort_values('Totaal')
-        team_klassement_df['Plaats'] = range(1, len(team_klassement_df) + 1)
+        team_klassement_df = finish_team_klassement(
+            team_klassement_df, team_points_this_week, new_week_col, is_second_period_started
+        )
 
-        cols_order = ['Plaats', 'team', '1e Periode', '2e Periode', 'Totaal'] + sorted(week_cols, key=lambda c: int(c[:-1]))
-        team_klassement_df = team_klassement_df[cols_order]
+        if write_output:
+            write_workbook(TEAM_KLASSEMENT_FILE, {"TEAMS STA": team_klassement_df})
 
-        with pd.ExcelWriter(TEAM_KLASSEMENT_FILE, engine='openpyxl', mode='w') as writer:
-            team_klassement_df.to_excel(writer, sheet_name="TEAMS STA", index=False)
+            # --- Save backup using shared backup system ---
+            backup_path = backup_file(TEAM_KLASSEMENT_FILE, f"team_klassement_2025_week_{current_week}.xlsx", week=current_week)
+            logger.info(f"📁 Backup saved to {backup_path}")
 
-         # --- Save backup using shared backup system ---
-        backup_path = backup_file(TEAM_KLASSEMENT_FILE, f"team_klassement_2025_week_{current_week}.xlsx")
-        logger.info(f"📁 Backup saved to {backup_path}")
+            logger.info(f"✅ Team klassement updated with week {current_week} (column {new_week_col}) in {TEAM_KLASSEMENT_FILE}")
 
-        logger.info(f"✅ Team klassement updated with week {current_week} (column {new_week_col}) in {TEAM_KLASSEMENT_FILE}")
+        return team_klassement_df
     except Exception as e:
         logger.error(f"❌ Error in calculate_team_klassement: {e}")
         raise
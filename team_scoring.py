@@ -0,0 +1,108 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import frame_size, traced
+
+# A slot takes the ``count`` best riders whose category is in ``categories``
+# (None: any category). When a team has fewer, its best remaining riders from the
+# ``fallback`` categories fill the open places. A rider fills at most one slot:
+# the first one that lists their category.
+Slot = namedtuple('Slot', ['categories', 'count', 'fallback'], defaults=((),))
+
+# A team scores the sum of the points of the riders in its slots. Places that
+# stay open count as ``padding`` points each; with None they count nothing.
+CompositionRule = namedtuple('CompositionRule', ['slots', 'padding'], defaults=(None,))
+
+def _slot_of(categories, slots):
+    """Index of the first slot listing each rider's category, -1 when none does."""
+    conditions = [
+        np.ones(len(categories), dtype=bool) if slot.categories is None else categories.isin(slot.categories).to_numpy()
+        for slot in slots
+    ]
+    return np.select(conditions, np.arange(len(slots)), default=-1)
+
+def _take_best(riders, keys, limits):
+    """Mask of the riders that are among the ``limits`` best of their ``keys`` group.
+
+    ``riders`` must already be sorted from best to worst.
+    """
+    return riders.groupby(keys, sort=False, observed=True).cumcount().to_numpy() < limits
+
+@traced('aggregation', measure=lambda punten_df, *args, **kwargs: frame_size(punten_df))
+def score_teams(punten_df, rule, points_col, team_col='team', category_col='categorie', by=()):
+    """Score every team of ``punten_df`` (one row per rider) with a composition rule.
+
+    All teams are scored in one pass: riders are sorted on their points once and
+    each slot keeps the best ones of every team with a grouped cumcount. Returns
+    a frame with ``team_col`` and ``points_col``, one row per team, sorted by team.
+    ``by`` names extra key columns, e.g. ``('week',)`` to score many weeks at once.
+    """
+    keys = list(by) + [team_col]
+    slots = rule.slots
+    counts = np.array([slot.count for slot in slots])
+    riders = punten_df[keys + [category_col, points_col]].sort_values(points_col, kind='stable')
+    slot_of = _slot_of(riders[category_col], slots)
+    riders = riders.assign(_slot=slot_of)
+    # Riders without a slot can still be a fallback; they are never picked directly
+    selected = _take_best(riders, keys + ['_slot'], np.where(slot_of >= 0, counts[slot_of], 0))
+
+    # Open places are filled from the fallback categories, slot by slot
+    for slot_idx, slot in enumerate(slots):
+        if not slot.fallback:
+            continue
+        in_slot = pd.Series(selected & (slot_of == slot_idx), index=riders.index)
+        open_places = slot.count - in_slot.groupby([riders[key] for key in keys], observed=True).transform('sum').to_numpy()
+        candidates = ~selected & riders[category_col].isin(slot.fallback).to_numpy() & (open_places > 0)
+        fill = np.zeros(len(riders), dtype=bool)
+        fill[candidates] = _take_best(riders[candidates], keys, open_places[candidates])
+        selected |= fill
+
+    teams = punten_df[keys].drop_duplicates()
+    teams = pd.MultiIndex.from_frame(teams) if by else pd.Index(teams[team_col])
+    chosen = riders[selected].groupby(keys, observed=True)[points_col]
+    scores = pd.DataFrame({
+        'points': chosen.sum().reindex(teams, fill_value=0),
+        'riders': chosen.size().reindex(teams, fill_value=0),
+    })
+    if rule.padding is not None:
+        scores['points'] += (counts.sum() - scores['riders']) * rule.padding
+    return scores['points'].sort_index().rename(points_col).reset_index()
+
+def is_team(teams):
+    """Mask of real team values: not empty and not the '0' placeholder."""
+    text = teams.astype(str).str.strip()
+    return teams.notna() & (text != '') & (text != '0')
+
+def finish_team_klassement(team_klassement_df, team_points_this_week, week_col, is_second_period_started):
+    """Add a week to a team klassement and compute its totals, periods and places.
+
+    ``team_klassement_df`` holds the earlier ``<week>T`` columns per team and
+    ``team_points_this_week`` the ranking of this week in ``week_col``. Returns
+    the sheet in export order.
+    """
+    team_klassement_df = team_klassement_df.merge(team_points_this_week[['team', week_col]], on='team', how='outer')
+    team_klassement_df = team_klassement_df[is_team(team_klassement_df['team'])]
+
+    week_cols = [col for col in team_klassement_df.columns if col.endswith('T') and col[:-1].isdigit()]
+    team_klassement_df[week_cols] = team_klassement_df[week_cols].fillna(0)
+
+    team_klassement_df['Totaal'] = team_klassement_df[week_cols].sum(axis=1)
+
+    if is_second_period_started and week_cols:
+        second_period_start = max([int(col[:-1]) for col in week_cols])
+        first_period_weeks = [col for col in week_cols if int(col[:-1]) < second_period_start]
+        second_period_weeks = [col for col in week_cols if int(col[:-1]) >= second_period_start]
+    else:
+        first_period_weeks = week_cols
+        second_period_weeks = []
+
+    team_klassement_df['1e Periode'] = team_klassement_df[first_period_weeks].sum(axis=1) if first_period_weeks else 0
+    team_klassement_df['2e Periode'] = team_klassement_df[second_period_weeks].sum(axis=1) if second_period_weeks else 0
+
+    team_klassement_df = team_klassement_df.sort_values('Totaal')
+    team_klassement_df['Plaats'] = range(1, len(team_klassement_df) + 1)
+
+    cols_order = ['Plaats', 'team', '1e Periode', '2e Periode', 'Totaal'] + sorted(week_cols, key=lambda c: int(c[:-1]))
+    return team_klassement_df[cols_order]
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The scripts live in the repository root and are imported as top-level modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in an empty directory: the scripts read and write paths relative to it."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local HTTP stand-in for the roster download. It serves ``body`` with an ETag
+# and a Last-Modified and answers 304 to a request whose validators match.
+# Statuses queued in ``failures`` are answered first; while ``hang`` is set a
+# request gets no answer.
+
+LAST_MODIFIED = "Mon, 06 Oct 2025 08:00:00 GMT"
+
+class RosterHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.hang.is_set():
+            server.release.wait()
+            return
+        if server.failures:
+            self.send_response(server.failures.pop(0))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{hashlib.sha256(server.body).hexdigest()[:16]}"'
+        headers = {}
+        if server.etag:
+            headers["ETag"] = etag
+        if server.last_modified:
+            headers["Last-Modified"] = LAST_MODIFIED
+        # If-None-Match wins over If-Modified-Since (RFC 7232)
+        if "If-None-Match" in self.headers:
+            not_modified = server.etag and self.headers["If-None-Match"] == etag
+        else:
+            not_modified = server.last_modified and self.headers.get("If-Modified-Since") == LAST_MODIFIED
+        self.send_response(304 if not_modified else 200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0" if not_modified else str(len(server.body)))
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(server.body)
+
+class FakeHttpServer(ThreadingHTTPServer):
+    """HTTP stand-in on a free local port, serving on a thread while used as context manager."""
+
+    daemon_threads = True
+
+    def __init__(self, body=b"", etag=True, last_modified=True):
+        super().__init__(("127.0.0.1", 0), RosterHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/roster.xlsx"
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.failures = []
+        self.requests = []
+        self.hang = threading.Event()
+        self.release = threading.Event()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.release.set()
+        self.shutdown()
+        self.server_close()
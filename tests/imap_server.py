@@ -0,0 +1,138 @@
+import re
+import socketserver
+import threading
+
+# A local IMAP stand-in: enough of the protocol for imaplib, the mail fetch in
+# check_mail (EXAMINE, UID SEARCH, UID FETCH) and the IDLE / DONE exchange of the
+# watcher. Messages are ``(structure, {part number: payload})``; a BODYSTRUCTURE
+# is given as the text the server sends.
+
+XLSX_STRUCTURE = (
+    '(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 12 1 NIL NIL NIL)'
+    '("APPLICATION" "VND.OPENXMLFORMATS-OFFICEDOCUMENT.SPREADSHEETML.SHEET" ("NAME" "uitslag.xlsx") NIL NIL'
+    ' "BASE64" {size} NIL ("ATTACHMENT" ("FILENAME" "uitslag.xlsx")) NIL NIL)'
+    ' "MIXED" ("BOUNDARY" "b") NIL NIL NIL)'
+)
+
+def xlsx_message(payload):
+    """A message with a text part and ``payload`` (base64) as Excel attachment, part 2."""
+    return XLSX_STRUCTURE.format(size=len(payload)), {'2': payload}
+
+class ImapHandler(socketserver.StreamRequestHandler):
+
+    def send(self, line):
+        with self.lock:
+            self.wfile.write(line if isinstance(line, bytes) else line.encode() + b"\r\n")
+            self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        self.lock = threading.Lock()
+        # A stalled server accepts the connection but never greets
+        server.stall.wait()
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE] fake IMAP ready")
+        for line in self.rfile:
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            server.commands.append(rest)
+            if command == "UID":
+                command, _, args = args.partition(" ")
+                command = "UID " + command.upper()
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command")
+            elif handler(tag, args) is False:
+                return
+
+    def do_CAPABILITY(self, tag, args):
+        self.send("* CAPABILITY IMAP4rev1 IDLE")
+        self.send(f"{tag} OK CAPABILITY completed")
+
+    def do_LOGIN(self, tag, args):
+        self.send(f"{tag} OK LOGIN completed")
+
+    def do_EXAMINE(self, tag, args):
+        self.send(f"* {len(self.server.messages)} EXISTS")
+        self.send(f"* OK [UIDVALIDITY {self.server.uidvalidity}] UIDs valid")
+        self.send(f"{tag} OK [READ-ONLY] EXAMINE completed")
+
+    do_SELECT = do_EXAMINE
+
+    def do_UID_SEARCH(self, tag, args):
+        match = re.search(r"UID (\d+):\*", args)
+        first = int(match.group(1)) if match else 1
+        uids = [uid for uid in sorted(self.server.messages) if uid >= first]
+        # "n:*" always matches the highest UID
+        if not uids and self.server.messages:
+            uids = [max(self.server.messages)]
+        self.send("* SEARCH " + " ".join(map(str, uids)))
+        self.send(f"{tag} OK SEARCH completed")
+
+    def do_UID_FETCH(self, tag, args):
+        uid, _, items = args.partition(" ")
+        structure, parts = self.server.messages[int(uid)]
+        number = list(self.server.messages).index(int(uid)) + 1
+        if "BODYSTRUCTURE" in items.upper():
+            self.send(f"* {number} FETCH (UID {uid} BODYSTRUCTURE {structure})")
+        else:
+            part = re.search(r"BODY\.PEEK\[([\d.]+)\]", items).group(1)
+            payload = parts[part]
+            self.send(f"* {number} FETCH (UID {uid} BODY[{part}] {{{len(payload)}}}".encode() + b"\r\n" + payload + b")\r\n")
+        self.send(f"{tag} OK FETCH completed")
+
+    def do_IDLE(self, tag, args):
+        self.send("+ idling")
+        with self.server.lock:
+            self.server.idling.append(self)
+        try:
+            line = self.rfile.readline()
+        finally:
+            with self.server.lock:
+                self.server.idling.remove(self)
+        if line.strip().upper() != b"DONE":
+            return False
+        self.send(f"{tag} OK IDLE terminated")
+
+    def do_LOGOUT(self, tag, args):
+        self.send("* BYE logging out")
+        self.send(f"{tag} OK LOGOUT completed")
+        return False
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """IMAP stand-in on a free local port, serving on a thread while used as context manager."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages=None, uidvalidity=1):
+        super().__init__(("127.0.0.1", 0), ImapHandler)
+        self.port = self.server_address[1]
+        self.messages = dict(messages or {})
+        self.uidvalidity = uidvalidity
+        self.commands = []
+        self.idling = []
+        self.lock = threading.Lock()
+        self.stall = threading.Event()
+        self.stall.set()
+
+    def deliver(self, uid, message):
+        """Add a message and announce it to the clients that are idling."""
+        self.messages[uid] = message
+        with self.lock:
+            idling = list(self.idling)
+        for handler in idling:
+            handler.send(f"* {len(self.messages)} EXISTS")
+
+    def idle_commands(self):
+        return sum(command.upper().startswith("IDLE") for command in self.commands)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        # Let stalled connections go before closing
+        self.stall.set()
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,90 @@
+import socketserver
+import threading
+from email import message_from_bytes
+
+# A local SMTP stand-in, like a debugging server: no TLS, no AUTH, and every
+# accepted message is kept as ``(recipients, message)`` in ``received``. An
+# address in ``refuse`` gets that ``(code, text)`` answer to its RCPT TO; with a
+# 4xx code it is refused ``temporary`` times (every time when None).
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+
+    def send(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        recipients = []
+        self.send("220 fake SMTP ready")
+        for line in self.rfile:
+            command, _, args = line.decode().rstrip("\r\n").partition(" ")
+            command = command.upper()
+            if command in ("EHLO", "HELO"):
+                self.send("250 fake SMTP")
+            elif command == "MAIL":
+                recipients = []
+                self.send("250 OK")
+            elif command == "RCPT":
+                address = args.partition(":")[2].strip().strip("<>")
+                answer = server.answer(address)
+                if answer is None:
+                    recipients.append(address)
+                    self.send("250 OK")
+                else:
+                    self.send(f"{answer[0]} {answer[1]}")
+            elif command == "DATA":
+                self.send("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for data_line in self.rfile:
+                    if data_line == b".\r\n":
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                with server.lock:
+                    server.received.append((recipients, message_from_bytes(b"".join(data))))
+                self.send("250 OK queued")
+            elif command == "RSET":
+                recipients = []
+                self.send("250 OK")
+            elif command == "NOOP":
+                self.send("250 OK")
+            elif command == "QUIT":
+                self.send("221 Bye")
+                return
+            else:
+                self.send("502 Command not implemented")
+
+class FakeSmtpServer(socketserver.ThreadingTCPServer):
+    """SMTP stand-in on a free local port, serving on a thread while used as context manager."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.port = self.server_address[1]
+        self.refuse = {}
+        self.temporary = None
+        self.refused = []
+        self.received = []
+        self.lock = threading.Lock()
+
+    def answer(self, address):
+        """The refusal for ``address``, or None when it is accepted."""
+        with self.lock:
+            answer = self.refuse.get(address)
+            if answer is None:
+                return None
+            if answer[0] < 500 and self.temporary is not None:
+                if self.refused.count(address) >= self.temporary:
+                    return None
+            self.refused.append(address)
+            return answer
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
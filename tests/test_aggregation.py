@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregation import aggregate, aggregate_periods, best_half, best_k, drop_worst
+from utils import MAX_POINTS
+
+def sorted_best_k(points, k):
+    """The reference: sort every rider's weeks and sum the k lowest."""
+    return np.sort(points, axis=1)[:, :max(k, 0)].sum(axis=1)
+
+@pytest.mark.parametrize('n_weeks', [1, 2, 5, 6, 11, 12])
+def test_best_k_matches_a_full_sort(n_weeks):
+    rng = np.random.default_rng(n_weeks)
+    # Few distinct values, so most riders have ties around the k-th week
+    points = rng.choice([1, 2, 3, 50, MAX_POINTS], size=(200, n_weeks))
+    for k in range(0, n_weeks + 2):
+        assert np.array_equal(best_k(points, k), sorted_best_k(points, k)), k
+
+@pytest.mark.parametrize('n_weeks', [1, 2, 7, 8])
+@pytest.mark.parametrize('rule', [best_half, drop_worst])
+def test_rules_match_a_full_sort(rule, n_weeks):
+    points = np.random.default_rng(n_weeks).integers(0, MAX_POINTS + 1, size=(100, n_weeks))
+    assert np.array_equal(aggregate(points, rule), sorted_best_k(points, rule(n_weeks)))
+
+def test_best_half():
+    assert [best_half(n) for n in range(7)] == [0, 1, 1, 1, 2, 2, 3]
+
+def test_drop_worst():
+    assert [drop_worst(n) for n in range(5)] == [0, 1, 1, 2, 3]
+    assert [drop_worst(n, n=2) for n in range(5)] == [0, 1, 1, 1, 2]
+
+def test_best_k_without_weeks():
+    assert best_k(np.zeros((3, 0), dtype=int), 2).tolist() == [0, 0, 0]
+
+def test_aggregate_periods():
+    df = pd.DataFrame({'1': [5, 1], '2': [3, 80], '3': [4, 2], '4': [1, 1]})
+    totals = aggregate_periods(df, {'Totaal': ['1', '2', '3', '4'], 'first': ['1', '2'], 'second': []}, best_half)
+
+    assert totals['Totaal'].tolist() == [4, 2]
+    assert totals['first'].tolist() == [3, 1]
+    # A period without weeks totals 0
+    assert totals['second'] == 0
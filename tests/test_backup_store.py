@@ -0,0 +1,54 @@
+import os
+import threading
+
+import backup_store
+
+LEGACY_RUN = "20250101_120000"
+
+def legacy_backups(workdir):
+    """Full copies in an old run directory and one roster backup."""
+    run_dir = workdir / backup_store.BACKUP_ROOT / LEGACY_RUN
+    run_dir.mkdir(parents=True)
+    (run_dir / "klassement_totaal_2025_week_3.xlsx").write_bytes(b"klassement week 3")
+    (run_dir / "wedstrijd_data_2025_week_3.xlsx").write_bytes(b"combined week 3")
+    roster_dir = workdir / backup_store.LEGACY_ROSTER_BACKUP_DIR
+    roster_dir.mkdir(parents=True)
+    (roster_dir / f"deelnemerslijst_2025_{LEGACY_RUN}.xlsx").write_bytes(b"roster")
+    return [run_dir / "klassement_totaal_2025_week_3.xlsx", run_dir / "wedstrijd_data_2025_week_3.xlsx",
+            roster_dir / f"deelnemerslijst_2025_{LEGACY_RUN}.xlsx"]
+
+def test_a_lookup_does_not_import(workdir):
+    legacy_backups(workdir)
+    assert backup_store.latest_snapshot("deelnemerslijst 2025.xlsx") is None
+
+def test_concurrent_imports_copy_once_and_keep_the_originals(workdir):
+    originals = legacy_backups(workdir)
+    counts = []
+    threads = [threading.Thread(target=lambda: counts.append(backup_store.import_legacy_backups()))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(counts) == [0, 0, 0, 3]
+    assert all(path.is_file() for path in originals)
+    snapshot = backup_store.snapshot_for_week("klassement_totaal_2025.xlsx", 3)
+    with backup_store.open_snapshot(snapshot) as f:
+        assert f.read() == b"klassement week 3"
+    assert backup_store.latest_snapshot("deelnemerslijst 2025.xlsx")['run'] == LEGACY_RUN
+    # A later import finds the migration done, even for a copy added since
+    (originals[0].parent / "klassement_2025_week_4.xlsx").write_bytes(b"late")
+    assert backup_store.import_legacy_backups() == 0
+
+def test_remove_originals_only_deletes_what_is_stored(workdir):
+    originals = legacy_backups(workdir)
+    backup_store.import_legacy_backups()
+    # Changed after the import: its content is not in the store
+    originals[1].write_bytes(b"edited by hand")
+
+    assert backup_store.import_legacy_backups(remove=True) == 0
+    assert not originals[0].exists()
+    assert originals[1].read_bytes() == b"edited by hand"
+    assert not originals[2].exists()
+    assert os.path.isdir(workdir / backup_store.LEGACY_ROSTER_BACKUP_DIR)
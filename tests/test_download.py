@@ -0,0 +1,66 @@
+import pytest
+
+import download_deelnemers_file as download
+import pipeline
+from http_server import FakeHttpServer
+
+ROSTER = b"roster of week 1"
+
+@pytest.fixture
+def server(workdir, monkeypatch):
+    with FakeHttpServer(ROSTER) as server:
+        monkeypatch.setattr(download, 'DEELNEMERS_URL', server.url)
+        yield server
+
+def roster(workdir):
+    return (workdir / download.OUTPUT_FILE).read_bytes()
+
+def test_new_roster_is_saved(server, workdir):
+    assert download.download_google_sheets_as_excel() is True
+    assert roster(workdir) == ROSTER
+
+    server.body = b"roster of week 2"
+    assert download.download_google_sheets_as_excel() is True
+    assert roster(workdir) == b"roster of week 2"
+
+def test_matching_etag_keeps_the_roster(server, workdir):
+    download.download_google_sheets_as_excel()
+    mtime = (workdir / download.OUTPUT_FILE).stat().st_mtime_ns
+
+    assert download.download_google_sheets_as_excel() is False
+    assert 'If-None-Match' in server.requests[-1]
+    assert roster(workdir) == ROSTER
+    assert (workdir / download.OUTPUT_FILE).stat().st_mtime_ns == mtime
+
+def test_matching_last_modified_keeps_the_roster(server, workdir):
+    server.etag = False
+    download.download_google_sheets_as_excel()
+
+    assert download.download_google_sheets_as_excel() is False
+    assert 'If-None-Match' not in server.requests[-1]
+    assert 'If-Modified-Since' in server.requests[-1]
+    assert roster(workdir) == ROSTER
+
+def test_same_content_without_validators_keeps_the_roster(server, workdir):
+    server.etag = server.last_modified = False
+    download.download_google_sheets_as_excel()
+    mtime = (workdir / download.OUTPUT_FILE).stat().st_mtime_ns
+
+    assert download.download_google_sheets_as_excel() is False
+    assert roster(workdir) == ROSTER
+    assert (workdir / download.OUTPUT_FILE).stat().st_mtime_ns == mtime
+
+def test_unavailable_server_is_retried(server, workdir):
+    server.failures = [503]
+
+    assert download.download_google_sheets_as_excel() is True
+    assert len(server.requests) == 2
+    assert roster(workdir) == ROSTER
+
+def test_roster_put_in_place_by_hand_is_kept(server, workdir):
+    download.download_google_sheets_as_excel()
+    (workdir / download.OUTPUT_FILE).write_bytes(b"roster edited by hand")
+
+    pipeline.run_download_deelnemers({'download_roster': False})
+    assert roster(workdir) == b"roster edited by hand"
+    assert len(server.requests) == 1
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import excel_import
+
+@pytest.fixture(params=sorted(excel_import.ENGINES))
+def engine(request, monkeypatch):
+    if request.param == 'calamine' and excel_import.python_calamine is None:
+        pytest.skip("python-calamine is not installed")
+    monkeypatch.setattr(excel_import, 'engine_name', lambda: request.param)
+    return request.param
+
+@pytest.fixture
+def sheet(tmp_path):
+    """A sheet with a title above the header and the cells read_excel has to type."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["title"])
+    ws.append([])
+    ws.append(["bib", "naam", "", "naam", 7, "datum", "mix", "leeg", "tekst", "punten"])
+    ws.append([1, "An", "x", "A2", 1, datetime(2025, 1, 2), 1, None, "12", 1.5])
+    ws.append([2, "Bo", None, "B2", 2, datetime(2025, 1, 3), "b", None, "13", 2])
+    ws.append([None] * 10)
+    ws.append([3, "Cas", "z", "C2", 3, datetime(2025, 1, 4), datetime(2025, 1, 1), None, "14", None])
+    path = tmp_path / "sheet.xlsx"
+    wb.save(path)
+    return path
+
+@pytest.mark.parametrize('header', [0, 2])
+@pytest.mark.parametrize('nrows', [None, 0, 2])
+def test_read_sheet_matches_read_excel(engine, sheet, header, nrows):
+    want = pd.read_excel(sheet, header=header, nrows=nrows)
+    pd.testing.assert_frame_equal(excel_import.read_sheet(sheet, header=header, nrows=nrows), want)
+
+@pytest.mark.parametrize('usecols', [['bib', 'naam', 'punten'], ['naam.1', 'datum'], lambda name: name != 'mix'])
+def test_read_sheet_keeps_only_the_wanted_columns(engine, sheet, usecols):
+    want = pd.read_excel(sheet, header=2, usecols=usecols)
+    pd.testing.assert_frame_equal(excel_import.read_sheet(sheet, header=2, usecols=usecols), want)
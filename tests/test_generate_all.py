@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import generate_all
+import instrumentation
+
+STAGES = ['run_generate_klassement', 'run_generate_regelmatigheidscriterium', 'run_teams_sta', 'run_teams_dam',
+          'run_combine', 'run_send_mail']
+
+@pytest.fixture
+def stages(workdir, monkeypatch):
+    """The names of the subprocess stages that ran; none of them starts a process."""
+    ran = []
+    for name in ['run_deelnemers_file', *STAGES]:
+        monkeypatch.setattr(generate_all, name, lambda name=name: ran.append(name))
+    monkeypatch.setattr(generate_all, 'run_search_mail', lambda: True)
+    monkeypatch.setattr(generate_all, 'commit_processed_id', lambda: ran.append('commit'))
+    return ran
+
+def report():
+    with open(instrumentation.report_path()) as f:
+        return json.load(f)
+
+def test_subprocess_run_writes_a_report(stages):
+    assert generate_all.run_subprocesses() is True
+    assert stages[-1] == 'commit'
+
+    written = report()
+    assert written['status'] == 'updated'
+    assert set(written['totals']) == {'run', 'deelnemers', 'mail', 'klassement', 'regelmatigheid', 'teams_sta',
+                                      'teams_mixed', 'combine', 'send_mail'}
+
+def test_failed_stage_is_in_the_report(stages, monkeypatch):
+    def fail():
+        raise RuntimeError("combine failed")
+
+    monkeypatch.setattr(generate_all, 'run_combine', fail)
+    with pytest.raises(RuntimeError):
+        generate_all.run_subprocesses()
+    assert 'commit' not in stages
+
+    written = report()
+    assert written['status'] == 'failed'
+    assert [span.get('error') for span in written['spans'] if span['name'] == 'combine'] == ['RuntimeError']
+
+def test_no_new_result_is_in_the_report(stages, monkeypatch):
+    monkeypatch.setattr(generate_all, 'run_search_mail', lambda: False)
+    assert generate_all.run_subprocesses() is False
+    assert stages == ['run_deelnemers_file']
+    assert report()['status'] == 'no_new_result'
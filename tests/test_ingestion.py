@@ -0,0 +1,93 @@
+import base64
+import os
+import subprocess
+
+import pytest
+
+import check_mail
+import download_deelnemers_file as download
+import generate_all
+import pipeline
+from http_server import FakeHttpServer
+from imap_server import FakeImapServer, xlsx_message
+
+ROSTER = b"roster of this week"
+RESULT = b"result of this week"
+# Seconds a source may take in these tests
+TIMEOUT = 2
+
+@pytest.fixture
+def sources(workdir):
+    """A roster on an HTTP stand-in and a result mail on an IMAP stand-in."""
+    (workdir / check_mail.DOWNLOAD_FOLDER).mkdir()
+    with FakeHttpServer(ROSTER) as http, FakeImapServer({1: xlsx_message(base64.b64encode(RESULT))}) as imap:
+        yield http, imap
+
+def hang(source, http, imap):
+    if source == 'deelnemers':
+        http.hang.set()
+    else:
+        imap.stall.clear()
+
+def saved(source, workdir):
+    if source == 'deelnemers':
+        return (workdir / download.OUTPUT_FILE).read_bytes() == ROSTER
+    return (workdir / check_mail.DOWNLOAD_FOLDER / check_mail.SAVE_AS_FILENAME).read_bytes() == RESULT
+
+def other(source):
+    return 'mail' if source == 'deelnemers' else 'deelnemers'
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('source', ['deelnemers', 'mail'])
+def test_stage_timeout_keeps_the_other_source(sources, workdir, monkeypatch, source, parallel):
+    http, imap = sources
+    monkeypatch.setattr(download, 'DEELNEMERS_URL', http.url)
+    monkeypatch.setattr(download, 'TIMEOUT', (TIMEOUT, TIMEOUT * 2))
+    for name, value in [('IMAP_SERVER', '127.0.0.1'), ('IMAP_PORT', imap.port), ('IMAP_SSL', False),
+                        ('IMAP_TIMEOUT', TIMEOUT * 2), ('EMAIL_ACCOUNT', 'results'), ('EMAIL_PASSWORD', 'secret')]:
+        monkeypatch.setattr(check_mail, name, value)
+    stages = [stage._replace(timeout=TIMEOUT) for stage in pipeline.build_stage_graph() if stage.io]
+    hang(source, http, imap)
+
+    with pytest.raises(TimeoutError, match=f"Stage '{source}'"):
+        pipeline.run_stage_graph(stages, {}, parallel=parallel)
+    assert saved(other(source), workdir)
+
+@pytest.mark.parametrize('source', ['deelnemers', 'mail'])
+def test_ingestion_timeout_keeps_the_other_source(sources, workdir, monkeypatch, source):
+    http, imap = sources
+    # The scripts run in this directory; a link keeps their imports pointing at the repository
+    for script in ('download_deelnemers_file.py', 'check_mail.py'):
+        os.symlink(os.path.join(os.path.dirname(generate_all.__file__), script), workdir / script)
+    for name, value in [('DEELNEMERS_URL', http.url), ('IMAP_SERVER', '127.0.0.1'), ('IMAP_PORT', str(imap.port)),
+                        ('IMAP_SSL', 'False'), ('EMAIL_ACCOUNT', 'results'), ('EMAIL_PASSWORD', 'secret')]:
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(generate_all, 'DOWNLOAD_TIMEOUT', TIMEOUT * 2)
+    monkeypatch.setattr(generate_all, 'MAIL_TIMEOUT', TIMEOUT * 2)
+    hang(source, http, imap)
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        generate_all.run_ingestion()
+    assert saved(other(source), workdir)
+
+def test_failed_update_fetches_the_same_mail_again(sources, workdir, monkeypatch):
+    http, imap = sources
+    for name, value in [('IMAP_SERVER', '127.0.0.1'), ('IMAP_PORT', imap.port), ('IMAP_SSL', False),
+                        ('EMAIL_ACCOUNT', 'results'), ('EMAIL_PASSWORD', 'secret')]:
+        monkeypatch.setattr(check_mail, name, value)
+
+    def fail(context):
+        raise RuntimeError("standings failed")
+
+    mail = next(stage for stage in pipeline.build_stage_graph() if stage.name == 'mail')
+    stages = [mail, pipeline.Stage('klassement', fail, (pipeline.RESULT_FILE,), ('klassement',))]
+    monkeypatch.setattr(pipeline, 'build_stage_graph', lambda: stages)
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline(False)
+    assert check_mail.get_last_processed_id() is None
+
+    # The next run finds the email again; once it succeeds, the email is processed
+    stages[1] = stages[1]._replace(func=lambda context: None)
+    assert pipeline.run_pipeline(False)
+    assert check_mail.get_last_processed_id() == {'uidvalidity': imap.uidvalidity, 'uid': 1}
+    assert not pipeline.run_pipeline(False)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from schema import POINTS_DTYPE
+from utils import MAX_POINTS, MAX_RANK_POINTS, calculate_points
+
+def roster(klassen):
+    return pd.DataFrame({'bib': np.arange(1, len(klassen) + 1), 'klasse': klassen})
+
+def test_points_are_the_place_within_the_class():
+    deelnemers = roster(['A', 'B', 'A', 'B', 'A'])
+    # Finish order: 5, 2, 1, 4, 3
+    uitslag = pd.DataFrame({'bib': [5, 2, 1, 4, 3], 'plaats': [1, 2, 3, 4, 5]})
+
+    punten = calculate_points(deelnemers, uitslag)
+
+    assert punten.dtype == POINTS_DTYPE
+    assert punten.index.equals(deelnemers.index)
+    assert punten.tolist() == [2, 1, 3, 2, 1]
+
+def test_riders_without_a_result_get_max_points():
+    deelnemers = roster(['A', 'A', 'A', None])
+    # Rider 2 did not finish, rider 4 has no class, bib 9 is not on the roster
+    uitslag = pd.DataFrame({'bib': [9, 3, 1, 4], 'plaats': [1, 2, 3, 4]})
+
+    assert calculate_points(deelnemers, uitslag).tolist() == [2, MAX_POINTS, 1, MAX_POINTS]
+
+def test_points_are_capped_at_max_rank_points():
+    field = MAX_RANK_POINTS + 5
+    deelnemers = roster(['A'] * field)
+    uitslag = pd.DataFrame({'bib': deelnemers['bib'], 'plaats': np.arange(1, field + 1)})
+
+    punten = calculate_points(deelnemers, uitslag)
+
+    assert punten.tolist() == list(range(1, MAX_RANK_POINTS + 1)) + [MAX_RANK_POINTS] * 5
+    assert punten.max() < MAX_POINTS
+
+def test_places_count_in_finish_order_not_row_order():
+    deelnemers = roster(['A', 'A', 'A'])
+    uitslag = pd.DataFrame({'bib': [1, 2, 3], 'plaats': [30, 10, 20]})
+
+    assert calculate_points(deelnemers, uitslag).tolist() == [3, 1, 2]
+
+def test_group_by_category():
+    deelnemers = roster(['A', 'B', 'C']).assign(categorie=['DAM', 'DAM', 'SEN'])
+    uitslag = pd.DataFrame({'bib': [3, 2, 1], 'plaats': [1, 2, 3]})
+
+    assert calculate_points(deelnemers, uitslag, group_by='categorie').tolist() == [2, 1, 1]
+
+def test_many_weeks_at_once_match_week_by_week():
+    rng = np.random.default_rng(4)
+    weeks = []
+    for week in range(1, 4):
+        deelnemers = roster(rng.choice(['A', 'B', 'C'], 40).tolist())
+        finishers = rng.permutation(deelnemers['bib'])[:30]
+        uitslag = pd.DataFrame({'bib': finishers, 'plaats': np.arange(1, 31)})
+        weeks.append((deelnemers.assign(week=week), uitslag.assign(week=week)))
+
+    deelnemers = pd.concat([d for d, _ in weeks], ignore_index=True)
+    uitslag = pd.concat([u for _, u in weeks], ignore_index=True)
+    together = calculate_points(deelnemers, uitslag, by=('week',))
+    one_by_one = pd.concat([calculate_points(d, u) for d, u in weeks], ignore_index=True)
+
+    assert together.tolist() == one_by_one.tolist()
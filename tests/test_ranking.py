@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from ranking import TIE_POLICIES, add_placings, placing_columns
+from schema import PLACE_DTYPE
+
+@pytest.fixture
+def standing():
+    # Sorted on Klasse and Totaal, as the standings are before they are placed
+    return pd.DataFrame({
+        'Klasse': ['A', 'A', 'A', 'A', 'B', 'B', None],
+        'Totaal': [10, 20, 20, 30, 5, 5, 1],
+    })
+
+@pytest.mark.parametrize('tie, places', [
+    ('order', [1, 2, 3, 4, 1, 2]),
+    ('min', [1, 2, 2, 4, 1, 1]),
+    ('dense', [1, 2, 2, 3, 1, 1]),
+    ('first', [1, 2, 3, 4, 1, 2]),
+])
+def test_tie_policies(standing, tie, places):
+    placed = add_placings(standing, 'Klasse', 'Plaats Klasse', score='Totaal', tie=tie)
+
+    assert placed['Plaats Klasse'].dtype == PLACE_DTYPE
+    assert placed['Plaats Klasse'].tolist()[:-1] == places
+    # A row without a group gets no place
+    assert placed['Plaats Klasse'].isna().tolist() == [False] * 6 + [True]
+
+def test_every_tie_policy_is_tested():
+    assert set(TIE_POLICIES) == {'order', 'min', 'dense', 'first'}
+
+def test_first_ranks_by_score_not_by_row(standing):
+    shuffled = standing.iloc[[3, 1, 0, 2, 5, 4, 6]]
+    placed = add_placings(shuffled, 'Klasse', 'Plaats', score='Totaal', tie='first')
+    assert placed['Plaats'].tolist()[:-1] == [4, 2, 1, 3, 1, 2]
+
+def test_a_column_per_group(standing):
+    placed = add_placings(standing, 'Klasse', 'Plaats {}', groups=['A', 'B'])
+
+    assert placing_columns('Plaats {}', ['A', 'B']) == ['Plaats A', 'Plaats B']
+    assert placed['Plaats A'].tolist() == [1, 2, 3, 4, pd.NA, pd.NA, pd.NA]
+    assert placed['Plaats B'].tolist() == [pd.NA] * 4 + [1, 2, pd.NA]
+
+def test_a_column_per_group_present_by_default(standing):
+    placed = add_placings(standing.iloc[:4], 'Klasse', 'Plaats {}')
+    assert [col for col in placed if col.startswith('Plaats')] == ['Plaats A']
+
+def test_unknown_policy_or_missing_score(standing):
+    with pytest.raises(ValueError):
+        add_placings(standing, 'Klasse', 'Plaats', score='Totaal', tie='max')
+    with pytest.raises(ValueError):
+        add_placings(standing, 'Klasse', 'Plaats', tie='min')
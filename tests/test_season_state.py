@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregation import aggregate, best_half, drop_worst
+from season_state import SeasonState, recompute_season_totals, update_season_totals
+from utils import CLASS_CHANGE_POINTS, MAX_POINTS
+
+RULES = [best_half, drop_worst, lambda n_weeks: 3]
+
+def random_points(rng, riders, weeks):
+    return rng.integers(1, MAX_POINTS + 1, size=(riders, weeks))
+
+@pytest.mark.parametrize('rule', RULES)
+def test_state_totals_match_the_matrix(rule):
+    rng = np.random.default_rng(6)
+    points = random_points(rng, 50, 7)
+    bibs = np.arange(50)
+
+    state = SeasonState.from_matrix(bibs, points[:, :1], ['1'])
+    for week in range(2, 8):
+        state.add_week(points[:, week - 1], week)
+        assert np.array_equal(state.totals(rule), aggregate(points[:, :week], rule))
+    assert np.array_equal(state.counts, SeasonState.from_matrix(bibs, points, range(1, 8)).counts)
+
+def test_reset_weeks_is_a_class_change():
+    rng = np.random.default_rng(7)
+    points = random_points(rng, 20, 5)
+    changed = np.zeros(20, dtype=bool)
+    changed[[3, 11]] = True
+
+    state = SeasonState.from_matrix(np.arange(20), points, range(1, 6))
+    state.reset_weeks(changed, CLASS_CHANGE_POINTS)
+    points[changed] = CLASS_CHANGE_POINTS
+
+    assert np.array_equal(state.totals(best_half), aggregate(points, best_half))
+
+def test_save_load_and_reorder(tmp_path):
+    points = random_points(np.random.default_rng(8), 10, 3)
+    state = SeasonState.from_matrix(np.arange(100, 110), points, [1, 2, 3])
+    path = str(tmp_path / "state.npz")
+    state.save(path)
+
+    loaded = SeasonState.load(path)
+    assert loaded.weeks == ['1', '2', '3']
+    order = np.arange(109, 99, -1)
+    reordered = loaded.reorder(order)
+    assert np.array_equal(reordered.totals(drop_worst), aggregate(points[::-1], drop_worst))
+    assert loaded.reorder(np.arange(101, 111)) is None
+    assert loaded.reorder(np.arange(100, 109)) is None
+
+def test_points_outside_the_histogram_are_refused():
+    state = SeasonState.from_matrix(np.arange(2), [[1], [2]], ['1'])
+    for points in ([MAX_POINTS + 1, 1], [np.nan, 1], [1.5, 1], [-1, 1]):
+        with pytest.raises(ValueError):
+            state.add_week(points, '2')
+
+@pytest.mark.parametrize('is_second_period_started', [False, True])
+@pytest.mark.parametrize('rule', RULES)
+def test_incremental_season_matches_the_full_recompute(tmp_path, rule, is_second_period_started):
+    rng = np.random.default_rng(12)
+    state_path = str(tmp_path / "state.npz")
+    df = pd.DataFrame({'bib': np.arange(1, 61)})
+    week_cols = []
+    for week in range(1, 9):
+        week_col = str(week)
+        reset_bibs = set()
+        if week == 4:
+            # A new rider joins: 80 points for the weeks before
+            df = pd.concat([df, pd.DataFrame({'bib': [99], **{col: [MAX_POINTS] for col in week_cols}})],
+                           ignore_index=True)
+        if week > 1:
+            # Some riders change class: their earlier weeks count CLASS_CHANGE_POINTS
+            reset_bibs = set(rng.choice(df['bib'], 3, replace=False).tolist())
+            df.loc[df['bib'].isin(reset_bibs), week_cols] = CLASS_CHANGE_POINTS
+        if week == 6:
+            df = df.sample(frac=1, random_state=1).reset_index(drop=True)
+        df[week_col] = rng.integers(1, MAX_POINTS + 1, size=len(df))
+        week_cols.append(week_col)
+
+        got = update_season_totals(df, week_cols, week_col, rule, state_path, is_second_period_started,
+                                   reset_bibs=reset_bibs)
+        want = recompute_season_totals(df, week_cols, rule, is_second_period_started)
+        for a, b in zip(got, want):
+            assert np.array_equal(np.broadcast_to(a, len(df)), np.broadcast_to(b, len(df))), week
+
+def test_points_that_do_not_fit_fall_back_to_the_recompute(tmp_path):
+    df = pd.DataFrame({'bib': [1, 2], '1': [3, 4], '2': [MAX_POINTS + 20, 1]})
+    got = update_season_totals(df, ['1', '2'], '2', drop_worst, str(tmp_path / "state.npz"), False)
+    want = recompute_season_totals(df, ['1', '2'], drop_worst, False)
+    assert np.array_equal(got[0], want[0])
+    assert got[0].tolist() == [3, 1]
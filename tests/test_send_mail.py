@@ -0,0 +1,95 @@
+import json
+import smtplib
+
+import pandas as pd
+import pytest
+
+import send_mail
+from smtp_server import FakeSmtpServer
+
+@pytest.fixture
+def smtp():
+    with FakeSmtpServer() as server:
+        yield server
+
+def connect_to(server):
+    return lambda: smtplib.SMTP("127.0.0.1", server.port, timeout=5)
+
+def message(recipients):
+    return send_mail.build_message(recipients, None, (b"workbook", *send_mail.XLSX_TYPE, "stand.xlsx"))
+
+def test_parse_recipients():
+    distribution = send_mail.parse_recipients(
+        "all@example.com, a@example.com:klasse=A, x@example.com:team=Ploeg X , b@example.com : Klasse = b,"
+    )
+    assert distribution == {
+        None: ['all@example.com'],
+        ('klasse', 'A'): ['a@example.com'],
+        ('team', 'Ploeg X'): ['x@example.com'],
+        ('klasse', 'b'): ['b@example.com'],
+    }
+
+@pytest.mark.parametrize('text', ["a@example.com:ploeg=X", "a@example.com:klasse=", "a@example.com:team"])
+def test_parse_recipients_rejects_unknown_selections(text):
+    with pytest.raises(ValueError):
+        send_mail.parse_recipients(text)
+
+def test_tailored_sheets():
+    riders = pd.DataFrame({'Nr.': [1, 2, 3], 'Naam': ['An', 'Bo', 'Cas'], 'Klasse': ['A', 'b', 'B']})
+    teams = pd.DataFrame({'Plaats': [1, 2], 'team': ['Ploeg X', 'Ploeg Y'], 'Totaal': [90, 80]})
+    deelnemers = pd.DataFrame({'bib': [1, 2, 3], 'team': ['Ploeg Y', 'Ploeg X ', 'Ploeg X']})
+    sheets = {'KLASSEMENT': riders, 'TEAMS STA': teams}
+
+    by_class = send_mail.tailored_sheets(sheets, ('klasse', 'b'))
+    assert list(by_class) == ['KLASSEMENT']
+    assert by_class['KLASSEMENT']['Nr.'].tolist() == [2, 3]
+
+    by_team = send_mail.tailored_sheets(sheets, ('team', 'Ploeg X'), deelnemers)
+    assert by_team['KLASSEMENT']['Nr.'].tolist() == [2, 3]
+    assert by_team['TEAMS STA']['team'].tolist() == ['Ploeg X']
+
+def test_temporary_refusal_retries_only_that_recipient(smtp):
+    smtp.refuse = {'busy@example.com': (451, "try again later"), 'gone@example.com': (550, "no such user")}
+    smtp.temporary = 1
+    deliveries = [
+        (message(['a@example.com', 'busy@example.com', 'gone@example.com']),
+         ['a@example.com', 'busy@example.com', 'gone@example.com']),
+        (message(['b@example.com']), ['b@example.com']),
+    ]
+    sent = []
+
+    failed = send_mail.send_batch(deliveries, connect=connect_to(smtp),
+                                  on_sent=lambda msg, addresses: sent.append(addresses), retry_seconds=0)
+
+    assert [recipients for recipients, _ in smtp.received] == [
+        ['a@example.com'], ['b@example.com'], ['busy@example.com']
+    ]
+    assert sent == [['a@example.com'], ['b@example.com'], ['busy@example.com']]
+    # A permanent refusal is reported, not retried
+    assert smtp.refused == ['busy@example.com', 'gone@example.com']
+    assert set(failed) == {'gone@example.com'}
+
+def test_sent_log_prevents_a_resend(smtp, workdir):
+    (workdir / send_mail.ATTACHMENT_PATH).write_bytes(b"combined workbook")
+    distribution = {None: ['a@example.com', 'b@example.com']}
+    smtp.refuse = {'b@example.com': (550, "mailbox full")}
+
+    with pytest.raises(RuntimeError, match='b@example.com'):
+        send_mail.send_email(distribution=distribution, zip_attachment=False, html_summary=False,
+                             connect=connect_to(smtp))
+    with open(send_mail.SENT_LOG) as f:
+        assert json.load(f)['recipients'] == ['a@example.com']
+
+    # The rerun only mails the recipient that is missing, a third run nobody
+    smtp.refuse = {}
+    for _ in range(2):
+        send_mail.send_email(distribution=distribution, zip_attachment=False, html_summary=False,
+                             connect=connect_to(smtp))
+    assert [recipients for recipients, _ in smtp.received] == [['a@example.com'], ['b@example.com']]
+    assert smtp.received[1][1]['To'] == 'b@example.com'
+
+    # A new workbook goes to everyone again
+    (workdir / send_mail.ATTACHMENT_PATH).write_bytes(b"combined workbook of next week")
+    send_mail.send_email(distribution=distribution, zip_attachment=False, html_summary=False,
+                         connect=connect_to(smtp))
+    assert smtp.received[-1][0] == ['a@example.com', 'b@example.com']
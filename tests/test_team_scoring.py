@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import team_DAM_klassement
+import team_klassement
+from team_scoring import CompositionRule, Slot, is_team, score_teams
+from utils import MAX_POINTS
+
+CATEGORIES = ['STA', 'SEN', 'DAM', 'VET', 'JUN']
+# A DAM team: the 2 best DAM, a VET when there are not enough, and 1 more of any category
+DAM_RULE = CompositionRule(
+    slots=(Slot(('DAM',), 2, fallback=('VET',)), Slot(None, 1)),
+    padding=MAX_POINTS,
+)
+
+def random_field(seed, teams=40, weeks=None):
+    """One row per rider; few distinct points so riders tie, and teams of 0 to 7 riders."""
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(0, 8, size=teams)
+    team = np.repeat([f"Ploeg {i}" for i in range(teams)], sizes)
+    field = pd.DataFrame({
+        'team': team,
+        'categorie': rng.choice(CATEGORIES, size=len(team), p=[0.4, 0.2, 0.2, 0.1, 0.1]),
+        'punten': rng.choice([1, 2, 3, 10, 60, MAX_POINTS], size=len(team)),
+    })
+    if weeks is None:
+        return field
+    return pd.concat([
+        field.assign(week=week, punten=rng.permutation(field['punten'].to_numpy())) for week in range(1, weeks + 1)
+    ], ignore_index=True)
+
+def old_sta(field):
+    """TEAMS STA before score_teams: the 4 best riders of every team."""
+    top = field.sort_values(by='punten').groupby('team').head(4)
+    return top.groupby('team')['punten'].sum()
+
+def old_mixed(field):
+    """TEAMS MIXED before score_teams: 2 STA, 1 SEN and 1 DAM/VET per team, open places MAX_POINTS."""
+    scores = {}
+    for team, group in field.groupby('team'):
+        group = group.sort_values(by='punten')
+        selected = pd.concat([
+            group[group['categorie'] == 'STA'].nsmallest(2, 'punten'),
+            group[group['categorie'] == 'SEN'].nsmallest(1, 'punten'),
+            group[group['categorie'].isin(['DAM', 'VET'])].nsmallest(1, 'punten'),
+        ])
+        scores[team] = selected['punten'].sum() + (4 - len(selected)) * MAX_POINTS
+    return pd.Series(scores)
+
+def per_team(field, rule):
+    """Any composition rule team by team: slots in order, then the fallbacks, then padding."""
+    scores = {}
+    for team, group in field.groupby('team'):
+        group = group.sort_values(by='punten', kind='stable')
+        taken = pd.Series(False, index=group.index)
+        picked = []
+        for slot in rule.slots:
+            # A rider belongs to the first slot listing their category
+            own = group['categorie'].map(
+                lambda cat: next(i for i, s in enumerate(rule.slots) if s.categories is None or cat in s.categories)
+                if any(s.categories is None or cat in s.categories for s in rule.slots) else -1
+            ) == rule.slots.index(slot)
+            best = group[own & ~taken].head(slot.count)
+            taken[best.index] = True
+            picked.append(len(best))
+        for slot, count in zip(rule.slots, picked):
+            if slot.fallback and count < slot.count:
+                fill = group[group['categorie'].isin(slot.fallback) & ~taken].head(slot.count - count)
+                taken[fill.index] = True
+        open_places = sum(slot.count for slot in rule.slots) - taken.sum()
+        scores[team] = group.loc[taken, 'punten'].sum() + open_places * (rule.padding or 0)
+    return pd.Series(scores)
+
+def scored(field, rule):
+    return score_teams(field, rule, 'punten').set_index('team')['punten']
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sta_matches_the_old_loop(seed):
+    field = random_field(seed)
+    pd.testing.assert_series_equal(scored(field, team_klassement.TEAM_RULE), old_sta(field),
+                                   check_names=False, check_dtype=False, check_index_type=False)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_mixed_matches_the_old_loop(seed):
+    field = random_field(seed)
+    pd.testing.assert_series_equal(scored(field, team_DAM_klassement.TEAM_RULE), old_mixed(field),
+                                   check_names=False, check_dtype=False, check_index_type=False)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fallback_rule_matches_team_by_team(seed):
+    field = random_field(seed)
+    pd.testing.assert_series_equal(scored(field, DAM_RULE), per_team(field, DAM_RULE),
+                                   check_names=False, check_dtype=False, check_index_type=False)
+
+def test_fallback_fills_only_open_places():
+    field = pd.DataFrame({
+        'team': ['X'] * 5 + ['Y'] * 3,
+        'categorie': ['DAM', 'VET', 'VET', 'STA', 'DAM', 'VET', 'VET', 'JUN'],
+        'punten': [5, 1, 2, 3, 9, 4, 6, 7],
+    })
+    # X: DAM 5 and 9 fill the DAM places, so no VET is needed there; VET 1 is the best of the rest.
+    # Y: no DAM. VET 4 is the best of any category; VET 6 fills one DAM place, the other stays open.
+    assert scored(field, DAM_RULE).to_dict() == {'X': 5 + 9 + 1, 'Y': 4 + 6 + MAX_POINTS}
+
+def test_short_teams_are_padded():
+    field = pd.DataFrame({'team': ['X', 'Y', 'Y'], 'categorie': ['JUN', 'STA', 'STA'], 'punten': [1, 2, 3]})
+    # X has nobody for the four places; Y only its two STA
+    assert scored(field, team_DAM_klassement.TEAM_RULE).to_dict() == {'X': 4 * MAX_POINTS, 'Y': 5 + 2 * MAX_POINTS}
+    # Without padding an open place counts nothing
+    assert scored(field, team_klassement.TEAM_RULE).to_dict() == {'X': 1, 'Y': 5}
+
+@pytest.mark.parametrize('rule', [team_klassement.TEAM_RULE, team_DAM_klassement.TEAM_RULE, DAM_RULE])
+def test_many_weeks_at_once_match_week_by_week(rule):
+    field = random_field(9, weeks=4)
+    together = score_teams(field, rule, 'punten', by=('week',))
+    one_by_one = pd.concat([
+        score_teams(week_field, rule, 'punten').assign(week=week) for week, week_field in field.groupby('week')
+    ], ignore_index=True)
+    pd.testing.assert_frame_equal(together, one_by_one[['week', 'team', 'punten']], check_dtype=False)
+
+def test_is_team():
+    teams = pd.Series(['Ploeg X', '0', ' ', None, 0, ' 0 '])
+    assert is_team(teams).tolist() == [True, False, False, False, False, False]
@@ -0,0 +1,85 @@
+import imaplib
+import threading
+import time
+
+import pytest
+
+import pipeline
+import watch
+from imap_server import FakeImapServer, xlsx_message
+
+POLL = 0.05
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+@pytest.fixture
+def pipeline_runs(workdir, monkeypatch):
+    """``(require_new_mail, download_roster)`` of every pipeline run the watcher starts; they update nothing."""
+    runs = []
+
+    def run_pipeline(is_second_period_started, require_new_mail=True, download_roster=True, **kwargs):
+        runs.append((require_new_mail, download_roster))
+        return False
+
+    monkeypatch.setattr(pipeline, 'run_pipeline', run_pipeline)
+    return runs
+
+@pytest.fixture
+def watcher():
+    stop = threading.Event()
+    threads = []
+
+    def start(**kwargs):
+        thread = threading.Thread(target=watch.watch, kwargs=dict(poll=POLL, stop=stop, **kwargs), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    yield start
+    stop.set()
+    for thread in threads:
+        thread.join(5)
+
+def settle():
+    """Give the watcher a few polls to start runs it should not start."""
+    time.sleep(POLL * 10)
+
+def test_new_mail_in_idle_triggers_one_run(pipeline_runs, watcher):
+    with FakeImapServer() as server:
+        def connect():
+            mail = imaplib.IMAP4("127.0.0.1", server.port, timeout=5)
+            mail.login("watcher", "secret")
+            return mail
+
+        watcher(connect=connect)
+        # The run at start-up, for mail that arrived while the watcher was not running
+        wait_for(lambda: len(pipeline_runs) == 1 and server.idling)
+        server.deliver(1, xlsx_message(b"UEsDBA=="))
+        wait_for(lambda: len(pipeline_runs) == 2)
+        # The watcher ends the IDLE with DONE and starts the next one
+        wait_for(lambda: server.idle_commands() == 2 and server.idling)
+        settle()
+        assert pipeline_runs == [(True, True), (True, True)]
+
+def test_new_result_file_triggers_one_run(pipeline_runs, watcher, workdir):
+    (workdir / "Result").mkdir()
+    watcher(idle=False)
+    wait_for(lambda: len(pipeline_runs) == 1)
+    (workdir / "Result" / "finish.xlsx").write_bytes(b"result of this week")
+    wait_for(lambda: len(pipeline_runs) == 2)
+    settle()
+    # A result put in place by hand is processed without new mail
+    assert pipeline_runs == [(True, True), (False, True)]
+
+def test_new_roster_file_is_not_downloaded_over(pipeline_runs, watcher, workdir):
+    (workdir / "Deelnemers").mkdir()
+    watcher(idle=False)
+    wait_for(lambda: len(pipeline_runs) == 1)
+    (workdir / "Deelnemers" / "deelnemerslijst 2025.xlsx").write_bytes(b"roster edited by hand")
+    wait_for(lambda: len(pipeline_runs) == 2)
+    settle()
+    assert pipeline_runs == [(True, True), (False, False)]
@@ -1,18 +1,37 @@
 import pandas as pd
+import io
 import os
-from openpyxl import load_workbook
-import shutil
-from datetime import datetime
+import backup_store
+import roster_history
+from excel_import import engine_name, read_sheet
+from instrumentation import traced
+from input_cache import cached_frame, file_sha256
+from ranking import placing_columns, PLACING_CATEGORIES
+from schema import compact, points
 
 
 DEELNEMERS_FILE = "Deelnemers/deelnemerslijst 2025.xlsx"
 RESULT_FILE = "Result/finish.xlsx"
 TEMPLATE_FILE = "Template/klassement.xlsx"
 MAX_POINTS = 80
-_CURRENT_BACKUP_DIR = None
+MAX_RANK_POINTS = 60
+# Points for every earlier week of a rider who changed klasse
+CLASS_CHANGE_POINTS = 50
+_CURRENT_BACKUP_RUN = None
+# Columns the stages use; the other columns of the files are not read
+ROSTER_COLUMNS = ('number', 'name', 'klasse', 'cat', 'team')
+RESULT_COLUMNS = ('pl', 'bib', 'naam')
+
+def _named(columns):
+    """Column filter matching ``columns`` the way the loaders normalise names (stripped, lower case)."""
+    return lambda name: str(name).strip().lower() in columns
 
 def load_deelnemers():
-    df = pd.read_excel(DEELNEMERS_FILE, header=4)
+    return cached_frame(DEELNEMERS_FILE, "deelnemers", parse_deelnemers)
+
+@traced('read', file='roster', engine=engine_name())
+def parse_deelnemers(path):
+    df = read_sheet(path, header=4, usecols=_named(ROSTER_COLUMNS))
     df.columns = df.columns.str.strip().str.lower()
     df = df.rename(columns={
         'number': 'bib',
@@ -24,95 +43,121 @@ def load_deelnemers():
     df = df.dropna(subset=['bib', 'naam', 'klasse'])
     df['naam'] = df['naam'].str.strip().str.lower()
     df['bib'] = df['bib'].astype(int)
-    return df
+    return compact(df)
 
 def load_result():
-    df = pd.read_excel(RESULT_FILE)
+    return cached_frame(RESULT_FILE, "result", parse_result)
+
+@traced('read', file='result', engine=engine_name())
+def parse_result(path):
+    df = read_sheet(path, usecols=_named(RESULT_COLUMNS))
     df.columns = df.columns.str.strip().str.lower()
     df = df.rename(columns={'pl': 'plaats', 'bib': 'bib', 'naam': 'naam'})
     df['bib'] = pd.to_numeric(df['bib'], errors='coerce').astype('Int64')
     df = df.dropna(subset=['bib', 'plaats'])
     return df
 
-def get_current_week(overall_path, sheet_name):
-    # If file doesn't exist, don't create anything — just start at week 1
-    if not os.path.isfile(overall_path):
-        return 1
-
-    wb = load_workbook(overall_path)
+@traced('points')
+def calculate_points(deelnemers, uitslag, group_by='klasse', by=()):
+    """Points for every roster row: its place among the finishers of its group.
 
-    # Create the sheet if it's missing
-    if sheet_name not in wb.sheetnames:
-        wb.create_sheet(title=sheet_name)
-        wb.save(overall_path)
-        return 1
+    Places are counted within ``group_by`` (klasse, categorie, ...) in finish
+    order and capped at MAX_RANK_POINTS; riders without a result get MAX_POINTS.
+    One merge and one grouped rank for the whole field, returned as an int16
+    Series aligned with ``deelnemers``. ``by`` names extra key columns present
+    in both frames, e.g. ``('week',)`` to score many races at once.
+    """
+    by = list(by)
+    riders = deelnemers[by + ['bib', group_by]].dropna(subset=[group_by]).drop_duplicates()
+    ranked = uitslag[by + ['bib', 'plaats']].merge(riders, on=by + ['bib'], how='inner')
+    ranked['punten'] = (
+        ranked.groupby(by + [group_by], sort=False, observed=True)['plaats']
+        .rank(method='first')
+        .clip(upper=MAX_RANK_POINTS)
+        .astype(int)
+    )
+    ranked = ranked.drop_duplicates(subset=by + ['bib', group_by], keep='last')
 
-    # Sheet exists — check existing week columns
-    df = pd.read_excel(overall_path, sheet_name=sheet_name)
-    week_cols = [col for col in df.columns if str(col).isdigit()]
-    return len(week_cols) + 1
+    punten = deelnemers[by + ['bib', group_by]].merge(
+        ranked[by + ['bib', group_by, 'punten']], on=by + ['bib', group_by], how='left'
+    )['punten']
+    return pd.Series(points(punten, MAX_POINTS).to_numpy(), index=deelnemers.index, name='punten')
 
+@traced('read', file='template', engine=engine_name())
 def load_template_column_order():
-    template_df = pd.read_excel(TEMPLATE_FILE, sheet_name=0, nrows=0)
+    template_df = read_sheet(TEMPLATE_FILE, nrows=0)
     return [col for col in template_df.columns if not str(col).startswith("Unnamed")]
 
+def export_columns(columns, template_columns):
+    """Exported columns of an individual standing, in template order.
+
+    Plaats Klasse follows Klasse and the category placings follow Cat. when the
+    template lacks them; the week columns come last.
+    """
+    final_column_order = list(template_columns)
+    if 'Plaats Klasse' not in final_column_order:
+        try:
+            klasse_idx = final_column_order.index('Klasse')
+            final_column_order.insert(klasse_idx + 1, 'Plaats Klasse')
+        except ValueError:
+            final_column_order.append('Plaats Klasse')
+
+    for col in placing_columns('Plaats {}', PLACING_CATEGORIES):
+        if col not in final_column_order:
+            try:
+                cat_idx = final_column_order.index('Cat.')
+                final_column_order.insert(cat_idx + 1, col)
+            except ValueError:
+                final_column_order.append(col)
+
+    week_cols_in_output = [col for col in columns if str(col).isdigit()]
+    final_cols = final_column_order + [col for col in week_cols_in_output if col not in final_column_order]
+    return [col for col in final_cols if col in columns]
+
 def backup_deelnemers_file():
     """
-    Backup the deelnemers file to a new file with a timestamp in the filename.
+    Backup the deelnemers file in the backup store, as roster snapshot of the current run.
     """
-    backup_dir = "Deelnemers/backups"
-    os.makedirs(backup_dir, exist_ok=True)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_path = os.path.join(backup_dir, f"deelnemerslijst_2025_{timestamp}.xlsx")
-    shutil.copy(DEELNEMERS_FILE, backup_path)
+    run = get_current_backup_run()
+    backup_path = backup_store.add_snapshot(run, DEELNEMERS_FILE, f"deelnemerslijst_2025_{run}.xlsx")
+    sha = file_sha256(DEELNEMERS_FILE)
+    if not roster_history.has_version(sha):
+        roster_history.record_version(sha, load_deelnemers())
+    return backup_path
     
-def detect_klasse_wissels_met_backup():
-    backup_dir = "Deelnemers/backups"
-    if not os.path.exists(backup_dir):
-        return {}
-    
-    # Zoek de meest recente backup
-    backups = [f for f in os.listdir(backup_dir) if f.endswith('.xlsx')]
-    if not backups:
+@traced('class_changes')
+def detect_klasse_wissels_met_backup(deelnemers=None):
+    """Klasse wissels ``{bib: (oud, nieuw)}`` between the latest roster snapshot and the current roster.
+
+    Unchanged rosters are recognised by their hash; otherwise the diff comes from
+    the roster history, so each roster version is parsed at most once.
+    """
+    snapshot = backup_store.latest_snapshot(os.path.basename(DEELNEMERS_FILE))
+    if snapshot is None:
         return {}
-    
-    latest_backup = max(backups, key=lambda f: os.path.getmtime(os.path.join(backup_dir, f)))
-    backup_path = os.path.join(backup_dir, latest_backup)
-    
-     # Laad beide lijsten
-    df_now = pd.read_excel(DEELNEMERS_FILE, header=4)
-    df_now.columns = df_now.columns.str.strip().str.lower()
-    df_now = df_now.rename(columns={'number': 'bib', 'klasse': 'klasse'})
-    df_now = df_now.dropna(subset=['bib', 'klasse'])
-    df_now['bib'] = df_now['bib'].astype(int)
-
-    df_old = pd.read_excel(backup_path, header=4)
-    df_old.columns = df_old.columns.str.strip().str.lower()
-    df_old = df_old.rename(columns={'number': 'bib', 'klasse': 'klasse'})
-    df_old = df_old.dropna(subset=['bib', 'klasse'])
-    df_old['bib'] = df_old['bib'].astype(int)
-
-    # Vergelijk klasse per bib
-    merged = pd.merge(df_old[['bib', 'klasse']], df_now[['bib', 'klasse']], on='bib', suffixes=('_oud', '_nieuw'))
-    wissels = merged[merged['klasse_oud'] != merged['klasse_nieuw']]
-    return {row['bib']: (row['klasse_oud'], row['klasse_nieuw']) for _, row in wissels.iterrows()}
-
-def get_current_backup_dir():
-    """Get or create the backup directory for the current run."""
-    global _CURRENT_BACKUP_DIR
-    if _CURRENT_BACKUP_DIR is None:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        _CURRENT_BACKUP_DIR = os.path.join("output_backups", timestamp)
-        os.makedirs(_CURRENT_BACKUP_DIR, exist_ok=True)
-    return _CURRENT_BACKUP_DIR
-
-def backup_file(source_file, backup_name=None):
-    """Backup a file to the current run's backup directory."""
-    backup_dir = get_current_backup_dir()
-    if backup_name is None:
-        backup_name = os.path.basename(source_file)
-    backup_file_path = os.path.join(backup_dir, backup_name)
-    shutil.copy2(source_file, backup_file_path)
-    return backup_file_path
-
-    
\ No newline at end of file
+    current_sha = file_sha256(DEELNEMERS_FILE)
+
+    def load_roster(sha):
+        if sha == current_sha:
+            return deelnemers if deelnemers is not None else load_deelnemers()
+        with backup_store.open_snapshot(snapshot) as backup:
+            return parse_deelnemers(io.BytesIO(backup.read()))
+
+    return roster_history.class_changes(snapshot['sha256'], current_sha, load_roster)
+
+def get_current_backup_run():
+    """Get or create the backup run id for the current run."""
+    global _CURRENT_BACKUP_RUN
+    if _CURRENT_BACKUP_RUN is None:
+        _CURRENT_BACKUP_RUN = backup_store.new_run_id()
+    return _CURRENT_BACKUP_RUN
+
+def set_current_backup_run(run):
+    """Use an existing backup run for this process, e.g. the one of the parent process."""
+    global _CURRENT_BACKUP_RUN
+    _CURRENT_BACKUP_RUN = run
+
+@traced('backup')
+def backup_file(source_file, backup_name=None, week=None):
+    """Backup a file in the current run's manifest of the backup store; returns the blob path."""
+    return backup_store.add_snapshot(get_current_backup_run(), source_file, backup_name, week)
@@ -0,0 +1,214 @@
+import argparse
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import backup_store
+from utils import backup_deelnemers_file, set_current_backup_run, DEELNEMERS_FILE, RESULT_FILE
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# The watcher runs the weekly update as soon as a result arrives: on new mail in
+# the inbox check_mail reads (IMAP IDLE) or when the files in Result/ or
+# Deelnemers/ change. After a change in Deelnemers/ the roster put there is used
+# and not downloaded. The second period flag comes from IS_SECOND_PERIOD_STARTED
+# in .env, read again before every run. File changes are polled every
+# POLL_SECONDS; with watchdog installed (inotify) a change wakes the watcher at once.
+WATCHED_FOLDERS = (os.path.dirname(RESULT_FILE), os.path.dirname(DEELNEMERS_FILE))
+POLL_SECONDS = 1.0
+# Servers drop an IDLE connection after 30 minutes, so it is renewed before that
+IDLE_RENEW_SECONDS = 29 * 60
+RECONNECT_SECONDS = 30
+
+def is_second_period_started():
+    load_dotenv(override=True)
+    return os.environ.get('IS_SECOND_PERIOD_STARTED', 'False').lower() == 'true'
+
+def folder_signature(folders=WATCHED_FOLDERS):
+    """``{path: (mtime, size)}`` of the Excel files directly in ``folders``."""
+    signature = {}
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.xlsx'):
+                    stat = entry.stat()
+                    signature[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return signature
+
+class MailboxIdler(threading.Thread):
+    """Keeps an IMAP IDLE command running on the inbox and reports new mail.
+
+    ``connect`` returns a logged-in imaplib connection. The thread blocks on the
+    connection and sets ``wake`` when the server announces a new message; the
+    owner calls ``renew_if_due`` now and then so the IDLE never times out.
+    """
+
+    def __init__(self, connect, wake):
+        super().__init__(daemon=True)
+        self.connect = connect
+        self.wake = wake
+        self.new_mail = threading.Event()
+        self._lock = threading.Lock()
+        self._mail = None
+        self._idling_since = None
+        self._tags = 0
+
+    def run(self):
+        while True:
+            try:
+                mail = self.connect()
+                mail.select("inbox", readonly=True)
+                # IDLE waits for as long as there is no mail, without a read timeout
+                mail.sock.settimeout(None)
+                self._mail = mail
+                while True:
+                    self._idle(mail)
+            except Exception as e:
+                logger.warning(f"⚠️ Mailbox connection lost ({e}), reconnecting in {RECONNECT_SECONDS}s")
+                self._mail = None
+                time.sleep(RECONNECT_SECONDS)
+
+    def _idle(self, mail):
+        """One IDLE command, until the server ends it after a DONE."""
+        self._tags += 1
+        tag = f"IDLE{self._tags}".encode()
+        mail.send(tag + b" IDLE\r\n")
+        line = mail.readline()
+        if not line.startswith(b"+"):
+            raise RuntimeError(f"IDLE refused: {line!r}")
+        with self._lock:
+            self._idling_since = time.monotonic()
+        while True:
+            line = mail.readline()
+            if not line:
+                raise ConnectionError("connection closed by the server")
+            if line.startswith(tag + b" "):
+                return
+            if line.rstrip().upper().endswith(b"EXISTS"):
+                logger.info("📬 New mail in the mailbox")
+                self.new_mail.set()
+                self.wake.set()
+                self._done()
+
+    def _done(self):
+        """End the running IDLE; the thread starts a new one."""
+        with self._lock:
+            if self._idling_since is not None and self._mail is not None:
+                self._mail.send(b"DONE\r\n")
+                self._idling_since = None
+
+    def renew_if_due(self):
+        with self._lock:
+            due = self._idling_since is not None and time.monotonic() - self._idling_since > IDLE_RENEW_SECONDS
+        if due:
+            self._done()
+
+    def take_new_mail(self):
+        """Whether new mail arrived since the last call."""
+        if self.new_mail.is_set():
+            self.new_mail.clear()
+            return True
+        return False
+
+def _watch_folders(wake):
+    """Wake the watcher on file events in the watched folders (needs watchdog)."""
+    if Observer is None:
+        return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            wake.set()
+
+    observer = Observer()
+    for folder in WATCHED_FOLDERS:
+        os.makedirs(folder, exist_ok=True)
+        observer.schedule(Handler(), folder, recursive=False)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+def run_update(parallel=False, write_stage_workbooks=False, require_new_mail=True, download_roster=True):
+    """Run the weekly update once, as ``generate_all.py --in-process`` would. Errors are logged, not raised."""
+    from pipeline import run_pipeline
+    # Every update is its own backup run
+    set_current_backup_run(backup_store.new_run_id())
+    try:
+        updated = run_pipeline(is_second_period_started(), parallel=parallel,
+                               write_stage_workbooks=write_stage_workbooks, require_new_mail=require_new_mail,
+                               download_roster=download_roster)
+        if updated:
+            backup_deelnemers_file()
+            logger.info("✅ Standings updated.")
+        return updated
+    except Exception as e:
+        logger.error(f"❌ Update failed: {e}")
+        return False
+
+def roster_changed(before, after):
+    """Whether a roster file differs between two folder signatures."""
+    roster_folder = os.path.dirname(DEELNEMERS_FILE)
+    changed = set(before.items()) ^ set(after.items())
+    return any(os.path.dirname(path) == roster_folder for path, _ in changed)
+
+def watch(parallel=False, write_stage_workbooks=False, idle=True, poll=POLL_SECONDS, connect=None, stop=None):
+    """Watch the mailbox and the input folders and run the update whenever a result arrives.
+
+    Runs until ``stop`` (a threading.Event) is set, or forever without one.
+    """
+    wake = threading.Event()
+    idler = None
+    if idle:
+        if connect is None:
+            from check_mail import connect_mailbox as connect
+        idler = MailboxIdler(connect, wake)
+        idler.start()
+    observer = _watch_folders(wake)
+    logger.info(f"👀 Watching {'the mailbox and ' if idle else ''}{', '.join(WATCHED_FOLDERS)}"
+                f"{' (inotify)' if observer else ''}")
+
+    # Mail that arrived while the watcher was not running
+    run_update(parallel, write_stage_workbooks)
+    signature = folder_signature()
+    while stop is None or not stop.is_set():
+        wake.wait(poll)
+        wake.clear()
+        if idler is not None:
+            idler.renew_if_due()
+        new_mail = idler is not None and idler.take_new_mail()
+        current = folder_signature()
+        if current != signature:
+            # Let a file that is being copied settle first
+            time.sleep(poll)
+            while folder_signature() != current:
+                current = folder_signature()
+                time.sleep(poll)
+        if new_mail or current != signature:
+            # A roster put in place by hand must not be overwritten by the download
+            run_update(parallel, write_stage_workbooks, require_new_mail=current == signature,
+                       download_roster=not roster_changed(signature, current))
+            # The update itself rewrites the roster and the result; those writes do not count as changes
+            signature = folder_signature()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Update the standings whenever a new result arrives.")
+    parser.add_argument('--parallel', action='store_true', help="run independent stages concurrently")
+    parser.add_argument('--stage-workbooks', action='store_true',
+                        help="also write the per-standing workbooks in output/")
+    parser.add_argument('--no-idle', action='store_true', help="only watch the folders, not the mailbox")
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS,
+                        help="seconds between checks of the folders (default: %(default)s)")
+    args = parser.parse_args()
+    watch(args.parallel, args.stage_workbooks, idle=not args.no_idle, poll=args.poll)